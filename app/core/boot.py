@@ -0,0 +1,164 @@
+"""
+Staggered VM starts (boot-storm control).
+
+Starting a whole lab, or every VM of the cluster, used to post every start at once; the burst of
+guest boots saturated the shared storage and every VM booted slowly. All starts now go through
+one BootScheduler per worker, which:
+
+* limits the boots in flight per node (BOOT_CONCURRENCY_PER_NODE) and per storage holding the
+  VM's disks (BOOT_CONCURRENCY_PER_STORAGE). A boot holds its slots until its start task has
+  finished, plus the VM's `startup: up=N` delay if it has one;
+* samples each node's CPU and IO wait from /nodes/{node}/status at most every
+  BOOT_PRESSURE_INTERVAL seconds and adapts that node's limit: halved while IO wait is above
+  BOOT_IOWAIT_HIGH or CPU above BOOT_CPU_HIGH, then raised by one per calm sample;
+* starts a group of VMs in priority order, the way Proxmox orders onboot starts: VMs with a
+  lower `startup: order=N` boot first, and a VM only boots once every VM of its group with a
+  lower order has. VMs without an order can be ranked by name with BOOT_PRIORITY, a
+  comma-separated list of name patterns (e.g. "router,dc"); the rest start last.
+"""
+import os
+import re
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from app.core.metrics import JOB_QUEUE_DEPTH
+from app.core.tasks import is_upid, wait_for_task
+
+logger = logging.getLogger("proxmox_api")
+
+BOOT_CONCURRENCY_PER_NODE = int(os.getenv("BOOT_CONCURRENCY_PER_NODE", "3"))
+BOOT_CONCURRENCY_PER_STORAGE = int(os.getenv("BOOT_CONCURRENCY_PER_STORAGE", "6"))
+BOOT_IOWAIT_HIGH = float(os.getenv("BOOT_IOWAIT_HIGH", "0.15"))
+BOOT_CPU_HIGH = float(os.getenv("BOOT_CPU_HIGH", "0.9"))
+BOOT_PRESSURE_INTERVAL = float(os.getenv("BOOT_PRESSURE_INTERVAL", "1"))
+BOOT_PRIORITY = [pattern.strip().lower() for pattern in os.getenv("BOOT_PRIORITY", "").split(",") if pattern.strip()]
+
+# Order of VMs with neither a startup order nor a BOOT_PRIORITY match: after all the others.
+UNORDERED = 10 ** 6
+
+def startup_options(config: dict) -> dict:
+    """The `startup` option of a VM config ("order=1,up=30") as {"order": 1, "up": 30}."""
+    options = {}
+    for part in str(config.get('startup', '')).split(','):
+        match = re.match(r"(order|up|down)=(\d+)$", part.strip())
+        if match:
+            options[match.group(1)] = int(match.group(2))
+    return options
+
+def boot_priority(name: str, config: dict) -> int:
+    """Lower boots first: the startup order, else 1 + the index of the first BOOT_PRIORITY pattern in the name."""
+    options = startup_options(config)
+    if "order" in options:
+        return options["order"]
+    name = (name or '').lower()
+    for index, pattern in enumerate(BOOT_PRIORITY):
+        if pattern in name:
+            return index + 1
+    return UNORDERED
+
+class BootBatch:
+    """A group of VMs started together: each boots only after every VM with a lower priority has."""
+    def __init__(self, priorities: dict):
+        self._pending = dict(priorities)
+        self._cond = threading.Condition()
+
+    def wait_turn(self, vmid: int):
+        priority = self._pending.get(vmid)
+        if priority is None:
+            return
+        with self._cond:
+            self._cond.wait_for(lambda: not any(other < priority for other_vmid, other in self._pending.items() if other_vmid != vmid))
+
+    def done(self, vmid: int):
+        """Marks a VM as booted (or failed, or skipped) so the next priority can go."""
+        with self._cond:
+            self._pending.pop(vmid, None)
+            self._cond.notify_all()
+
+class BootScheduler:
+    def __init__(self, node_limit: int = BOOT_CONCURRENCY_PER_NODE, storage_limit: int = BOOT_CONCURRENCY_PER_STORAGE):
+        self.node_limit = node_limit
+        self.storage_limit = storage_limit
+        self._cond = threading.Condition()
+        self._active = {}
+        # node -> current (adapted) limit
+        self._limits = {}
+        # node -> time.monotonic() of the last pressure sample
+        self._sampled_at = {}
+        self._sample_lock = threading.Lock()
+
+    def _sample(self, proxmox, node: str):
+        """Re-reads a node's CPU and IO wait when the last sample is older than BOOT_PRESSURE_INTERVAL and adapts its limit."""
+        with self._sample_lock:
+            if time.monotonic() - self._sampled_at.get(node, 0.0) < BOOT_PRESSURE_INTERVAL:
+                return
+            self._sampled_at[node] = time.monotonic()
+        try:
+            status = proxmox.nodes(node).status.get()
+        except Exception as e:
+            logger.warning(f"Could not read the load of node {node}, keeping its boot limit: {e}")
+            return
+        cpu, iowait = float(status.get('cpu') or 0), float(status.get('wait') or 0)
+        with self._cond:
+            limit = self._limits.get(node, self.node_limit)
+            if iowait > BOOT_IOWAIT_HIGH or cpu > BOOT_CPU_HIGH:
+                new_limit = max(1, limit // 2)
+            else:
+                new_limit = min(self.node_limit, limit + 1)
+            if new_limit != limit:
+                logger.info(f"Boot limit of node {node} now {new_limit} (cpu {cpu:.2f}, iowait {iowait:.2f}).")
+            self._limits[node] = new_limit
+            self._cond.notify_all()
+
+    def _fits(self, node: str, storages) -> bool:
+        if self._active.get("node:{}".format(node), 0) >= self._limits.get(node, self.node_limit):
+            return False
+        return all(self._active.get("storage:{}".format(storage), 0) < self.storage_limit for storage in storages)
+
+    @contextmanager
+    def slot(self, proxmox, node: str, storages=()):
+        """Holds a boot slot on `node` and on each storage while the block runs."""
+        keys = ["node:{}".format(node)] + ["storage:{}".format(storage) for storage in storages]
+        queued = False
+        while True:
+            self._sample(proxmox, node)
+            with self._cond:
+                if self._fits(node, storages):
+                    for key in keys:
+                        self._active[key] = self._active.get(key, 0) + 1
+                    break
+                if not queued:
+                    queued = True
+                    JOB_QUEUE_DEPTH.labels("boot_wait").inc()
+                self._cond.wait(timeout=BOOT_PRESSURE_INTERVAL)
+        if queued:
+            JOB_QUEUE_DEPTH.labels("boot_wait").dec()
+        try:
+            yield
+        finally:
+            with self._cond:
+                for key in keys:
+                    self._active[key] -= 1
+                self._cond.notify_all()
+
+    def boot(self, proxmox, node: str, vmid: int, storages=(), settle: int = 0, batch: BootBatch = None):
+        """
+        Starts one VM once its turn in `batch` and a slot come up. Returns the start task after it
+        finished and `settle` seconds (the VM's `startup: up=N`) passed.
+        """
+        if batch is not None:
+            batch.wait_turn(vmid)
+        try:
+            with self.slot(proxmox, node, storages):
+                upid = proxmox.nodes(node).qemu(vmid).status.start.post()
+                if is_upid(upid):
+                    wait_for_task(proxmox, node, upid)
+                if settle:
+                    time.sleep(settle)
+                return upid
+        finally:
+            if batch is not None:
+                batch.done(vmid)
+
+boot_scheduler = BootScheduler()
@@ -0,0 +1,118 @@
+"""
+Bulk VM actions.
+
+Every VM of a bulk request is resolved to its node from one /cluster/resources read, then acted
+on concurrently. Actions on one node share a per-node limit (BULK_CONCURRENCY_PER_NODE, across
+all bulk requests of the worker), so a large list does not flood a single node with tasks. With
+`wait`, each VM's slot is held until its task has finished, and the result carries the task's
+exit status. Starts are handed to the boot scheduler (app/core/boot.py) instead, which staggers
+them by node load and startup order; without `wait` they are queued and run in the background.
+"""
+import os
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from app.core.inventory import cluster_resources, vm_node_index
+from app.core.lab_pipeline import start_vms, start_vms_in_background
+from app.core.tasks import KeyedLimiter, is_upid, submit, wait_for_task
+from app.core.vm_index import vm_index
+
+logger = logging.getLogger("proxmox_api")
+
+BULK_CONCURRENCY_PER_NODE = int(os.getenv("BULK_CONCURRENCY_PER_NODE", "4"))
+BULK_MAX_WORKERS = int(os.getenv("BULK_MAX_WORKERS", "32"))
+
+bulk_limiter = KeyedLimiter(BULK_CONCURRENCY_PER_NODE)
+
+def _stop(proxmox, vm, snapname):
+    if vm['status'] == 'stopped':
+        return None
+    return proxmox.nodes(vm['node']).qemu(vm['vmid']).status.stop.post()
+
+def _shutdown(proxmox, vm, snapname):
+    if vm['status'] == 'stopped':
+        return None
+    return proxmox.nodes(vm['node']).qemu(vm['vmid']).status.shutdown.post()
+
+def _delete(proxmox, vm, snapname):
+    api = proxmox.nodes(vm['node']).qemu(vm['vmid'])
+    if vm['status'] == 'running':
+        # A running VM cannot be destroyed; its stop has to finish first.
+        upid = api.status.stop.post()
+        if is_upid(upid):
+            wait_for_task(proxmox, vm['node'], upid)
+    upid = api.delete()
+    vm_node_index.forget(vm['vmid'])
+    return upid
+
+def _snapshot(proxmox, vm, snapname):
+    return proxmox.nodes(vm['node']).qemu(vm['vmid']).snapshot.post(snapname=snapname)
+
+def _rollback(proxmox, vm, snapname):
+    upid = proxmox.nodes(vm['node']).qemu(vm['vmid']).snapshot(snapname).rollback.post()
+    vm_index.forget(vm['vmid'])
+    return upid
+
+# action -> fn(proxmox, vm resource, snapname) returning the task UPID, or None when there is nothing to do.
+# Starts go through the boot scheduler instead.
+ACTIONS = {
+    "start": None,
+    "stop": _stop,
+    "shutdown": _shutdown,
+    "delete": _delete,
+    "snapshot": _snapshot,
+    "rollback": _rollback,
+}
+SNAPSHOT_ACTIONS = ("snapshot", "rollback")
+
+def _run_one(proxmox, action: str, vm: dict, snapname: str, wait: bool) -> dict:
+    result = {"vmid": vm['vmid'], "name": vm.get('name'), "node": vm['node']}
+    try:
+        with bulk_limiter.limit("node:{}".format(vm['node'])):
+            upid = ACTIONS[action](proxmox, vm, snapname)
+            if upid is None:
+                return {**result, "result": "skipped", "detail": "VM is already {}.".format(vm['status'])}
+            result["task_id"] = upid
+            if wait and is_upid(upid):
+                wait_for_task(proxmox, vm['node'], upid)
+        return {**result, "result": "ok"}
+    except Exception as e:
+        logger.warning(f"Bulk {action} of VM {vm['vmid']} failed: {e}")
+        return {**result, "result": "error", "detail": str(e)}
+
+def run_bulk(proxmox, action: str, vmids: list, snapname: str = None, wait: bool = False, vms: list = None) -> list:
+    """
+    Runs `action` on every VM of `vmids` and returns one result per VM, in order. `vms` may
+    pass /cluster/resources qemu entries already read by the caller; otherwise they are read
+    once, fresh, here.
+    """
+    if vms is None:
+        vms = cluster_resources.vms(proxmox, max_age=0)
+    by_id = {vm['vmid']: vm for vm in vms}
+    results = [None] * len(vmids)
+    jobs = []
+    for position, vmid in enumerate(vmids):
+        vm = by_id.get(vmid)
+        if vm is None:
+            results[position] = {"vmid": vmid, "result": "not_found", "detail": "VM with ID {} not found.".format(vmid)}
+        elif vm.get('template') == 1 and action != "delete":
+            results[position] = {"vmid": vmid, "name": vm.get('name'), "node": vm['node'], "result": "error", "detail": "VM {} is a template.".format(vmid)}
+        else:
+            jobs.append((position, vm))
+    if jobs and action == "start":
+        started = (start_vms if wait else start_vms_in_background)(proxmox, [vm for _, vm in jobs])
+        for (position, _), result in zip(jobs, started):
+            results[position] = result
+    elif jobs:
+        with ThreadPoolExecutor(max_workers=min(BULK_MAX_WORKERS, len(jobs))) as executor:
+            futures = [(position, submit(executor, _run_one, proxmox, action, vm, snapname, wait, queue="bulk_vm")) for position, vm in jobs]
+            for position, future in futures:
+                results[position] = future.result()
+    if jobs:
+        cluster_resources.invalidate()
+    return results
+
+def summarize(results: list) -> dict:
+    summary = {"ok": 0, "queued": 0, "skipped": 0, "error": 0, "not_found": 0}
+    for result in results:
+        summary[result["result"]] += 1
+    return summary
@@ -0,0 +1,128 @@
+"""
+Template catalog.
+
+A per-worker index of every template: its lab groups (from its tags, see app/core/lab_tags.py),
+its footprint (vCPUs, memory, disks) and its NIC layout, plus per lab group the list of templates
+and their summed footprint. It backs GET /templates, the capacity plan and lab instantiation,
+which used to read and parse the config of every VM to find a group's templates.
+
+The index is refreshed incrementally from the cached /cluster/resources listing: a template is
+re-read only when it is new or its node, tags, name or size there changed, and every template is
+re-read when the index is older than CATALOG_MAX_AGE (NIC edits do not show in the listing).
+tag_template and tag_vm record the tags they write straight away.
+"""
+import os
+import time
+import logging
+import threading
+from app.core.lab_tags import lab_vms, parse
+from app.core.metrics import record_cache_lookup
+from app.core.planner import footprint
+from app.core.tasks import map_concurrent
+from app.core.vm_records import parse_config
+
+logger = logging.getLogger("proxmox_api")
+
+CATALOG_MAX_AGE = float(os.getenv("CATALOG_MAX_AGE", "300"))
+
+def _signature(vm: dict) -> tuple:
+    """The fields of a /cluster/resources entry that change when the template does."""
+    return (vm.get('node'), vm.get('name'), vm.get('tags') or '', vm.get('maxcpu'), vm.get('maxmem'), vm.get('maxdisk'))
+
+class TemplateCatalog:
+    def __init__(self, max_age: float = CATALOG_MAX_AGE):
+        self.max_age = max_age
+        # vmid -> entry (see _entry)
+        self._templates = {}
+        # lab group -> {"templates": [vmid, ...], "footprint": totals, "nics": count}
+        self._groups = {}
+        self._built_at = 0.0
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+
+    def _entry(self, summary: dict, config: dict) -> dict:
+        record = parse_config(config)
+        needs = footprint(record)
+        return {
+            "vmid": summary['vmid'],
+            "name": summary.get('name'),
+            "node": summary['node'],
+            "lab_groups": parse(config.get('tags')).get('lab_groups', []),
+            "replica": "TemplateReplica:" in config.get('description', ''),
+            "footprint": {"cpus": needs["cpus"], "memory_mb": needs["memory_mb"], "disk_gb": sum(size for _, size in needs["disks"])},
+            "disks": [{"device": disk.device, "storage": disk.storage, "size_gb": disk.size_gb} for disk in record.disks],
+            "nics": [{"device": nic.device, "model": nic.model, "bridge": nic.bridge} for nic in record.nics],
+            "summary": summary,
+            "config": config,
+            "record": record,
+            "signature": _signature(summary),
+        }
+
+    def _index_groups(self):
+        groups = {}
+        for vmid, entry in sorted(self._templates.items()):
+            if entry["replica"]:
+                continue
+            for group in entry["lab_groups"]:
+                index = groups.setdefault(group, {"templates": [], "footprint": {"vms": 0, "cpus": 0, "memory_mb": 0, "disk_gb": 0}, "nics": 0})
+                index["templates"].append(vmid)
+                index["footprint"]["vms"] += 1
+                for key in ("cpus", "memory_mb", "disk_gb"):
+                    index["footprint"][key] += entry["footprint"][key]
+                index["nics"] += len(entry["nics"])
+        self._groups = groups
+
+    def refresh(self, proxmox, max_age: float = None, vms: list = None):
+        """
+        Brings the index up to date with the cached /cluster/resources listing (at most `max_age`
+        seconds old), or with `vms`, lab_vms() entries already read by the caller.
+        """
+        if vms is None:
+            vms = lab_vms(proxmox, max_age)
+        templates = {vm['vmid']: vm for vm in vms if vm.get('template') == 1}
+        with self._refresh_lock:
+            with self._lock:
+                expired = time.monotonic() - self._built_at > self.max_age
+                stale = [vm for vmid, vm in templates.items()
+                         if expired or vmid not in self._templates or self._templates[vmid]["signature"] != _signature(vm)]
+                removed = set(self._templates) - set(templates)
+            record_cache_lookup("template_catalog", not stale and not removed)
+            if not stale and not removed:
+                return self
+            started = time.monotonic()
+            configs = map_concurrent(lambda vm: proxmox.nodes(vm['node']).qemu(vm['vmid']).config.get(), stale)
+            entries = [self._entry(vm, config) for vm, config in zip(stale, configs)]
+            with self._lock:
+                for vmid in removed:
+                    self._templates.pop(vmid, None)
+                for entry in entries:
+                    self._templates[entry["vmid"]] = entry
+                if expired:
+                    self._built_at = started
+                self._index_groups()
+        logger.info(f"Template catalog refreshed: {len(entries)} template(s) read, {len(removed)} removed.")
+        return self
+
+    def record(self, vmid: int, config: dict, tags: str):
+        """Applies tags just written to a template (a no-op for VMs the catalog does not hold)."""
+        with self._lock:
+            entry = self._templates.get(vmid)
+            if entry is None:
+                return
+            config = {**config, "tags": tags}
+            entry.update(config=config, lab_groups=parse(tags).get('lab_groups', []), replica="TemplateReplica:" in config.get('description', ''),
+                         summary={**entry["summary"], "tags": tags}, signature=entry["signature"][:2] + (tags,) + entry["signature"][3:])
+            self._index_groups()
+
+    def groups(self) -> dict:
+        with self._lock:
+            return {group: {**index, "templates": list(index["templates"])} for group, index in self._groups.items()}
+
+    def templates(self, lab_group: str = None) -> list:
+        """The entries of every template (except replicas), or of the templates of `lab_group`."""
+        with self._lock:
+            if lab_group is None:
+                return [entry for _, entry in sorted(self._templates.items()) if not entry["replica"]]
+            return [self._templates[vmid] for vmid in self._groups.get(lab_group, {}).get("templates", [])]
+
+template_catalog = TemplateCatalog()
@@ -0,0 +1,131 @@
+"""
+Response compression.
+
+Responses of at least COMPRESS_MIN_SIZE bytes are compressed for clients that accept it:
+Brotli when the `brotli` package is installed and the client sends "br" in Accept-Encoding,
+gzip otherwise. Smaller bodies, event streams and responses that already carry a
+Content-Encoding are sent as they are. Large inventories (/vms, /dashboard) compress to a small
+fraction of their size, and nginx passes the encoded body through.
+
+The body reaches this middleware in several parts (the request tracing middleware streams it),
+so parts are buffered until the threshold is reached or the body ends before deciding.
+"""
+import os
+import zlib
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESS_MIN_SIZE = int(os.getenv("COMPRESS_MIN_SIZE", "1024"))
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "6"))
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", "4"))
+
+def accepts(headers: Headers, encoding: str) -> bool:
+    """Whether Accept-Encoding lists `encoding` (with a non-zero q)."""
+    for part in headers.get("accept-encoding", "").split(","):
+        name, _, params = part.partition(";")
+        if name.strip() != encoding:
+            continue
+        quality = params.strip()
+        try:
+            return not quality.startswith("q=") or float(quality[2:]) > 0
+        except ValueError:
+            return False
+    return False
+
+class GzipCompressor:
+    def __init__(self, level: int):
+        # wbits 31: gzip header and trailer
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes, final: bool) -> bytes:
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_FINISH if final else zlib.Z_SYNC_FLUSH)
+
+class BrotliCompressor:
+    def __init__(self, quality: int):
+        self._compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data: bytes, final: bool) -> bytes:
+        return self._compressor.process(data) + (self._compressor.finish() if final else self._compressor.flush())
+
+class CompressionResponder:
+    def __init__(self, app: ASGIApp, minimum_size: int, encoding: str, compressor):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.encoding = encoding
+        self.compressor = compressor
+        self.send = None
+        # The http.response.start message and body parts, held until it is decided whether to compress
+        self.initial_message = None
+        self.buffered = []
+        self.buffered_size = 0
+        self.compressing = False
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        self.send = send
+        await self.app(scope, receive, self.send_compressed)
+
+    async def _start(self, compress: bool, final: bool):
+        initial_message, body = self.initial_message, b"".join(self.buffered)
+        self.initial_message, self.buffered = None, []
+        self.compressing = compress
+        if compress:
+            headers = MutableHeaders(raw=initial_message["headers"])
+            headers.add_vary_header("Accept-Encoding")
+            headers["Content-Encoding"] = self.encoding
+            body = self.compressor.compress(body, final)
+            if final:
+                headers["Content-Length"] = str(len(body))
+            elif "content-length" in headers:
+                del headers["Content-Length"]
+        await self.send(initial_message)
+        await self.send({"type": "http.response.body", "body": body, "more_body": not final})
+
+    async def send_compressed(self, message: Message):
+        if message["type"] == "http.response.start":
+            headers = Headers(raw=message["headers"])
+            if "content-encoding" in headers or headers.get("content-type", "").startswith("text/event-stream"):
+                await self.send(message)
+            else:
+                self.initial_message = message
+            return
+        if message["type"] != "http.response.body":
+            if self.initial_message is not None:
+                await self._start(False, False)
+            await self.send(message)
+            return
+        body, more_body = message.get("body", b""), message.get("more_body", False)
+        if self.initial_message is None:
+            if self.compressing:
+                message["body"] = self.compressor.compress(body, not more_body)
+            await self.send(message)
+            return
+        self.buffered.append(body)
+        self.buffered_size += len(body)
+        if self.buffered_size >= self.minimum_size or not more_body:
+            await self._start(self.buffered_size >= self.minimum_size, not more_body)
+
+class CompressionMiddleware:
+    def __init__(self, app: ASGIApp, minimum_size: int = COMPRESS_MIN_SIZE, gzip_level: int = GZIP_LEVEL, brotli_quality: int = BROTLI_QUALITY):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = Headers(scope=scope)
+        if brotli is not None and accepts(headers, "br"):
+            responder = CompressionResponder(self.app, self.minimum_size, "br", BrotliCompressor(self.brotli_quality))
+        elif accepts(headers, "gzip"):
+            responder = CompressionResponder(self.app, self.minimum_size, "gzip", GzipCompressor(self.gzip_level))
+        else:
+            await self.app(scope, receive, send)
+            return
+        await responder(scope, receive, send)
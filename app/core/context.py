@@ -0,0 +1,16 @@
+import uuid
+from contextvars import ContextVar
+
+# Request-scoped values. The middleware in app.main sets these at the start of
+# every request; sync route handlers run in a threadpool that copies the context,
+# so they (and the log records they emit) see the same values.
+request_id_var: ContextVar[str] = ContextVar("request_id", default="-")
+
+
+def new_request_id() -> str:
+    """Returns a short random ID used to correlate log lines of one request."""
+    return uuid.uuid4().hex[:16]
+
+
+def get_request_id() -> str:
+    return request_id_var.get()
@@ -0,0 +1,143 @@
+import os
+import time
+import logging
+import threading
+from app.core.metrics import record_cache_lookup
+
+logger = logging.getLogger("proxmox_api")
+
+INVENTORY_TTL = float(os.getenv("INVENTORY_TTL", "5"))
+VM_INDEX_MAX_AGE = float(os.getenv("VM_INDEX_MAX_AGE", "300"))
+VM_INDEX_MISS_INTERVAL = float(os.getenv("VM_INDEX_MISS_INTERVAL", "1"))
+
+class ClusterResources:
+    """
+    Per-worker cache of GET /cluster/resources, the one call that returns every node, VM and
+    storage of the cluster. Readers within `ttl` seconds share a snapshot, and concurrent
+    misses wait for a single refresh instead of each issuing the call.
+    """
+    def __init__(self, ttl: float = INVENTORY_TTL):
+        self.ttl = ttl
+        self._resources = None
+        self._fetched_at = 0.0
+        # Bumped by every invalidate(), i.e. after every change this worker makes through the API
+        self._generation = 0
+        self._listeners = []
+        self._lock = threading.Lock()
+
+    def subscribe(self, listener):
+        """Has `listener(resources, fetched_at)` called with every snapshot fetched from now on."""
+        self._listeners.append(listener)
+
+    def get(self, proxmox, max_age: float = None) -> list:
+        max_age = self.ttl if max_age is None else max_age
+        with self._lock:
+            fresh = self._resources is not None and time.monotonic() - self._fetched_at <= max_age
+            record_cache_lookup("cluster_resources", fresh)
+            if not fresh:
+                self._resources = proxmox.cluster.resources.get()
+                self._fetched_at = time.monotonic()
+                vm_node_index.update(self._resources, self._fetched_at)
+                for listener in self._listeners:
+                    listener(self._resources, self._fetched_at)
+            return self._resources
+
+    @property
+    def fetched_at(self) -> float:
+        """time.monotonic() of the current snapshot."""
+        return self._fetched_at
+
+    @property
+    def generation(self) -> int:
+        """Changes whenever the cache is invalidated; data derived from VM configs is only valid within one generation."""
+        return self._generation
+
+    def invalidate(self):
+        with self._lock:
+            self._resources = None
+            self._generation += 1
+
+    def nodes(self, proxmox, max_age: float = None) -> list:
+        return [entry for entry in self.get(proxmox, max_age) if entry.get('type') == 'node']
+
+    def vms(self, proxmox, max_age: float = None) -> list:
+        return [entry for entry in self.get(proxmox, max_age) if entry.get('type') == 'qemu']
+
+    def storages(self, proxmox, max_age: float = None) -> list:
+        return [entry for entry in self.get(proxmox, max_age) if entry.get('type') == 'storage']
+
+cluster_resources = ClusterResources()
+
+class VmNodeIndex:
+    """
+    Per-worker vmid -> node index for single-VM endpoints, so they no longer list the whole
+    cluster to find one VM. It is rebuilt from every /cluster/resources snapshot fetched in the
+    worker, kept up to date by the code that creates, migrates and deletes VMs (record/forget),
+    and refreshed on a lookup miss (at most every VM_INDEX_MISS_INTERVAL seconds) or when it is
+    older than VM_INDEX_MAX_AGE. A failed call on a VM invalidates its entry, so a VM migrated
+    outside this API is looked up again on the next request.
+    """
+    def __init__(self, max_age: float = VM_INDEX_MAX_AGE, miss_interval: float = VM_INDEX_MISS_INTERVAL):
+        self.max_age = max_age
+        self.miss_interval = miss_interval
+        self._nodes = {}
+        # vmids whose entry proved wrong; their next lookup refreshes regardless of the miss interval
+        self._invalidated = set()
+        self._refreshed_at = 0.0
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+
+    def update(self, resources: list, fetched_at: float):
+        """Replaces the index with the VMs of a /cluster/resources listing taken at `fetched_at`."""
+        nodes = {entry['vmid']: entry['node'] for entry in resources if entry.get('type') == 'qemu'}
+        with self._lock:
+            if fetched_at >= self._refreshed_at:
+                self._nodes = nodes
+                self._invalidated.clear()
+                self._refreshed_at = fetched_at
+
+    def record(self, vmid: int, node: str):
+        with self._lock:
+            self._nodes[vmid] = node
+
+    def forget(self, vmid: int):
+        """Drops a VM this worker deleted."""
+        with self._lock:
+            self._nodes.pop(vmid, None)
+
+    def invalidate(self, vmid: int):
+        """Drops an entry that may be wrong (a call on the VM failed); the next lookup re-reads the cluster."""
+        with self._lock:
+            self._nodes.pop(vmid, None)
+            self._invalidated.add(vmid)
+
+    def _refresh(self, proxmox):
+        fetched_at = time.monotonic()
+        try:
+            resources = proxmox.cluster.resources.get(type='vm')
+        except Exception:
+            resources = []
+            for node in proxmox.nodes.get():
+                resources.extend({**vm, 'type': 'qemu', 'node': node['node']} for vm in proxmox.nodes(node['node']).qemu.get())
+        self.update(resources, fetched_at)
+
+    def lookup(self, proxmox, vmid: int):
+        """The node of `vmid`, or None when the cluster has no such VM."""
+        with self._lock:
+            fresh = time.monotonic() - self._refreshed_at <= self.max_age
+            node = self._nodes.get(vmid) if fresh else None
+        record_cache_lookup("vm_node", node is not None)
+        if node is not None:
+            return node
+        # Concurrent misses share one refresh; a burst of lookups for unknown VMs refreshes once per interval.
+        with self._refresh_lock:
+            with self._lock:
+                age = time.monotonic() - self._refreshed_at
+                node = self._nodes.get(vmid)
+                suspect = vmid in self._invalidated
+            if age > self.max_age or (node is None and (suspect or age > self.miss_interval)):
+                self._refresh(proxmox)
+        with self._lock:
+            return self._nodes.get(vmid)
+
+vm_node_index = VmNodeIndex()
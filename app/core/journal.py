@@ -0,0 +1,290 @@
+"""
+Durable journal of multi-step lab operations.
+
+Instantiating or deleting a lab is a VNET plus one pipeline per member VM; a failure part way
+used to leave the lab half built (or half deleted) with no record of what had been done. Every
+such operation is now written to the lab_operations table with one lab_operation_steps row per
+step, planned up front, before anything is created. Steps move from "pending" to "done" or
+"failed", and a clone step also records the pipeline stage it reached (see
+lab_pipeline.CLONE_STAGES), so a resume picks up inside a pipeline instead of re-cloning.
+
+An operation that failed (or whose worker died, leaving it "running") can be resumed, which
+runs only the steps that are not done, or, for an instantiation, rolled back, which deletes the
+clones and the VNET and restores the VMs that were added to the lab (description, tags, NIC and power state).
+"""
+import json
+import logging
+import threading
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from app import models
+from app.database import SessionLocal
+from app.core.inventory import cluster_resources
+from app.core.lab_tags import instance_name, parse as parse_tags, tag_update
+from app.core.lab_pipeline import provision_clone, provision_existing, remove_vm, wait_for_sdn_apply
+from app.core.tasks import submit
+
+logger = logging.getLogger("proxmox_api")
+
+# Serialises this worker's journal writes; pipelines report their progress from many threads.
+_write_lock = threading.Lock()
+
+class Journal:
+    def __init__(self, operation_id: int):
+        self.operation_id = operation_id
+
+    @classmethod
+    def open(cls, kind: str, lab_group: str, params: dict, steps: list, created_by: str = None) -> "Journal":
+        """Records a new running operation with its planned `steps`, a list of (key, data)."""
+        now = datetime.utcnow()
+        with _write_lock:
+            db = SessionLocal()
+            try:
+                operation = models.LabOperation(kind=kind, lab_group=lab_group, status="running", params=json.dumps(params),
+                                                created_by=created_by, created_at=now, updated_at=now)
+                db.add(operation)
+                db.flush()
+                for position, (key, data) in enumerate(steps):
+                    db.add(models.LabOperationStep(operation_id=operation.id, position=position, key=key, status="pending",
+                                                   data=json.dumps(data), updated_at=now))
+                db.commit()
+                return cls(operation.id)
+            finally:
+                db.close()
+
+    @classmethod
+    def claim(cls, operation_id: int, force: bool = False):
+        """
+        Marks a failed operation as running again and returns its Journal, or None when it is not
+        failed. With `force`, an operation still marked running (its worker died) is taken over.
+        The check and the update are one statement, so two workers cannot both claim it.
+        """
+        statuses = ["failed", "running"] if force else ["failed"]
+        with _write_lock:
+            db = SessionLocal()
+            try:
+                claimed = db.query(models.LabOperation).filter(models.LabOperation.id == operation_id, models.LabOperation.status.in_(statuses)) \
+                    .update({"status": "running", "error": None, "updated_at": datetime.utcnow()}, synchronize_session=False)
+                db.commit()
+                return cls(operation_id) if claimed else None
+            finally:
+                db.close()
+
+    def step(self, key: str, status: str = None, stage: str = None, error: str = None):
+        with _write_lock:
+            db = SessionLocal()
+            try:
+                step = db.query(models.LabOperationStep).filter_by(operation_id=self.operation_id, key=key).first()
+                if status:
+                    step.status = status
+                if stage:
+                    step.stage = stage
+                step.error = error
+                step.updated_at = datetime.utcnow()
+                db.commit()
+            finally:
+                db.close()
+
+    def progress(self, key: str):
+        """A progress(stage) callback for provision_clone()."""
+        return lambda stage: self.step(key, stage=stage)
+
+    def run(self, key: str, fn, *args, **kwargs):
+        """Runs one step, journalling it as done or failed."""
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            self.step(key, status="failed", error=str(e))
+            raise
+        self.step(key, status="done")
+        return result
+
+    def finish(self, status: str, error: str = None):
+        with _write_lock:
+            db = SessionLocal()
+            try:
+                operation = db.query(models.LabOperation).get(self.operation_id)
+                operation.status = status
+                operation.error = error
+                operation.updated_at = datetime.utcnow()
+                db.commit()
+            finally:
+                db.close()
+
+    def load(self):
+        """(operation params, [step dicts in order]) as currently journalled."""
+        db = SessionLocal()
+        try:
+            operation = db.query(models.LabOperation).get(self.operation_id)
+            steps = db.query(models.LabOperationStep).filter_by(operation_id=self.operation_id).order_by(models.LabOperationStep.position).all()
+            return json.loads(operation.params), [_step_dict(step) for step in steps]
+        finally:
+            db.close()
+
+def _step_dict(step) -> dict:
+    return {"key": step.key, "status": step.status, "stage": step.stage, "data": json.loads(step.data or "{}"),
+            "error": step.error, "updated_at": step.updated_at}
+
+def describe(operation, steps: list = None) -> dict:
+    description = {
+        "id": operation.id,
+        "kind": operation.kind,
+        "lab_group": operation.lab_group,
+        "status": operation.status,
+        "error": operation.error,
+        "created_by": operation.created_by,
+        "created_at": operation.created_at,
+        "updated_at": operation.updated_at,
+        "params": json.loads(operation.params or "{}"),
+    }
+    if steps is not None:
+        description["steps"] = [_step_dict(step) for step in steps]
+    return description
+
+def resume_instantiate(proxmox, journal: Journal) -> dict:
+    """Runs the steps of an instantiation that are not done yet; clones continue from the stage they reached."""
+    params, steps = journal.load()
+    live = {vm['vmid']: vm for vm in cluster_resources.vms(proxmox, max_age=0)}
+    vnet_name = params['vnet']
+    sdn_apply_upid = None
+    if any(step['key'] == 'vnet' and step['status'] != 'done' for step in steps):
+        def create_vnet():
+            if vnet_name not in {vnet.get('vnet') for vnet in proxmox.cluster.sdn.vnets.get()}:
+                proxmox.cluster.sdn.vnets.post(vnet=vnet_name, zone=params['vlan_zone'], tag=params['vlan_tag'])
+            return proxmox.cluster.sdn.put()
+        try:
+            sdn_apply_upid = journal.run('vnet', create_vnet)
+        except Exception as vnet_error:
+            journal.finish("failed", "vnet failed: {}".format(vnet_error))
+            raise
+
+    pending = [step for step in steps if step['key'] != 'vnet' and step['status'] != 'done']
+    results, errors = [], []
+    if pending:
+        with ThreadPoolExecutor(max_workers=min(16, len(pending) + 1)) as executor:
+            sdn_ready = submit(executor, wait_for_sdn_apply, proxmox, sdn_apply_upid)
+            futures = []
+            for step in pending:
+                data = step['data']
+                if step['key'].startswith('clone:'):
+                    stage = step['stage']
+                    if stage is None and data['vmid'] in live:
+                        # The clone finished but the worker stopped before journalling it.
+                        stage = 'cloned'
+                    template_config = proxmox.nodes(data['source_node']).qemu(data['source_vmid']).config.get()
+                    futures.append((step, submit(executor, journal.run, step['key'], provision_clone, proxmox, data['source_node'], data['source_vmid'],
+                                                 template_config, data['vmid'], data['name'], data['description'], vnet_name, sdn_ready,
+                                                 target_node=data['target_node'], source_storages=data['source_storages'],
+                                                 progress=journal.progress(step['key']), resume_after=stage,
+                                                 baseline_snapshot=params.get('baseline'), tags=data.get('tags'), queue="lab_pipeline")))
+                else:
+                    node_name = live.get(data['vmid'], {}).get('node', data['node'])
+                    # The whole config, not just net0: the start needs the VM's startup order and disk storages.
+                    vm_config = proxmox.nodes(node_name).qemu(data['vmid']).config.get()
+                    futures.append((step, submit(executor, journal.run, step['key'], provision_existing, proxmox, node_name, data['vmid'], data['name'],
+                                                 vm_config, data['description'], vnet_name, sdn_ready,
+                                                 baseline_snapshot=params.get('baseline'), tags=data.get('tags'), queue="lab_pipeline")))
+            for step, future in futures:
+                try:
+                    results.append(future.result())
+                except Exception as job_error:
+                    errors.append("{} failed: {}".format(step['key'], job_error))
+    if errors:
+        journal.finish("failed", "; ".join(errors))
+    else:
+        journal.finish("completed")
+    cluster_resources.invalidate()
+    return {"resumed": results, "errors": errors}
+
+def _step_started(step: dict, live: dict) -> bool:
+    """
+    Whether a step of an instantiation did any work. A step whose worker died part way is still
+    pending, so a pending clone counts as started once its VM exists under the planned name, and a
+    pending add once the VM carries the lab's tags (the first thing provision_existing writes).
+    """
+    if step['status'] != 'pending' or step['stage']:
+        return True
+    data = step['data']
+    vm = live.get(data.get('vmid'))
+    if vm is None:
+        return False
+    if step['key'].startswith('clone:'):
+        return vm.get('name') == data['name']
+    if step['key'].startswith('add:'):
+        instance = instance_name(parse_tags(data.get('tags')))
+        return instance is not None and instance_name(parse_tags(vm.get('tags'))) == instance
+    return False
+
+def rollback_instantiate(proxmox, journal: Journal) -> dict:
+    """
+    Undoes an instantiation: deletes its clones and VNET, and restores the VMs it added to the lab.
+    Steps that never ran are left pending.
+    """
+    params, steps = journal.load()
+    live = {vm['vmid']: vm for vm in cluster_resources.vms(proxmox, max_age=0)}
+    removed, restored, errors = [], [], []
+    for step in reversed(steps):
+        data = step['data']
+        if not _step_started(step, live):
+            continue
+        try:
+            if step['key'].startswith('clone:'):
+                if data['vmid'] in live:
+                    remove_vm(proxmox, live[data['vmid']]['node'], data['vmid'])
+                    removed.append(data['vmid'])
+            elif step['key'].startswith('add:'):
+                if data['vmid'] in live:
+                    vm = proxmox.nodes(live[data['vmid']]['node']).qemu(data['vmid'])
+                    updates = {"description": data.get('original_description', '')}
+                    if data.get('original_net0'):
+                        updates['net0'] = data['original_net0']
+                    if 'original_tags' in data:
+                        updates.update(tag_update(data['original_tags']))
+                    vm.config.put(**updates)
+                    if data.get('original_status') == 'stopped' and live[data['vmid']].get('status') == 'running':
+                        vm.status.stop.post()
+                    restored.append(data['vmid'])
+            elif step['key'] == 'vnet':
+                if params['vnet'] in {vnet.get('vnet') for vnet in proxmox.cluster.sdn.vnets.get()}:
+                    proxmox.cluster.sdn.vnets(params['vnet']).delete()
+                    wait_for_sdn_apply(proxmox, proxmox.cluster.sdn.put())
+            journal.step(step['key'], status="rolled_back")
+        except Exception as step_error:
+            journal.step(step['key'], error=str(step_error))
+            errors.append("{} failed: {}".format(step['key'], step_error))
+    if errors:
+        journal.finish("failed", "Rollback incomplete: {}".format("; ".join(errors)))
+    else:
+        journal.finish("rolled_back")
+    cluster_resources.invalidate()
+    return {"removed_vms": removed, "restored_vms": restored, "errors": errors}
+
+def run_delete(proxmox, journal: Journal) -> dict:
+    """Runs (or resumes) a lab deletion: every member VM not deleted yet, then the VNET."""
+    params, steps = journal.load()
+    live = {vm['vmid']: vm for vm in cluster_resources.vms(proxmox, max_age=0)}
+    deleted_vms = []
+    try:
+        for step in steps:
+            if step['status'] == 'done':
+                continue
+            data = step['data']
+            if step['key'].startswith('delete:'):
+                def delete_member():
+                    if data['vmid'] in live:
+                        remove_vm(proxmox, live[data['vmid']]['node'], data['vmid'])
+                journal.run(step['key'], delete_member)
+                deleted_vms.append(data['name'])
+            elif step['key'] == 'vnet':
+                def delete_vnet():
+                    if params['vnet'] in {vnet.get('vnet') for vnet in proxmox.cluster.sdn.vnets.get()}:
+                        proxmox.cluster.sdn.vnets(params['vnet']).delete()
+                        wait_for_sdn_apply(proxmox, proxmox.cluster.sdn.put())
+                journal.run('vnet', delete_vnet)
+    except Exception as step_error:
+        journal.finish("failed", str(step_error))
+        cluster_resources.invalidate()
+        raise
+    journal.finish("completed")
+    cluster_resources.invalidate()
+    return {"deleted_vms": deleted_vms, "vnet": params.get('vnet')}
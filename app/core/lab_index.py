@@ -0,0 +1,142 @@
+"""
+Lab instance index.
+
+GET /labs lists every lab instance ("<group>_cloned<n>") with its VNET, member count, power
+states and resources. The aggregates are kept per worker from the /cluster/resources snapshots
+(app/core/inventory.py): each snapshot is compared with the previous one VM by VM, and only the
+labs of VMs that joined, left, or changed tags, node, status or usage are updated. Listing the
+labs costs no upstream call while the inventory cache is fresh.
+
+A lab's VNET is not in the listing. It is recorded when the lab is instantiated, or else read
+once from a member's config (clones first), and kept until the lab has no members left.
+"""
+import logging
+import threading
+from collections import namedtuple
+from app.core.inventory import cluster_resources
+from app.core.lab_pipeline import net_bridge
+from app.core.lab_tags import parse
+from app.core.tasks import map_concurrent
+
+logger = logging.getLogger("proxmox_api")
+
+MIB = 1024 * 1024
+GIB = 1024 * MIB
+
+# What the index keeps of a VM; `lab` is (group, instance) or None
+_VmState = namedtuple("_VmState", "tags lab role node status maxcpu maxmem maxdisk cpu mem")
+
+def _state(entry: dict, previous: _VmState = None) -> _VmState:
+    tags = entry.get('tags') or ''
+    if previous is not None and previous.tags == tags:
+        lab, role = previous.lab, previous.role
+    else:
+        metadata = parse(tags)
+        lab = (metadata['lab_name'], metadata['lab_instance']) if 'lab_instance' in metadata else None
+        role = metadata.get('lab_role')
+    return _VmState(tags, lab, role, entry.get('node'), entry.get('status'), int(entry.get('maxcpu') or 0), int(entry.get('maxmem') or 0),
+                    int(entry.get('maxdisk') or 0), float(entry.get('cpu') or 0), int(entry.get('mem') or 0))
+
+class LabIndex:
+    def __init__(self):
+        # vmid -> _VmState, for every VM of the last snapshot
+        self._vms = {}
+        # (group, instance) -> running totals
+        self._labs = {}
+        # (group, instance) -> {vmid, ...}
+        self._members = {}
+        # (group, instance) -> VNET name
+        self._vnets = {}
+        self._updated_at = 0.0
+        self._lock = threading.Lock()
+
+    def _apply(self, vmid: int, state: _VmState, sign: int):
+        if state.lab is None:
+            return
+        totals = self._labs.setdefault(state.lab, {"members": 0, "running": 0, "stopped": 0, "maxcpu": 0, "maxmem": 0, "maxdisk": 0, "cpu": 0.0, "mem": 0})
+        running = state.status == 'running'
+        totals["members"] += sign
+        totals["running"] += sign * running
+        totals["stopped"] += sign * (state.status == 'stopped')
+        totals["maxcpu"] += sign * state.maxcpu
+        totals["maxmem"] += sign * state.maxmem
+        totals["maxdisk"] += sign * state.maxdisk
+        if running:
+            totals["cpu"] += sign * state.cpu * state.maxcpu
+            totals["mem"] += sign * state.mem
+        members = self._members.setdefault(state.lab, set())
+        if sign > 0:
+            members.add(vmid)
+        else:
+            members.discard(vmid)
+        if totals["members"] == 0:
+            del self._labs[state.lab], self._members[state.lab]
+            self._vnets.pop(state.lab, None)
+
+    def update(self, resources: list, fetched_at: float):
+        """Applies the differences between a /cluster/resources snapshot taken at `fetched_at` and the previous one."""
+        with self._lock:
+            if fetched_at <= self._updated_at:
+                return
+            seen = set()
+            for entry in resources:
+                if entry.get('type') != 'qemu':
+                    continue
+                vmid = entry['vmid']
+                seen.add(vmid)
+                previous = self._vms.get(vmid)
+                state = _state(entry, previous)
+                if state != previous:
+                    if previous is not None:
+                        self._apply(vmid, previous, -1)
+                    self._apply(vmid, state, 1)
+                    self._vms[vmid] = state
+            for vmid in set(self._vms) - seen:
+                self._apply(vmid, self._vms.pop(vmid), -1)
+            self._updated_at = fetched_at
+
+    def record_vnet(self, lab_group: str, instance: int, vnet: str):
+        with self._lock:
+            self._vnets[(lab_group, instance)] = vnet
+
+    def vnet(self, lab_group: str, instance: int):
+        """The VNET recorded or resolved for a lab, or None."""
+        with self._lock:
+            return self._vnets.get((lab_group, instance))
+
+    def _resolve_vnet(self, proxmox, lab: tuple, members: list):
+        for vmid, state in sorted(members, key=lambda member: member[1].role != 'clone'):
+            try:
+                vnet = net_bridge(proxmox.nodes(state.node).qemu(vmid).config.get())
+            except Exception as e:
+                logger.warning(f"Could not read the VNET of lab member {vmid}: {e}")
+                continue
+            if vnet:
+                return vnet
+        return None
+
+    def labs(self, proxmox, max_age: float = None, lab_group: str = None) -> list:
+        """Every lab instance (of `lab_group`) with its VNET, power states and resources, from an inventory at most `max_age` seconds old."""
+        self.update(cluster_resources.get(proxmox, max_age), cluster_resources.fetched_at)
+        with self._lock:
+            unresolved = [(lab, [(vmid, self._vms[vmid]) for vmid in self._members[lab]])
+                          for lab in self._labs if lab not in self._vnets and (lab_group is None or lab[0] == lab_group)]
+        vnets = map_concurrent(lambda job: self._resolve_vnet(proxmox, *job), unresolved)
+        with self._lock:
+            for (lab, _), vnet in zip(unresolved, vnets):
+                if vnet and lab in self._labs:
+                    self._vnets[lab] = vnet
+            return [{
+                "name": "{}_cloned{}".format(*lab),
+                "lab_group": lab[0],
+                "instance": lab[1],
+                "vnet": self._vnets.get(lab),
+                "members": totals["members"],
+                "running": totals["running"],
+                "stopped": totals["stopped"],
+                "resources": {"cpus": totals["maxcpu"], "memory_mb": totals["maxmem"] // MIB, "disk_gb": round(totals["maxdisk"] / GIB, 1)},
+                "usage": {"cpus": round(totals["cpu"], 2), "memory_mb": totals["mem"] // MIB},
+            } for lab, totals in sorted(self._labs.items()) if lab_group is None or lab[0] == lab_group]
+
+lab_index = LabIndex()
+cluster_resources.subscribe(lab_index.update)
@@ -0,0 +1,231 @@
+import os
+import re
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from app.core.inventory import vm_node_index
+from app.core.boot import BootBatch, boot_priority, boot_scheduler, startup_options
+from app.core.tasks import clone_limiter, is_upid, map_concurrent, submit, task_node, wait_for_task
+
+logger = logging.getLogger("proxmox_api")
+
+BOOT_MAX_WORKERS = int(os.getenv("BOOT_MAX_WORKERS", "32"))
+# Snapshot taken of every lab member before its first boot, so the lab can be reset to it; empty disables it.
+LAB_BASELINE_SNAPSHOT = os.getenv("LAB_BASELINE_SNAPSHOT", "clean")
+
+# The stages of a clone pipeline, in order; `progress` is called after each one.
+CLONE_STAGES = ("cloned", "configured", "snapshotted", "started")
+
+def description_lab_groups(description: str) -> list:
+    """The groups of a 'LabGroups:[a,b]' tag in a template description."""
+    group_match = re.search(r"LabGroups:\[(.*?)\]", description)
+    if group_match and group_match.group(1):
+        return group_match.group(1).split(',')
+    return []
+
+def bridge_net_config(net_config: str, bridge: str) -> str:
+    """Keeps the NIC model and MAC of a netX value and points it at `bridge`."""
+    model_and_mac = net_config.split(',')[0]
+    return "{},bridge={}".format(model_and_mac, bridge)
+
+def net_bridge(vm_config: dict, key: str = 'net0'):
+    """The bridge (or VNET) a NIC is attached to, or None."""
+    net_config = vm_config.get(key, '')
+    if 'bridge=' not in net_config:
+        return None
+    return net_config.split('bridge=')[1].split(',')[0]
+
+def nic_updates(vm_config: dict, bridges: dict) -> dict:
+    """
+    The netX values that attach the NICs of `bridges` ({device: bridge}) to their bridge, for the
+    NICs not already on it. Model and MAC are kept; a NIC the VM does not have is added as virtio.
+    """
+    updates = {}
+    for device, bridge in bridges.items():
+        if net_bridge(vm_config, device) != bridge:
+            net_config = vm_config.get(device, '')
+            updates[device] = bridge_net_config(net_config, bridge) if net_config else "virtio,bridge={}".format(bridge)
+    return updates
+
+def disk_storages(vm_config: dict) -> set:
+    storages = set()
+    for key, value in vm_config.items():
+        if re.match(r"(scsi|sata|ide|virtio)\d+$", key) and ':' in str(value) and 'media=cdrom' not in str(value):
+            storages.add(str(value).split(':', 1)[0])
+    return storages
+
+def next_vnet_name(all_vnets: list) -> str:
+    """vnetN with N one above the highest existing vnetN."""
+    highest_num = 0
+    for vnet in all_vnets:
+        match = re.match(r"vnet(\d+)", vnet.get('vnet', ''))
+        if match:
+            highest_num = max(highest_num, int(match.group(1)))
+    return "vnet{}".format(highest_num + 1)
+
+def wait_for_sdn_apply(proxmox, upid):
+    if is_upid(upid):
+        wait_for_task(proxmox, task_node(upid), upid)
+
+def provision_clone(proxmox, node_name, template_id, template_config, new_vmid, new_clone_name, clone_description, vnet_name,
+                    sdn_ready=None, start=True, final_description=None, target_node=None, source_storages=None,
+                    progress=None, resume_after=None, boot_batch=None, baseline_snapshot=None, tags=None, nics=None):
+    """
+    Clone -> move NIC to the lab VNET -> start, for one template. Runs on a lab pipeline pool.
+    `nics` ({device: bridge}) attaches other NICs than net0 to the VNET, or to other bridges.
+    `final_description` and `tags` (app/core/lab_tags.py) are written together with the NIC, so
+    they only appear once the clone is usable.
+    `target_node` places the clone on another node (the template's disks must be on shared storage).
+    `node_name`/`template_id` may be a replica of the template, whose disks are on `source_storages`.
+    `progress(stage)` is called after each of CLONE_STAGES; `resume_after` skips the stages up to
+    and including that one (an interrupted pipeline picking up where it stopped).
+    With `baseline_snapshot`, the configured clone is snapshotted under that name before it first boots.
+    The start goes through the boot scheduler, in `boot_batch` priority order when given.
+    """
+    target_node = target_node or node_name
+    completed = CLONE_STAGES.index(resume_after) + 1 if resume_after else 0
+    if completed < 1:
+        clone_params = {"newid": new_vmid, "name": new_clone_name, "full": 0, "description": clone_description}
+        if target_node != node_name:
+            clone_params["target"] = target_node
+        # The clone task runs on the source node, so that is the node whose concurrent clones are limited.
+        storage_keys = ["storage:{}".format(storage) for storage in (source_storages or disk_storages(template_config))]
+        with clone_limiter.limit("node:{}".format(node_name), *storage_keys):
+            upid = proxmox.nodes(node_name).qemu(template_id).clone.post(**clone_params)
+            if is_upid(upid):
+                wait_for_task(proxmox, node_name, upid)
+        vm_node_index.record(new_vmid, target_node)
+        if progress:
+            progress("cloned")
+    new_vm = proxmox.nodes(target_node).qemu(new_vmid)
+    if completed < 2:
+        # The clone API cannot set net0, so the bridge is switched as soon as the clone task is done.
+        updates = {}
+        net0_config = template_config.get('net0', '')
+        if nics is not None:
+            updates.update(nic_updates(template_config, nics))
+        elif net0_config:
+            updates['net0'] = bridge_net_config(net0_config, vnet_name)
+        if final_description:
+            updates['description'] = final_description
+        if tags is not None:
+            # Replaces the tags copied from the template, lab groups included.
+            updates.update({"tags": tags} if tags else {"delete": "tags"})
+        if updates:
+            new_vm.config.put(**updates)
+        if progress:
+            progress("configured")
+    if baseline_snapshot and completed < 3:
+        take_snapshot(proxmox, target_node, new_vmid, baseline_snapshot, "Lab baseline")
+        if progress:
+            progress("snapshotted")
+    try:
+        if start and completed < 4:
+            if sdn_ready is not None:
+                sdn_ready.result()
+            #START VM FOR NEW CLONED VM
+            start_vm(proxmox, target_node, new_vmid, template_config, boot_batch)
+            if progress:
+                progress("started")
+    finally:
+        if boot_batch is not None:
+            boot_batch.done(new_vmid)
+    return {"name": new_clone_name, "id": new_vmid, "node": target_node}
+
+def provision_existing(proxmox, node_name, vm_id, vm_name, config, new_description, vnet_name, sdn_ready=None, boot_batch=None, baseline_snapshot=None,
+                       tags=None):
+    """Adds a regular (non-template) VM to the lab: description and tags, NIC bridge, baseline snapshot, start."""
+    try:
+        vm = proxmox.nodes(node_name).qemu(vm_id)
+        updates = {"description": new_description}
+        if tags is not None:
+            updates["tags"] = tags
+        net0_config = config.get('net0', '')
+        if net0_config:
+            updates["net0"] = bridge_net_config(net0_config, vnet_name)
+        vm.config.put(**updates)
+        if baseline_snapshot:
+            try:
+                take_snapshot(proxmox, node_name, vm_id, baseline_snapshot, "Lab baseline")
+            except Exception as snapshot_error:
+                # An existing VM may already have a snapshot of that name; it joins the lab without a new baseline.
+                logger.warning(f"No baseline snapshot for VM {vm_id}: {snapshot_error}")
+        if sdn_ready is not None:
+            sdn_ready.result()
+        #FOR EXISTING VM
+        start_vm(proxmox, node_name, vm_id, config, boot_batch)
+    finally:
+        if boot_batch is not None:
+            boot_batch.done(vm_id)
+    return {"name": vm_name, "id": vm_id}
+
+def take_snapshot(proxmox, node_name, vm_id, snapname, description=""):
+    upid = proxmox.nodes(node_name).qemu(vm_id).snapshot.post(snapname=snapname, description=description)
+    if is_upid(upid):
+        wait_for_task(proxmox, node_name, upid)
+
+def start_vm(proxmox, node_name, vm_id, config, boot_batch=None):
+    """Starts a VM through the boot scheduler, holding a slot on its node and disk storages until it is up."""
+    return boot_scheduler.boot(proxmox, node_name, vm_id, disk_storages(config), startup_options(config).get("up", 0), boot_batch)
+
+def boot_batch_for(members: list) -> BootBatch:
+    """A BootBatch over (vmid, name, config) members, by their startup order / BOOT_PRIORITY."""
+    return BootBatch({vm_id: boot_priority(name, config) for vm_id, name, config in members})
+
+def start_vms(proxmox, vms: list, configs: list = None) -> list:
+    """
+    Starts `vms` (dicts with vmid, node, name and status) through the boot scheduler in priority
+    order and returns one result per VM, in order. `configs` are read concurrently when not given.
+    """
+    if configs is None:
+        configs = map_concurrent(lambda vm: proxmox.nodes(vm['node']).qemu(vm['vmid']).config.get(), vms)
+    results = [None] * len(vms)
+    jobs = []
+    for position, (vm, config) in enumerate(zip(vms, configs)):
+        if vm.get('status') == 'running':
+            results[position] = {"vmid": vm['vmid'], "name": vm.get('name'), "node": vm['node'], "result": "skipped", "detail": "VM is already running."}
+        else:
+            jobs.append((boot_priority(vm.get('name'), config), position, vm, config))
+    if not jobs:
+        return results
+    # Submitted in priority order, so a worker never waits on a VM that has no worker yet.
+    jobs.sort(key=lambda job: job[:2])
+    batch = boot_batch_for([(vm['vmid'], vm.get('name'), config) for _, _, vm, config in jobs])
+    with ThreadPoolExecutor(max_workers=min(BOOT_MAX_WORKERS, len(jobs))) as executor:
+        futures = [(position, vm, submit(executor, start_vm, proxmox, vm['node'], vm['vmid'], config, batch, queue="boot"))
+                   for _, position, vm, config in jobs]
+        for position, vm, future in futures:
+            result = {"vmid": vm['vmid'], "name": vm.get('name'), "node": vm['node']}
+            try:
+                results[position] = {**result, "result": "ok", "task_id": future.result()}
+            except Exception as e:
+                logger.warning(f"Start of VM {vm['vmid']} failed: {e}")
+                results[position] = {**result, "result": "error", "detail": str(e)}
+    return results
+
+_background_starts = ThreadPoolExecutor(max_workers=4, thread_name_prefix="boot")
+
+def start_vms_in_background(proxmox, vms: list, configs: list = None) -> list:
+    """start_vms() on a background thread; returns right away, with every VM to be started as "queued"."""
+    submit(_background_starts, start_vms, proxmox, vms, configs)
+    return [{"vmid": vm['vmid'], "name": vm.get('name'), "node": vm['node'],
+             "result": "skipped" if vm.get('status') == 'running' else "queued"} for vm in vms]
+
+def remove_vm(proxmox, node_name, vm_id, stop_timeout: int = 60):
+    """Stops a VM if it is running (waiting up to `stop_timeout` seconds) and deletes it."""
+    vm = proxmox.nodes(node_name).qemu(vm_id)
+    if vm.status.current.get()['status'] == 'running':
+        upid = vm.status.stop.post()
+        if is_upid(upid):
+            wait_for_task(proxmox, node_name, upid, timeout=stop_timeout)
+        else:
+            for _ in range(stop_timeout // 3):
+                time.sleep(3)
+                if vm.status.current.get()['status'] == 'stopped': break
+            else:
+                logger.error(f"Timed out waiting for VM {vm_id} to stop.")
+                raise Exception("Timed out waiting for VM {} to stop.".format(vm_id))
+    upid = vm.delete()
+    if is_upid(upid):
+        wait_for_task(proxmox, node_name, upid)
+    vm_node_index.forget(vm_id)
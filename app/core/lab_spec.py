@@ -0,0 +1,276 @@
+"""
+Declarative lab specs.
+
+A lab instance can be described as a YAML spec and reconciled: the lab as it is (its members
+from their lab tags, one config read per member) is compared with the spec, and the fewest
+Proxmox mutations that make it match are planned and run.
+
+    lab_group: WebLab
+    instance: 3              # the WebLab_cloned3 lab
+    vnet:                    # only used when the lab has no VNET yet
+      zone: labzone
+      tag: 303
+    templates:               # clones, by template name or VMID
+      - template: tpl-web
+        count: 2
+        nics: {net0: lab, net1: vmbr1}
+    vms:                     # existing VMs added to the lab
+      - vm: 205
+
+NICs default to {net0: lab}; "lab" stands for the lab's VNET, and NICs a spec does not list are
+left alone. Clones of a template are recognised by the "<group>-<template name>-" name that
+instantiation gives them. Missing clones are provisioned like an instantiation (clone,
+configure, baseline snapshot, start) and surplus clones are deleted. VMs no longer listed under
+`vms` are released from the lab (description, tags and net0 back to vmbr0), as the membership
+edit does. Every change to one VM is a single config put, and the steps for different VMs run
+concurrently. A dry run returns the plan with the estimated upstream calls of each step.
+"""
+import re
+import logging
+from concurrent.futures import ThreadPoolExecutor
+import yaml
+from app.core.inventory import cluster_resources
+from app.core.lab_index import lab_index
+from app.core.lab_pipeline import (LAB_BASELINE_SNAPSHOT, disk_storages, net_bridge, next_vnet_name, nic_updates, provision_clone, remove_vm,
+                                   wait_for_sdn_apply)
+from app.core.lab_tags import clone_tags, instance_name, tag_update, with_lab_instance, without_lab_instance
+from app.core.planner import ensure_capacity
+from app.core.tasks import map_concurrent, submit
+from app.core.vm_index import vm_index
+
+logger = logging.getLogger("proxmox_api")
+
+LAB_BRIDGE = "lab"
+RELEASE_BRIDGE = "vmbr0"
+
+# Estimated upstream calls per step; a task wait counts as one status poll.
+STEP_CALLS = {"create_vnet": 3, "clone": 5, "add": 1, "configure": 1, "release": 1, "delete": 3}
+BASELINE_CALLS = 2
+STOP_CALLS = 2
+
+class SpecError(ValueError):
+    """A spec that cannot be parsed, or cannot be applied to the cluster as it is."""
+
+def clear_lab_description(existing_desc: str) -> str:
+    """Removes any 'Lab: ...' line from a description."""
+    return re.sub(r"Lab: .*? \| Instance: \d+\n?", "", existing_desc).strip()
+
+def _nics(value) -> dict:
+    if value is None:
+        return {"net0": LAB_BRIDGE}
+    if not isinstance(value, dict) or not all(re.match(r"net\d+$", str(device)) for device in value):
+        raise SpecError("nics must map netN devices to bridges, e.g. {net0: lab, net1: vmbr1}.")
+    return {str(device): str(bridge) for device, bridge in value.items()}
+
+def load_spec(text: str) -> dict:
+    """Parses and validates a YAML lab spec into its normalised form."""
+    try:
+        raw = yaml.safe_load(text)
+    except yaml.YAMLError as e:
+        raise SpecError("Invalid YAML: {}".format(e))
+    if not isinstance(raw, dict):
+        raise SpecError("A lab spec is a mapping with lab_group, instance, templates and vms.")
+    if not raw.get('lab_group') or not isinstance(raw.get('instance'), int) or raw['instance'] < 1:
+        raise SpecError("A lab spec needs a lab_group and a positive instance number.")
+    vnet = raw.get('vnet') or {}
+    if not isinstance(vnet, dict):
+        raise SpecError("vnet must be a mapping with zone and tag.")
+    templates = []
+    for entry in raw.get('templates') or []:
+        if not isinstance(entry, dict) or entry.get('template') is None:
+            raise SpecError("Every templates entry needs a template (name or VMID).")
+        count = entry.get('count', 1)
+        if not isinstance(count, int) or count < 0:
+            raise SpecError("count of template {} must be a non-negative integer.".format(entry['template']))
+        templates.append({"template": entry['template'], "count": count, "nics": _nics(entry.get('nics'))})
+    vms = []
+    for entry in raw.get('vms') or []:
+        entry = entry if isinstance(entry, dict) else {"vm": entry}
+        if not isinstance(entry.get('vm'), int):
+            raise SpecError("Every vms entry needs a vm (VMID).")
+        vms.append({"vm": entry['vm'], "nics": _nics(entry.get('nics'))})
+    if len({entry['vm'] for entry in vms}) != len(vms):
+        raise SpecError("A VM is listed more than once under vms.")
+    return {"lab_group": str(raw['lab_group']), "instance": raw['instance'], "vnet": {"zone": vnet.get('zone'), "tag": vnet.get('tag')},
+            "templates": templates, "vms": vms}
+
+def _step(action: str, vm: dict, **fields) -> dict:
+    return {"action": action, "vmid": vm['vmid'], "name": vm.get('name'), "node": vm['node'], **fields}
+
+def _read_configs(proxmox, vms: list) -> dict:
+    return dict(zip([vm['vmid'] for vm in vms], map_concurrent(lambda vm: proxmox.nodes(vm['node']).qemu(vm['vmid']).config.get(), vms)))
+
+def _lab_vnet(members: list, configs: dict):
+    for vm in sorted(members, key=lambda vm: vm['lab'].get('lab_role') != 'clone'):
+        if net_bridge(configs.get(vm['vmid'], {})):
+            return net_bridge(configs[vm['vmid']])
+    return None
+
+def _add_step(vm: dict, config: dict, lab_group: str, instance: int, bridges: dict) -> dict:
+    description = "{}\nLab: {} added | Instance: {}".format(clear_lab_description(config.get('description', '')), lab_group, instance).strip()
+    changes = {"description": description, "tags": with_lab_instance(config.get('tags'), lab_group, instance, "added"), **nic_updates(config, bridges)}
+    return _step("add", vm, changes=changes, calls=STEP_CALLS["add"])
+
+def _release_step(vm: dict, config: dict) -> dict:
+    changes = {"description": clear_lab_description(config.get('description', '')), **tag_update(without_lab_instance(config.get('tags')))}
+    if config.get('net0'):
+        changes.update(nic_updates(config, {"net0": RELEASE_BRIDGE}))
+    return _step("release", vm, changes=changes, calls=STEP_CALLS["release"])
+
+def _delete_step(vm: dict) -> dict:
+    return _step("delete", vm, status=vm.get('status'), calls=STEP_CALLS["delete"] + (STOP_CALLS if vm.get('status') == 'running' else 0))
+
+def _resolve_template(templates: list, key) -> dict:
+    matches = [entry for entry in templates if entry['vmid'] == key or entry['name'] == str(key)]
+    if not matches:
+        raise SpecError("Template '{}' not found.".format(key))
+    if len(matches) > 1:
+        raise SpecError("Template name '{}' is ambiguous ({}); use its VMID.".format(key, ", ".join(str(entry['vmid']) for entry in matches)))
+    return matches[0]
+
+def plan(proxmox, spec: dict, vms: list, templates: list, vnet: str = None) -> dict:
+    """
+    The steps that converge a lab to `spec`. `vms` are fresh lab_vms() entries and `templates`
+    template catalog entries (app/core/catalog.py); `vnet` is the lab's VNET when already known.
+    Reads the config of every member and of every VM to be added, once.
+    """
+    lab_group, instance = spec['lab_group'], spec['instance']
+    lab_name = "{}_cloned{}".format(lab_group, instance)
+    by_id = {vm['vmid']: vm for vm in vms}
+    members = [vm for vm in vms if instance_name(vm['lab']) == lab_name]
+    member_ids = {vm['vmid'] for vm in members}
+    for entry in spec['vms']:
+        vm = by_id.get(entry['vm'])
+        if vm is None:
+            raise SpecError("VM {} not found.".format(entry['vm']))
+        if vm.get('template') == 1:
+            raise SpecError("VM {} is a template; list it under templates.".format(entry['vm']))
+        if entry['vm'] not in member_ids and 'lab_instance' in vm['lab']:
+            raise SpecError("VM {} is already part of lab {}.".format(entry['vm'], instance_name(vm['lab'])))
+    wanted_vms = {entry['vm']: entry for entry in spec['vms']}
+    configs = _read_configs(proxmox, members + [by_id[vmid] for vmid in wanted_vms if vmid not in member_ids])
+    reads = 1 + len(configs)
+
+    steps = []
+    vnet = vnet or _lab_vnet(members, configs)
+    if vnet is None:
+        if spec['vnet']['zone'] is None or spec['vnet']['tag'] is None:
+            raise SpecError("Lab {} has no VNET yet; the spec needs vnet.zone and vnet.tag to create one.".format(lab_name))
+        vnet = next_vnet_name(proxmox.cluster.sdn.vnets.get())
+        reads += 1
+        steps.append({"action": "create_vnet", "vnet": vnet, "zone": spec['vnet']['zone'], "tag": spec['vnet']['tag'], "calls": STEP_CALLS["create_vnet"]})
+
+    def bridges(nics):
+        return {device: vnet if bridge == LAB_BRIDGE else bridge for device, bridge in nics.items()}
+
+    # Clones: keep the lowest VMIDs of each template up to its count, clone the rest, delete the surplus
+    clones = sorted((vm for vm in members if vm['lab'].get('lab_role') == 'clone' and vm['vmid'] not in wanted_vms), key=lambda vm: vm['vmid'])
+    kept = set()
+    taken_ids = set(by_id)
+    next_vmid = instance * 1000
+    for entry in spec['templates']:
+        template = _resolve_template(templates, entry['template'])
+        prefix = "{}-{}-".format(lab_group.lower(), template['name'])
+        matching = [vm for vm in clones if vm['vmid'] not in kept and (vm.get('name') or '').startswith(prefix)][:entry['count']]
+        for vm in matching:
+            kept.add(vm['vmid'])
+            changes = nic_updates(configs[vm['vmid']], bridges(entry['nics']))
+            if changes:
+                steps.append(_step("configure", vm, changes=changes, calls=STEP_CALLS["configure"]))
+        for _ in range(entry['count'] - len(matching)):
+            while next_vmid in taken_ids:
+                next_vmid += 1
+            taken_ids.add(next_vmid)
+            steps.append({"action": "clone", "vmid": next_vmid, "name": "{}{}".format(prefix, next_vmid), "template": template['vmid'],
+                          "template_node": template['node'], "nics": bridges(entry['nics']),
+                          "calls": STEP_CALLS["clone"] + (BASELINE_CALLS if LAB_BASELINE_SNAPSHOT else 0)})
+    steps += [_delete_step(vm) for vm in clones if vm['vmid'] not in kept]
+
+    # Added VMs: join the ones not in the lab yet, fix the NICs of the others, release the ones no longer listed
+    for vmid, entry in wanted_vms.items():
+        if vmid in member_ids:
+            changes = nic_updates(configs[vmid], bridges(entry['nics']))
+            if changes:
+                steps.append(_step("configure", by_id[vmid], changes=changes, calls=STEP_CALLS["configure"]))
+        else:
+            steps.append(_add_step(by_id[vmid], configs[vmid], lab_group, instance, bridges(entry['nics'])))
+    steps += [_release_step(vm, configs[vm['vmid']]) for vm in members if vm['lab'].get('lab_role') != 'clone' and vm['vmid'] not in wanted_vms]
+
+    return {"lab": lab_name, "lab_group": lab_group, "instance": instance, "vnet": vnet, "in_sync": not steps, "steps": steps,
+            "upstream_calls": {"planning": reads, "estimated": sum(step["calls"] for step in steps)}}
+
+def membership_plan(proxmox, lab_group: str, instance: int, vnet: str, vms: list, vm_ids: list) -> dict:
+    """
+    The steps that make `vm_ids` the members of a lab: VMs not in it yet are added, members not
+    listed are released (clones included, which are kept as regular VMs). Unknown VMIDs are
+    skipped. Only the configs of the VMs that change are read.
+    """
+    lab_name = "{}_cloned{}".format(lab_group, instance)
+    by_id = {vm['vmid']: vm for vm in vms}
+    members = {vm['vmid'] for vm in vms if instance_name(vm['lab']) == lab_name}
+    to_add = [by_id[vmid] for vmid in dict.fromkeys(vm_ids) if vmid in by_id and vmid not in members]
+    to_release = [by_id[vmid] for vmid in sorted(members - set(vm_ids))]
+    configs = _read_configs(proxmox, to_add + to_release)
+    steps = [_add_step(vm, configs[vm['vmid']], lab_group, instance, {"net0": vnet}) for vm in to_add]
+    steps += [_release_step(vm, configs[vm['vmid']]) for vm in to_release]
+    return {"lab": lab_name, "lab_group": lab_group, "instance": instance, "vnet": vnet, "in_sync": not steps, "steps": steps,
+            "upstream_calls": {"planning": len(configs), "estimated": sum(step["calls"] for step in steps)}}
+
+def _configure(proxmox, step: dict):
+    proxmox.nodes(step['node']).qemu(step['vmid']).config.put(**step['changes'])
+    vm_index.forget(step['vmid'])
+    return {"action": step['action'], "vmid": step['vmid'], "name": step['name']}
+
+def _delete(proxmox, step: dict):
+    remove_vm(proxmox, step['node'], step['vmid'])
+    return {"action": "delete", "vmid": step['vmid'], "name": step['name']}
+
+def apply(proxmox, plan: dict, templates: list, placement_policy: str = None) -> dict:
+    """
+    Runs the steps of a plan: the VNET first, then every other step concurrently, clones through
+    the lab pipeline once the capacity plan has placed them (CapacityError when they do not fit).
+    """
+    steps = plan['steps']
+    clone_steps = [step for step in steps if step['action'] == 'clone']
+    by_template = {entry['vmid']: entry for entry in templates}
+    placements = []
+    if clone_steps:
+        entries = [by_template[step['template']] for step in clone_steps]
+        placements = ensure_capacity(proxmox, [(entry['summary'], entry['config'], entry['record']) for entry in entries], {},
+                                     placement_policy)['placements']
+
+    sdn_apply_upid = None
+    for step in steps:
+        if step['action'] == 'create_vnet':
+            proxmox.cluster.sdn.vnets.post(vnet=step['vnet'], zone=step['zone'], tag=step['tag'])
+            sdn_apply_upid = proxmox.cluster.sdn.put()
+            lab_index.record_vnet(plan['lab_group'], plan['instance'], step['vnet'])
+            logger.info(f"New SDN Vnet '{step['vnet']}' Created.")
+
+    done, errors = [], []
+    others = [step for step in steps if step['action'] not in ('create_vnet', 'clone')]
+    if clone_steps or others:
+        with ThreadPoolExecutor(max_workers=min(16, len(clone_steps) + len(others) + 1)) as executor:
+            sdn_ready = submit(executor, wait_for_sdn_apply, proxmox, sdn_apply_upid)
+            futures = []
+            for step, placement in zip(clone_steps, placements):
+                entry = by_template[step['template']]
+                description = "Lab: {} clone | Instance: {}".format(plan['lab_group'], plan['instance'])
+                futures.append((step, submit(executor, provision_clone, proxmox, entry['node'], entry['vmid'], entry['config'], step['vmid'], step['name'],
+                                             description, plan['vnet'], sdn_ready, target_node=placement['node'],
+                                             source_storages=disk_storages(entry['config']), baseline_snapshot=LAB_BASELINE_SNAPSHOT or None,
+                                             tags=clone_tags(entry['summary'].get('tags'), plan['lab_group'], plan['instance']), nics=step['nics'],
+                                             queue="lab_pipeline")))
+            for step in others:
+                futures.append((step, submit(executor, _delete if step['action'] == 'delete' else _configure, proxmox, step, queue="lab_pipeline")))
+            for step, future in futures:
+                try:
+                    result = future.result()
+                    done.append({"action": "clone", "vmid": result['id'], "name": result['name'], "node": result['node']} if step['action'] == 'clone' else result)
+                except Exception as e:
+                    logger.warning(f"Lab {plan['lab']}: {step['action']} of VM {step['vmid']} failed: {e}")
+                    errors.append("{} of VM {} failed: {}".format(step['action'], step['vmid'], e))
+    else:
+        wait_for_sdn_apply(proxmox, sdn_apply_upid)
+    cluster_resources.invalidate()
+    return {"lab": plan['lab'], "vnet": plan['vnet'], "done": done, "errors": errors}
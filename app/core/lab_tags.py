@@ -0,0 +1,178 @@
+"""
+Lab metadata as Proxmox tags.
+
+Lab membership used to live only in VM descriptions ("LabGroups:[a,b]", "Lab: X clone |
+Instance: N"), which are only returned by /nodes/{node}/qemu/{vmid}/config: finding the members of
+a lab or of a lab group took one config read per VM in the cluster. The same facts are now also
+written as native tags, which /cluster/resources returns for every VM in one call:
+
+    labgroup-<group>     the template (or free VM) belongs to lab group <group>
+    lab-<group>.<n>      the VM is a member of instance <n> of <group> (the "<group>_cloned<n>" lab)
+    labrole-clone|added  how it joined that instance
+    labpool-<group>      the VM is a pre-cloned warm pool member for <group>
+
+Proxmox tags only allow [a-z0-9_+.-], so other characters of a group name (and ".") are written
+as "+" and their UTF-8 bytes in hex. Descriptions are still written as before, for people reading
+them in the Proxmox UI and for the frontend; the API reads the tags.
+
+Descriptions written before tags existed are converted once per database: the first reader runs
+migrate_descriptions(), which reads every VM config one last time, writes the matching tags and
+records the migration in the data_migrations table.
+"""
+import re
+import logging
+import threading
+from datetime import datetime
+from filelock import FileLock
+from app import models
+from app.database import SessionLocal
+from app.core.inventory import cluster_resources
+from app.core.lab_pipeline import description_lab_groups
+from app.core.metrics import timed_lock
+from app.core.tasks import is_upid, map_concurrent, wait_for_task
+
+logger = logging.getLogger("proxmox_api")
+
+GROUP_PREFIX = "labgroup-"
+INSTANCE_PREFIX = "lab-"
+ROLE_PREFIX = "labrole-"
+POOL_PREFIX = "labpool-"
+
+# Description marker of warm pool members (app/core/warm_pool.py), still the source of their slot and readiness
+POOL_DESCRIPTION = "WarmPool: {} | Slot: {} | Members: {}"
+POOL_PATTERN = re.compile(r"WarmPool: (.*?) \| Slot: (\d+) \| Members: (\d+)( \| Ready)?")
+
+MIGRATION_NAME = "lab_tags"
+INSTANCE_TAG = re.compile(r"lab-(.+)\.(\d+)$")
+
+migration_lock = FileLock("/tmp/lab_tag_migration.lock")
+_migrated = threading.Event()
+
+def encode(name: str) -> str:
+    return "".join(char if re.match(r"[A-Za-z0-9_-]$", char) else "".join("+{:02x}".format(byte) for byte in char.encode())
+                   for char in name)
+
+def decode(value: str) -> str:
+    return re.sub(r"((?:\+[0-9a-fA-F]{2})+)", lambda match: bytes.fromhex(match.group(1).replace("+", "")).decode(errors="replace"), value)
+
+def split_tags(tags) -> list:
+    """The tags of a `tags` value; Proxmox separates them with ';' (',' and spaces are accepted on input)."""
+    return [tag for tag in re.split(r"[;, ]+", tags or "") if tag]
+
+def join_tags(tags: list) -> str:
+    return ";".join(dict.fromkeys(tags))
+
+def parse(tags) -> dict:
+    """The lab metadata of a `tags` value, shaped like the description parser's output."""
+    metadata = {}
+    for tag in split_tags(tags):
+        if tag.startswith(GROUP_PREFIX):
+            metadata.setdefault('lab_groups', []).append(decode(tag[len(GROUP_PREFIX):]))
+        elif tag.startswith(ROLE_PREFIX):
+            metadata['lab_role'] = tag[len(ROLE_PREFIX):]
+        elif tag.startswith(POOL_PREFIX):
+            metadata['pool_group'] = decode(tag[len(POOL_PREFIX):])
+        else:
+            match = INSTANCE_TAG.match(tag)
+            if match:
+                metadata['lab_name'] = decode(match.group(1))
+                metadata['lab_instance'] = int(match.group(2))
+    return metadata
+
+def instance_name(metadata: dict):
+    """The "<group>_cloned<n>" name of the lab instance a VM belongs to, or None."""
+    if 'lab_instance' not in metadata:
+        return None
+    return "{}_cloned{}".format(metadata['lab_name'], metadata['lab_instance'])
+
+def _without(tags, *prefixes) -> list:
+    return [tag for tag in split_tags(tags) if not tag.startswith(prefixes)]
+
+def with_lab_groups(tags, lab_groups: list) -> str:
+    """`tags` with its lab group tags replaced by `lab_groups`."""
+    return join_tags(_without(tags, GROUP_PREFIX) + [GROUP_PREFIX + encode(group) for group in sorted(set(lab_groups))])
+
+def with_lab_instance(tags, lab_group: str, instance: int, role: str) -> str:
+    """`tags` moved into instance `instance` of `lab_group`, as a "clone" or an "added" VM."""
+    kept = _without(tags, INSTANCE_PREFIX, ROLE_PREFIX, POOL_PREFIX)
+    return join_tags(kept + ["{}{}.{}".format(INSTANCE_PREFIX, encode(lab_group), instance), ROLE_PREFIX + role])
+
+def without_lab_instance(tags) -> str:
+    return join_tags(_without(tags, INSTANCE_PREFIX, ROLE_PREFIX, POOL_PREFIX))
+
+def clone_tags(template_tags, lab_group: str, instance: int) -> str:
+    """The tags of a lab clone: the template's own tags, without its lab groups, in the new instance."""
+    return with_lab_instance(with_lab_groups(template_tags, []), lab_group, instance, "clone")
+
+def pool_tags(template_tags, lab_group: str) -> str:
+    return join_tags(_without(with_lab_groups(template_tags, []), INSTANCE_PREFIX, ROLE_PREFIX, POOL_PREFIX) + [POOL_PREFIX + encode(lab_group)])
+
+def tag_update(tags: str) -> dict:
+    """Config parameters setting `tags`; an empty value has to be deleted rather than set."""
+    return {"tags": tags} if tags else {"delete": "tags"}
+
+def strip_inherited(proxmox, clones: list):
+    """
+    A clone copies its template's tags, lab groups included, and would join the template's lab
+    group as a free VM. For each (node, vmid, clone task, template tags) whose template has lab
+    groups, waits for the clone and removes them.
+    """
+    def strip(clone):
+        node_name, vmid, upid, template_tags = clone
+        if is_upid(upid):
+            wait_for_task(proxmox, node_name, upid)
+        proxmox.nodes(node_name).qemu(vmid).config.put(**tag_update(with_lab_groups(template_tags, [])))
+    map_concurrent(strip, [clone for clone in clones if parse(clone[3]).get('lab_groups')])
+
+def lab_vms(proxmox, max_age: float = None) -> list:
+    """The /cluster/resources qemu entries, each with its lab metadata under "lab"."""
+    ensure_migrated(proxmox)
+    return [{**vm, "lab": parse(vm.get('tags'))} for vm in cluster_resources.vms(proxmox, max_age)]
+
+def lab_members(proxmox, lab_group_name: str, max_age: float = None) -> list:
+    """The /cluster/resources entries of every VM of lab instance `lab_group_name` ("<group>_cloned<n>")."""
+    return [vm for vm in lab_vms(proxmox, max_age) if instance_name(vm["lab"]) == lab_group_name]
+
+def description_tags(description: str, tags) -> str:
+    """`tags` completed with the lab metadata of a description written before tags were used."""
+    metadata = parse(tags)
+    if 'lab_groups' not in metadata and description_lab_groups(description):
+        tags = with_lab_groups(tags, description_lab_groups(description))
+    match = re.search(r"Lab: (.*?) \| Instance: (\d+)", description)
+    if match and 'lab_instance' not in metadata:
+        lab_name = match.group(1)
+        role = "clone" if lab_name.endswith(" clone") else "added"
+        tags = with_lab_instance(tags, lab_name.replace(' clone', '').replace(' added', ''), int(match.group(2)), role)
+    pool_match = POOL_PATTERN.search(description)
+    if pool_match and 'pool_group' not in metadata:
+        tags = join_tags(split_tags(tags) + [POOL_PREFIX + encode(pool_match.group(1))])
+    return join_tags(split_tags(tags))
+
+def migrate_descriptions(proxmox) -> int:
+    """Writes the tags of every VM whose description carries lab metadata; returns how many were tagged."""
+    vms = cluster_resources.vms(proxmox, max_age=0)
+    configs = map_concurrent(lambda vm: proxmox.nodes(vm['node']).qemu(vm['vmid']).config.get(), vms)
+    updates = []
+    for vm, config in zip(vms, configs):
+        tags = description_tags(config.get('description', ''), config.get('tags', ''))
+        if split_tags(tags) != split_tags(config.get('tags', '')):
+            updates.append((vm, tags))
+    map_concurrent(lambda update: proxmox.nodes(update[0]['node']).qemu(update[0]['vmid']).config.put(tags=update[1]), updates)
+    cluster_resources.invalidate()
+    return len(updates)
+
+def ensure_migrated(proxmox):
+    """Runs migrate_descriptions() once per database, before lab metadata is first read from tags."""
+    if _migrated.is_set():
+        return
+    with timed_lock(migration_lock, "lab_tag_migration", timeout=300):
+        db = SessionLocal()
+        try:
+            if db.query(models.DataMigration).get(MIGRATION_NAME) is None:
+                tagged = migrate_descriptions(proxmox)
+                db.add(models.DataMigration(name=MIGRATION_NAME, applied_at=datetime.utcnow(), detail="{} VMs tagged".format(tagged)))
+                db.commit()
+                logger.info(f"Lab metadata migrated from descriptions to tags on {tagged} VMs.")
+        finally:
+            db.close()
+    _migrated.set()
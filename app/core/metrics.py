@@ -0,0 +1,138 @@
+import os
+import time
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, generate_latest,
+)
+from prometheus_client import multiprocess
+
+# Buckets tuned for the API: most reads return in tens of milliseconds, lab
+# operations (clone + VNET apply) can take minutes.
+REQUEST_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+UPSTREAM_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds", "Latency of API requests, per route template.",
+    ["method", "route", "status"], buckets=REQUEST_BUCKETS,
+)
+PROXMOX_CALL_SECONDS = Histogram(
+    "proxmox_api_call_duration_seconds", "Latency of outbound Proxmox API calls.",
+    ["method", "path", "node"], buckets=UPSTREAM_BUCKETS,
+)
+PROXMOX_CALL_ERRORS = Counter(
+    "proxmox_api_call_errors_total", "Outbound Proxmox API calls that failed (HTTP >= 400 or transport error).",
+    ["method", "path", "node", "status"],
+)
+CACHE_LOOKUPS = Counter(
+    "inventory_cache_lookups_total", "Inventory cache lookups, by cache and result (hit/miss).",
+    ["cache", "result"],
+)
+LOCK_WAIT_SECONDS = Histogram(
+    "lock_wait_seconds", "Time spent waiting to acquire an operation lock.",
+    ["lock"], buckets=(0.001, 0.01, 0.1, 0.5, 1, 5, 15, 30, 60, 120, 300),
+)
+JOB_QUEUE_DEPTH = Gauge(
+    "job_queue_depth", "Background jobs waiting to run, per queue.",
+    ["queue"], multiprocess_mode="livesum",
+)
+
+# Path segments that are followed by an identifier. The identifier is replaced by
+# a placeholder so that e.g. every VM config read shares one label value.
+_ID_SEGMENTS = {
+    "nodes": "{node}", "qemu": "{vmid}", "lxc": "{vmid}", "snapshot": "{snapname}",
+    "tasks": "{upid}", "network": "{iface}", "vnets": "{vnet}", "zones": "{zone}",
+    "storage": "{storage}", "pools": "{poolid}",
+}
+
+def path_template(url: str):
+    """
+    Turns a Proxmox API URL into a low-cardinality label.
+    Returns (template, node), e.g. ('/nodes/{node}/qemu/{vmid}/config', 'pve1').
+    """
+    path = urlsplit(url).path
+    if path.startswith("/api2/json"):
+        path = path[len("/api2/json"):]
+    segments = [segment for segment in path.split("/") if segment]
+    template = []
+    node = ""
+    placeholder = None
+    for segment in segments:
+        if placeholder:
+            if placeholder == "{node}":
+                node = segment
+            template.append(placeholder)
+            placeholder = None
+            continue
+        template.append(segment)
+        placeholder = _ID_SEGMENTS.get(segment)
+    return "/" + "/".join(template), node
+
+class InstrumentedSession:
+    """
+    Wraps the HTTP session used by proxmoxer so every outbound call is timed and
+    counted, whichever router makes it. Observers registered with `add_observer`
+    are called with (method, path, node, seconds, status) after each call.
+    """
+    observers = []
+
+    def __init__(self, session):
+        self._session = session
+
+    def __getattr__(self, item):
+        return getattr(self._session, item)
+
+    @classmethod
+    def add_observer(cls, callback):
+        cls.observers.append(callback)
+
+    def request(self, method, url, *args, **kwargs):
+        path, node = path_template(url)
+        start = time.perf_counter()
+        status = 0
+        try:
+            response = self._session.request(method, url, *args, **kwargs)
+            status = response.status_code
+            return response
+        finally:
+            elapsed = time.perf_counter() - start
+            PROXMOX_CALL_SECONDS.labels(method, path, node).observe(elapsed)
+            if status == 0 or status >= 400:
+                PROXMOX_CALL_ERRORS.labels(method, path, node, str(status) if status else "transport").inc()
+            for observer in self.observers:
+                observer(method, path, node, elapsed, status)
+
+def instrument_connection(proxmox):
+    """Swaps the session of a ProxmoxAPI object for an instrumented one (idempotent)."""
+    session = proxmox._store["session"]
+    if not isinstance(session, InstrumentedSession):
+        proxmox._store["session"] = InstrumentedSession(session)
+    return proxmox
+
+def record_cache_lookup(cache: str, hit: bool):
+    CACHE_LOOKUPS.labels(cache, "hit" if hit else "miss").inc()
+
+@contextmanager
+def timed_lock(lock, name: str, timeout: float):
+    """Acquires a FileLock like `lock.acquire(timeout=...)`, recording how long the wait took."""
+    start = time.perf_counter()
+    try:
+        lock.acquire(timeout=timeout)
+    finally:
+        LOCK_WAIT_SECONDS.labels(name).observe(time.perf_counter() - start)
+    try:
+        yield lock
+    finally:
+        lock.release()
+
+def render_latest():
+    """
+    Returns (body, content_type) for the /metrics endpoint.
+    Under gunicorn with PROMETHEUS_MULTIPROC_DIR set, values are merged across all workers.
+    """
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
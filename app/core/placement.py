@@ -0,0 +1,184 @@
+"""
+Node placement for linked clones.
+
+A Placer is built from one /cluster/resources snapshot and picks a `target` node per clone.
+A node is eligible when it is online, can reach every storage the disks of the template (or of
+one of its replicas, see app/core/replicas.py) live on - shared storages only, unless the copy
+is on that node - and has room for the clone's memory under the headroom. Among eligible nodes the active policy scores each one; every
+placement is reserved on the chosen node, so the clones of one lab spread out instead of all
+looking at the same snapshot. Reservations are also kept in a worker-wide ledger until a newer
+snapshot is fetched, so requests sharing a cached snapshot spread out as well.
+
+Policies are plain scoring functions registered with @placement_policy; PLACEMENT_POLICY
+selects the default.
+"""
+import os
+import time
+import logging
+import threading
+from app.core.inventory import cluster_resources
+from app.core.lab_pipeline import disk_storages
+
+logger = logging.getLogger("proxmox_api")
+
+PLACEMENT_POLICY = os.getenv("PLACEMENT_POLICY", "spread")
+PLACEMENT_MEMORY_HEADROOM = float(os.getenv("PLACEMENT_MEMORY_HEADROOM", "0.1"))
+
+POLICIES = {}
+
+# (time.monotonic(), node, memory, cpus) of placements not yet visible in a /cluster/resources snapshot
+_ledger = []
+_ledger_lock = threading.Lock()
+
+def placement_policy(name: str):
+    """Registers fn(node: NodeState, template_node: str, storages) -> score; the highest score wins."""
+    def register(fn):
+        POLICIES[name] = fn
+        return fn
+    return register
+
+class NodeState:
+    def __init__(self, name: str, maxcpu: int, cpu: float, maxmem: int, mem: int):
+        self.name = name
+        self.maxcpu = maxcpu or 1
+        self.cpu = cpu or 0.0
+        self.maxmem = maxmem or 0
+        self.mem = mem or 0
+        self.running = 0
+        # storage -> {"shared": bool, "free": bytes, "total": bytes}
+        self.storages = {}
+
+    def free_memory_ratio(self) -> float:
+        return max(0.0, 1 - self.mem / self.maxmem) if self.maxmem else 0.0
+
+    def free_storage_ratio(self, storages) -> float:
+        ratios = [self.storages[storage]["free"] / self.storages[storage]["total"]
+                  for storage in storages if self.storages.get(storage, {}).get("total")]
+        return min(ratios) if ratios else 1.0
+
+@placement_policy("spread")
+def _spread(node: NodeState, template_node: str, storages=()) -> float:
+    """Most free memory first, then least CPU and fewest running VMs."""
+    return node.free_memory_ratio() * 0.5 + (1 - min(1.0, node.cpu)) * 0.2 + 0.2 / (1 + node.running) + node.free_storage_ratio(storages) * 0.1
+
+@placement_policy("pack")
+def _pack(node: NodeState, template_node: str, storages=()) -> float:
+    """Fill the busiest node that still fits, keeping whole nodes free."""
+    return 1 - node.free_memory_ratio()
+
+@placement_policy("local")
+def _local(node: NodeState, template_node: str, storages=()) -> float:
+    """The template's own node whenever it fits (the behaviour before placement existed)."""
+    return 1.0 if node.name == template_node else node.free_memory_ratio() * 0.1
+
+class Placer:
+    def __init__(self, resources: list, policy: str = None, headroom: float = PLACEMENT_MEMORY_HEADROOM):
+        policy = policy or PLACEMENT_POLICY
+        if policy not in POLICIES:
+            raise ValueError("Unknown placement policy '{}'. Available: {}".format(policy, ", ".join(sorted(POLICIES))))
+        self.score = POLICIES[policy]
+        self.headroom = headroom
+        self.nodes = {}
+        for entry in resources:
+            if entry.get('type') == 'node' and entry.get('status', 'online') == 'online':
+                self.nodes[entry['node']] = NodeState(entry['node'], entry.get('maxcpu'), entry.get('cpu'), entry.get('maxmem'), entry.get('mem'))
+        for entry in resources:
+            node = self.nodes.get(entry.get('node'))
+            if node is None:
+                continue
+            if entry.get('type') == 'qemu' and entry.get('status') == 'running':
+                node.running += 1
+            elif entry.get('type') == 'storage' and entry.get('status', 'available') == 'available':
+                total = entry.get('maxdisk', 0)
+                node.storages[entry['storage']] = {"shared": bool(entry.get('shared')), "total": total, "free": total - entry.get('disk', 0)}
+
+    def reserve(self, node_name: str, memory: int, cpus: int = 0, record: bool = False):
+        node = self.nodes.get(node_name)
+        if node is not None:
+            node.mem += memory
+            node.running += 1
+            node.cpu += cpus * 0.1 / node.maxcpu
+        if record:
+            record_placement(node_name, memory, cpus)
+
+    def apply_ledger(self, snapshot_time: float):
+        """Re-applies this worker's placements made after the snapshot the placer was built from."""
+        with _ledger_lock:
+            _ledger[:] = [entry for entry in _ledger if entry[0] > snapshot_time]
+            pending = list(_ledger)
+        for _, node_name, memory, cpus in pending:
+            self.reserve(node_name, memory, cpus)
+
+    def reachable(self, node: NodeState, source: dict) -> bool:
+        """Whether a linked clone of `source` can be created on `node`."""
+        return all(storage in node.storages and (node.name == source["node"] or node.storages[storage]["shared"])
+                   for storage in source["storages"])
+
+    def place(self, sources: list, memory: int, cpus: int = 0, strict: bool = False, record: bool = True):
+        """
+        Picks and reserves a node for one clone. `sources` are the template first, then its
+        replicas, as built by template_source(). Returns (target_node, source), the source being
+        the nearest copy of the template to clone from (preferably one on the target node).
+        Without a node that fits, returns the template's own node (so Proxmox reports the real
+        error), or (None, None) when `strict`.
+        """
+        template = sources[0]
+        storages = set().union(*(source["storages"] for source in sources))
+        fitting = [node for node in self.nodes.values()
+                   if any(self.reachable(node, source) for source in sources) and node.mem + memory <= node.maxmem * (1 - self.headroom)]
+        if not fitting:
+            if strict:
+                return None, None
+            logger.warning(f"No node has room for a clone of template {template['vmid']}, leaving it on {template['node']}.")
+            self.reserve(template["node"], memory, cpus, record)
+            return template["node"], template
+        source_nodes = {source["node"] for source in sources}
+        best = max(fitting, key=lambda node: (self.score(node, template["node"], storages), node.name in source_nodes))
+        self.reserve(best.name, memory, cpus, record)
+        return best.name, self.nearest_source(best, sources)
+
+    def nearest_source(self, node: NodeState, sources: list) -> dict:
+        for source in sources:
+            if source["node"] == node.name:
+                return source
+        return next(source for source in sources if self.reachable(node, source))
+
+    def place_all(self, templates: list, strict: bool = False, replicas: dict = None):
+        """
+        Places one clone of every (template_summary, template_config), using `replicas`
+        ({template vmid: [replica sources]}) as extra sources. With `strict`, either every clone
+        fits (returns [(target_node, source), ...] in order) or nothing is reserved (returns None).
+        """
+        snapshot = {name: (node.mem, node.running, node.cpu) for name, node in self.nodes.items()}
+        placements = []
+        for template_summary, template_config in templates:
+            sources = [template_source(template_summary, template_config)] + (replicas or {}).get(template_summary['vmid'], [])
+            target, source = self.place(sources, template_summary.get('maxmem', 0), _cpus(template_summary), strict=strict, record=False)
+            if target is None:
+                for name, (mem, running, cpu) in snapshot.items():
+                    self.nodes[name].mem, self.nodes[name].running, self.nodes[name].cpu = mem, running, cpu
+                return None
+            placements.append((target, source))
+        with _ledger_lock:
+            now = time.monotonic()
+            _ledger.extend((now, target, template_summary.get('maxmem', 0), _cpus(template_summary))
+                           for (target, _), (template_summary, _) in zip(placements, templates))
+        return placements
+
+def template_source(template_summary: dict, template_config: dict) -> dict:
+    return {"node": template_summary['node'], "vmid": template_summary['vmid'], "storages": disk_storages(template_config)}
+
+def record_placement(node_name: str, memory: int, cpus: int = 0):
+    """Counts a placement against `node_name` in later placers of this worker until a newer snapshot shows it."""
+    with _ledger_lock:
+        _ledger.append((time.monotonic(), node_name, memory, cpus))
+
+def _cpus(vm_summary: dict) -> int:
+    # /nodes/{node}/qemu calls it cpus, /cluster/resources maxcpu
+    return vm_summary.get('cpus', vm_summary.get('maxcpu', 0))
+
+def cluster_placer(proxmox, policy: str = None, headroom: float = PLACEMENT_MEMORY_HEADROOM, max_age: float = None) -> Placer:
+    """A Placer over the cached /cluster/resources snapshot plus this worker's pending placements."""
+    placer = Placer(cluster_resources.get(proxmox, max_age), policy, headroom)
+    placer.apply_ledger(cluster_resources.fetched_at)
+    return placer
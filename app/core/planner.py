@@ -0,0 +1,132 @@
+"""
+Pre-flight capacity planning for lab creation.
+
+Before a lab is cloned, the CPU, memory and disk of its templates (their VmRecords, see
+app/core/vm_records.py) are checked against the free capacity in the cached /cluster/resources
+snapshot. Every clone is placed on a node the same way it will be placed for real
+(app/core/placement.py). A node must have the memory (under the placement headroom) and the vCPUs
+(under CPU_OVERCOMMIT x its cores), and each storage must have room for the disks. Linked clones
+start as thin overlays, so only LINKED_CLONE_DISK_FACTOR of their disk size is counted.
+
+An infeasible plan is rejected with CapacityError, or waited on for up to `queue_timeout`
+seconds while capacity frees up.
+"""
+import os
+import time
+import logging
+from app.core.inventory import cluster_resources
+from app.core.metrics import JOB_QUEUE_DEPTH
+from app.core.placement import Placer, cluster_placer, template_source
+
+logger = logging.getLogger("proxmox_api")
+
+CPU_OVERCOMMIT = float(os.getenv("CPU_OVERCOMMIT", "4"))
+LINKED_CLONE_DISK_FACTOR = float(os.getenv("LINKED_CLONE_DISK_FACTOR", "0.2"))
+PLAN_QUEUE_INTERVAL = float(os.getenv("PLAN_QUEUE_INTERVAL", "10"))
+
+GIB = 1024 ** 3
+MIB = 1024 ** 2
+
+class CapacityError(Exception):
+    """The cluster cannot hold the planned lab."""
+    def __init__(self, plan: dict):
+        self.plan = plan
+        super().__init__("Not enough capacity for the lab: {}".format("; ".join(plan["shortfalls"])))
+
+def footprint(record) -> dict:
+    """vCPUs, memory and disk of one VM from its parsed config (a VmRecord)."""
+    return {
+        "cpus": int(record.cores or 1) * int(record.sockets or 1),
+        "memory_mb": int(record.memory_mb or 512),
+        "disks": [(disk.storage, disk.size_gb) for disk in record.disks],
+    }
+
+def plan_clones(resources: list, templates: list, replicas: dict = None, policy: str = None, linked: bool = True, placer=None) -> dict:
+    """
+    `templates` is a list of (template_summary, template_config, VmRecord), one entry per clone.
+    Returns the plan: totals, the node chosen per clone, free capacity left per node/storage,
+    and the shortfalls that make it infeasible (empty when it fits).
+    """
+    placer = placer or Placer(resources, policy)
+    allocated_cpus = {}
+    for entry in resources:
+        if entry.get('type') == 'qemu' and entry.get('status') == 'running':
+            allocated_cpus[entry['node']] = allocated_cpus.get(entry['node'], 0) + int(entry.get('maxcpu') or 0)
+    free_cpus = {name: node.maxcpu * CPU_OVERCOMMIT - allocated_cpus.get(name, 0) for name, node in placer.nodes.items()}
+    free_disk = {}
+    for name, node in placer.nodes.items():
+        for storage, info in node.storages.items():
+            # A shared storage is the same pool seen from every node.
+            free_disk[storage if info["shared"] else "{}:{}".format(name, storage)] = info["free"]
+
+    totals = {"vms": 0, "cpus": 0, "memory_mb": 0, "disk_gb": 0}
+    placements = []
+    shortfalls = []
+    disk_factor = LINKED_CLONE_DISK_FACTOR if linked else 1.0
+    for template_summary, template_config, record in templates:
+        needs = footprint(record)
+        totals["vms"] += 1
+        totals["cpus"] += needs["cpus"]
+        totals["memory_mb"] += needs["memory_mb"]
+        totals["disk_gb"] += sum(size for _, size in needs["disks"])
+        sources = [template_source(template_summary, template_config)] + (replicas or {}).get(template_summary['vmid'], [])
+        target, source = placer.place(sources, needs["memory_mb"] * MIB, needs["cpus"], strict=True, record=False)
+        name = template_summary.get('name', template_summary['vmid'])
+        if target is None:
+            shortfalls.append("no node has {} MiB of memory free for a clone of {}".format(needs["memory_mb"], name))
+            placements.append({"template": template_summary['vmid'], "node": None})
+            continue
+        placements.append({"template": template_summary['vmid'], "node": target, "source": source["vmid"]})
+        free_cpus[target] -= needs["cpus"]
+        if free_cpus[target] < 0:
+            shortfalls.append("node {} runs out of vCPUs (overcommit {}x) for a clone of {}".format(target, CPU_OVERCOMMIT, name))
+        for storage, size in needs["disks"]:
+            key = storage if placer.nodes[target].storages.get(storage, {}).get("shared") else "{}:{}".format(target, storage)
+            if key in free_disk:
+                free_disk[key] -= size * disk_factor * GIB
+                if free_disk[key] < 0:
+                    shortfalls.append("storage {} runs out of space for a clone of {}".format(key, name))
+    # Repeated clones of one template hit the same limit over and over; report each reason once, with a count.
+    counts = {}
+    for shortfall in shortfalls:
+        counts[shortfall] = counts.get(shortfall, 0) + 1
+    shortfalls = [reason if count == 1 else "{} (x{})".format(reason, count) for reason, count in counts.items()]
+    return {
+        "feasible": not shortfalls,
+        "totals": totals,
+        "placements": placements,
+        "free_after": {
+            "nodes": {name: {"memory_mb": int((node.maxmem * (1 - placer.headroom) - node.mem) // MIB), "vcpus": round(free_cpus[name], 1)}
+                      for name, node in sorted(placer.nodes.items())},
+            "storages": {key: round(free / GIB, 1) for key, free in sorted(free_disk.items())},
+        },
+        "shortfalls": shortfalls,
+    }
+
+def ensure_capacity(proxmox, templates: list, replicas: dict = None, policy: str = None, linked: bool = True, queue_timeout: float = 0) -> dict:
+    """
+    Plans `templates` against the cached cluster state and returns the plan when it fits.
+    Otherwise waits (re-reading the cluster every PLAN_QUEUE_INTERVAL seconds) for up to
+    `queue_timeout` seconds, then raises CapacityError with the last plan.
+    """
+    deadline = time.monotonic() + queue_timeout
+    max_age = None
+    queued = False
+    try:
+        while True:
+            placer = cluster_placer(proxmox, policy, max_age=max_age)
+            plan = plan_clones(cluster_resources.get(proxmox), templates, replicas, policy, linked, placer=placer)
+            if plan["feasible"] or time.monotonic() >= deadline:
+                break
+            if not queued:
+                queued = True
+                JOB_QUEUE_DEPTH.labels("capacity_wait").inc()
+                logger.info(f"Lab creation waiting for capacity: {plan['shortfalls']}")
+            time.sleep(min(PLAN_QUEUE_INTERVAL, max(0.0, deadline - time.monotonic())))
+            max_age = 0
+    finally:
+        if queued:
+            JOB_QUEUE_DEPTH.labels("capacity_wait").dec()
+    if not plan["feasible"]:
+        raise CapacityError(plan)
+    return plan
@@ -1,6 +1,7 @@
 import os
 import logging
 from app.logging_helper import save_error
+from app.core.metrics import instrument_connection
 from fastapi import HTTPException
 from proxmoxer import ProxmoxAPI
 from dotenv import load_dotenv
@@ -12,12 +13,16 @@ PROXMOX_HOST = os.getenv("PROXMOX_HOST")
 PROXMOX_USER = os.getenv("PROXMOX_USER")
 PROXMOX_TOKEN_NAME = os.getenv("PROXMOX_TOKEN_NAME")
 PROXMOX_TOKEN_VALUE = os.getenv("PROXMOX_TOKEN_VALUE")
+# Set to 1, a YAML config path or an http:// URL to use the simulated cluster (see app/core/simulator.py).
+PROXMOX_SIMULATOR = os.getenv("PROXMOX_SIMULATOR")
 
 logger = logging.getLogger("proxmox_api")
 
 def get_proxmox_connection():
-    logger.info(f"Attempting to connect to Proxmox host: {PROXMOX_HOST}")
     """Helper function to connect to the Proxmox API."""
+    if PROXMOX_SIMULATOR:
+        return _get_simulator_connection()
+    logger.info(f"Attempting to connect to Proxmox host: {PROXMOX_HOST}")
     try:
         full_user_string = "{}!{}".format(PROXMOX_USER, PROXMOX_TOKEN_NAME)
         proxmox = ProxmoxAPI(
@@ -27,9 +32,16 @@ def get_proxmox_connection():
             token_value=PROXMOX_TOKEN_VALUE,
             verify_ssl=False
         )
+        instrument_connection(proxmox)
         proxmox.version.get()
         logger.info("Successfully connected to Proxmox API.")
         return proxmox
     except Exception as e:
         logger.critical(f"Failed to connect to Proxmox API. {save_error(e)}")
         raise HTTPException(status_code=500, detail=str(e))
+
+def _get_simulator_connection():
+    from app.core import simulator
+    if PROXMOX_SIMULATOR.startswith(("http://", "https://")):
+        return instrument_connection(simulator.connect_remote(PROXMOX_SIMULATOR))
+    return instrument_connection(simulator.connect(simulator.get_cluster()))
@@ -0,0 +1,130 @@
+"""
+Template replicas.
+
+A linked clone is created by the node holding its template, so every lab instance used to queue
+on that one node. A replica is a full copy of a tagged template on another node or storage,
+converted to a template itself; clones are then served by whichever copy is nearest to the node
+the placer picked (app/core/placement.py), and clone throughput grows with the number of nodes
+holding a copy.
+
+Replicas are described as "TemplateReplica: <template vmid>" (without the template's LabGroups
+line or lab group tags, so lab instantiation never clones a replica as a lab member of its own)
+and recorded in the template_replicas table, which is the index read on every instantiation. A digest of the
+template's config is stored with each replica so stale copies show up after the template is edited. It leaves out
+the keys a copy does not take from its template (see source_digest()): Proxmox's own config digest changes on
+any edit, tags and description included.
+"""
+import re
+import json
+import hashlib
+import logging
+from datetime import datetime
+from app import models
+from app.database import SessionLocal
+from app.core.inventory import vm_node_index
+from app.core import lab_tags
+from app.core.lab_pipeline import disk_storages, remove_vm
+from app.core.tasks import is_upid, wait_for_task
+
+logger = logging.getLogger("proxmox_api")
+
+REPLICA_DESCRIPTION = "TemplateReplica: {}"
+# Template config keys that do not change what a replica (or a clone of it) gets
+DIGEST_IGNORED_KEYS = frozenset(("digest", "description", "tags", "name", "lock"))
+
+def load_index(db=None) -> dict:
+    """{template vmid: [TemplateReplica, ...]} from the database."""
+    own_session = db is None
+    db = db or SessionLocal()
+    try:
+        index = {}
+        for replica in db.query(models.TemplateReplica).all():
+            index.setdefault(replica.template_vmid, []).append(replica)
+        if own_session:
+            db.expunge_all()
+        return index
+    finally:
+        if own_session:
+            db.close()
+
+def replica_vmids(db=None) -> set:
+    """VMIDs of every recorded replica. Paths that clone "every template" must skip them: a replica is a template too."""
+    return {replica.replica_vmid for replicas in load_index(db).values() for replica in replicas}
+
+def replica_sources(index: dict, all_vms: list) -> dict:
+    """
+    Placement sources ({template vmid: [{"node", "vmid", "storages"}, ...]}) for the replicas
+    that still exist as templates on the recorded node. Missing replicas are skipped.
+    """
+    live = {(vm['vmid'], vm['node']) for vm in all_vms if vm.get('template') == 1}
+    sources = {}
+    for template_vmid, replicas in index.items():
+        for replica in replicas:
+            if (replica.replica_vmid, replica.node) in live:
+                sources.setdefault(template_vmid, []).append({"node": replica.node, "vmid": replica.replica_vmid, "storages": {replica.storage}})
+    return sources
+
+def _replica_description(template_vmid: int, template_description: str) -> str:
+    description = re.sub(r"LabGroups:\[.*?\]\n?", "", template_description).strip()
+    return "{}\n{}".format(description, REPLICA_DESCRIPTION.format(template_vmid)).strip()
+
+def replicate_template(proxmox, template_node: str, template_vmid: int, template_config: dict, template_name: str,
+                       target_node: str, target_storage: str, new_vmid: int, storages: dict) -> int:
+    """
+    Copies a template to `target_storage` on `target_node` as template `new_vmid`.
+    `storages` is {storage: shared} for the storages of `template_node`. A template on shared
+    storage is full-cloned straight to the target; otherwise it is full-cloned on its own node
+    and migrated offline. Returns the replica's vmid once it is a template.
+    """
+    clone_params = {"newid": new_vmid, "name": "{}-replica-{}".format(template_name, target_node), "full": 1,
+                    "description": _replica_description(template_vmid, template_config.get('description', ''))}
+    source_shared = all(storages.get(storage) for storage in disk_storages(template_config))
+    migrate = target_node != template_node and not source_shared
+    if target_node != template_node and not migrate:
+        clone_params["target"] = target_node
+    if target_storage in storages or clone_params.get("target"):
+        clone_params["storage"] = target_storage
+    upid = proxmox.nodes(template_node).qemu(template_vmid).clone.post(**clone_params)
+    if is_upid(upid):
+        wait_for_task(proxmox, template_node, upid)
+    # With "target" the clone is created on the target node
+    clone_node = target_node if "target" in clone_params else template_node
+    try:
+        if lab_tags.parse(template_config.get('tags')).get('lab_groups'):
+            # The copy carries the template's lab group tags too; like its description, it must not be a lab template itself.
+            proxmox.nodes(clone_node).qemu(new_vmid).config.put(**lab_tags.tag_update(lab_tags.with_lab_groups(template_config.get('tags'), [])))
+        if migrate:
+            upid = proxmox.nodes(clone_node).qemu(new_vmid).migrate.post(target=target_node, targetstorage=target_storage)
+            if is_upid(upid):
+                wait_for_task(proxmox, clone_node, upid)
+            clone_node = target_node
+        vm_node_index.record(new_vmid, target_node)
+        upid = proxmox.nodes(target_node).qemu(new_vmid).template.post()
+        if is_upid(upid):
+            wait_for_task(proxmox, target_node, upid)
+    except Exception:
+        # Do not leave an untracked full copy behind
+        try:
+            remove_vm(proxmox, clone_node, new_vmid)
+        except Exception as cleanup_error:
+            logger.warning(f"Could not delete the partial replica {new_vmid} on {clone_node}: {cleanup_error}")
+        raise
+    logger.info(f"Template {template_vmid} replicated to {target_node}:{target_storage} as {new_vmid}.")
+    return new_vmid
+
+def source_digest(template_config: dict) -> str:
+    """Digest of the parts of a template config that a replica copies."""
+    content = json.dumps({key: value for key, value in template_config.items() if key not in DIGEST_IGNORED_KEYS}, sort_keys=True, default=str)
+    return hashlib.sha1(content.encode()).hexdigest()
+
+def is_stale(replica, template_config: dict) -> bool:
+    """Whether the template changed in a way its replica does not reflect."""
+    if replica.source_digest is None:
+        return False
+    # Replicas recorded before source_digest() hold Proxmox's config digest
+    return replica.source_digest not in (source_digest(template_config), template_config.get('digest'))
+
+def record_replica(db, template_vmid: int, replica_vmid: int, node: str, storage: str, source_digest: str):
+    db.add(models.TemplateReplica(template_vmid=template_vmid, replica_vmid=replica_vmid, node=node, storage=storage,
+                                  source_digest=source_digest, created_at=datetime.utcnow()))
+    db.commit()
@@ -0,0 +1,31 @@
+"""
+JSON response encoding.
+
+Responses are encoded with orjson (the app's default response class is FastAPI's
+ORJSONResponse) instead of json.dumps. Large documents that are mostly made of cached parts,
+like the hardware details of GET /vms (see VmRecord.to_json), are assembled from the parts'
+already-encoded JSON with encode_object / encode_array and returned as EncodedJSONResponse,
+which skips both FastAPI's jsonable_encoder and a second encoding of the cached parts.
+"""
+import orjson
+from starlette.responses import Response
+
+def dumps(content) -> bytes:
+    """Encodes like the default response class (ORJSONResponse)."""
+    return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+
+def encode_object(fields: dict, encoded: dict = None) -> bytes:
+    """The JSON object of `fields` plus the members of `encoded`, whose values are already JSON (bytes)."""
+    body = dumps(fields)
+    if not encoded:
+        return body
+    members = b",".join(dumps(key) + b":" + value for key, value in encoded.items())
+    return body[:-1] + (b"," if fields else b"") + members + b"}"
+
+def encode_array(items) -> bytes:
+    """The JSON array of `items`, each already JSON (bytes)."""
+    return b"[" + b",".join(items) + b"]"
+
+class EncodedJSONResponse(Response):
+    """A response whose body is already JSON."""
+    media_type = "application/json"
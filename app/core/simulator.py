@@ -0,0 +1,806 @@
+"""
+In-process stand-in for the Proxmox VE API.
+
+`SimulatedCluster` models nodes, qemu VMs/templates with their configs, linked
+clones, snapshots, Linux bridges, SDN zones/VNETs, storage and asynchronous tasks
+with UPIDs. Per-endpoint latency and per-task-type duration are configurable, so
+router code can be exercised and timed deterministically without a real cluster.
+
+Two ways to use it:
+
+* In-process: set `PROXMOX_SIMULATOR=1` (or the path of a YAML config) and
+  `get_proxmox_connection()` returns a proxmoxer resource backed by the simulator.
+* Over HTTP, shared by several gunicorn workers: run
+  `python -m app.core.simulator --port 8006 [--config sim.yaml]` and set
+  `PROXMOX_SIMULATOR=http://127.0.0.1:8006`.
+
+Example config:
+
+    time_scale: 1.0          # multiplies every latency and task duration (0 = instant)
+    latency:                 # seconds, keyed by "METHOD /template", "/template" or "*"
+      "*": 0.005
+      GET /cluster/resources: 0.04
+    task_durations:          # seconds, keyed by Proxmox task type or "*"
+      qmclone: 3.0
+      qmstart: 1.0
+    synthetic:               # arguments of SimulatedCluster.synthetic()
+      nodes: 3
+      vms: 200
+      lab_instances: 5
+"""
+import os
+import re
+import json
+import time
+import hashlib
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+import yaml
+from proxmoxer.core import ProxmoxResource
+from proxmoxer.backends.https import JsonSerializer
+from app.core.metrics import path_template
+
+GIB = 1024 ** 3
+MIB = 1024 ** 2
+
+DEFAULT_LATENCY = {"*": 0.0}
+DEFAULT_TASK_DURATIONS = {
+    "*": 0.5,
+    "qmclone": 2.0,
+    "qmstart": 1.0,
+    "qmstop": 0.5,
+    "qmshutdown": 2.0,
+    "qmdestroy": 0.5,
+    "qmsnapshot": 1.0,
+    "qmrollback": 1.5,
+    "qmdelsnapshot": 0.5,
+    "qmigrate": 5.0,
+    "qmtemplate": 1.0,
+    "reloadnetworkall": 1.0,
+}
+# Parameters accepted by POST /nodes/{node}/qemu/{vmid}/clone on a real cluster.
+CLONE_PARAMS = {"newid", "name", "description", "full", "target", "storage", "format", "pool", "snapname", "bwlimit"}
+DISK_PREFIXES = ("scsi", "sata", "ide", "virtio")
+
+class SimulatorError(Exception):
+    def __init__(self, status_code: int, message: str):
+        self.status_code = status_code
+        self.message = message
+        super().__init__(message)
+
+def _int(value, default=None):
+    if value is None or value == "":
+        return default
+    return int(value)
+
+class SimulatedCluster:
+    """Thread-safe model of a Proxmox cluster. All API calls go through `handle()`."""
+
+    def __init__(self, latency: dict = None, task_durations: dict = None, time_scale: float = 1.0):
+        self.latency = {**DEFAULT_LATENCY, **(latency or {})}
+        self.task_durations = {**DEFAULT_TASK_DURATIONS, **(task_durations or {})}
+        self.time_scale = time_scale
+        self.nodes = {}
+        self.vms = {}
+        self.zones = {}
+        self.vnets = {}
+        self.tasks = {}
+        self.calls = 0
+        self._lock = threading.RLock()
+        self._mac_counter = 0
+        self._pid = 1000
+        self._routes = [
+            ("GET", r"/version", self._get_version),
+            ("GET", r"/nodes", self._list_nodes),
+            ("GET", r"/nodes/(?P<node>[^/]+)/status", self._node_status),
+            ("GET", r"/nodes/(?P<node>[^/]+)/rrddata", self._node_rrddata),
+            ("GET", r"/nodes/(?P<node>[^/]+)/storage", self._node_storage),
+            ("GET", r"/nodes/(?P<node>[^/]+)/qemu", self._list_qemu),
+            ("POST", r"/nodes/(?P<node>[^/]+)/qemu", self._create_qemu),
+            ("GET", r"/nodes/(?P<node>[^/]+)/qemu/(?P<vmid>\d+)/config", self._get_config),
+            ("PUT", r"/nodes/(?P<node>[^/]+)/qemu/(?P<vmid>\d+)/config", self._put_config),
+            ("POST", r"/nodes/(?P<node>[^/]+)/qemu/(?P<vmid>\d+)/config", self._put_config),
+            ("DELETE", r"/nodes/(?P<node>[^/]+)/qemu/(?P<vmid>\d+)", self._delete_qemu),
+            ("GET", r"/nodes/(?P<node>[^/]+)/qemu/(?P<vmid>\d+)/status/current", self._vm_status),
+            ("POST", r"/nodes/(?P<node>[^/]+)/qemu/(?P<vmid>\d+)/status/(?P<action>start|stop|shutdown|reboot)", self._vm_action),
+            ("POST", r"/nodes/(?P<node>[^/]+)/qemu/(?P<vmid>\d+)/clone", self._clone),
+            ("POST", r"/nodes/(?P<node>[^/]+)/qemu/(?P<vmid>\d+)/template", self._make_template),
+            ("POST", r"/nodes/(?P<node>[^/]+)/qemu/(?P<vmid>\d+)/migrate", self._migrate),
+            ("GET", r"/nodes/(?P<node>[^/]+)/qemu/(?P<vmid>\d+)/snapshot", self._list_snapshots),
+            ("POST", r"/nodes/(?P<node>[^/]+)/qemu/(?P<vmid>\d+)/snapshot", self._create_snapshot),
+            ("POST", r"/nodes/(?P<node>[^/]+)/qemu/(?P<vmid>\d+)/snapshot/(?P<snapname>[^/]+)/rollback", self._rollback_snapshot),
+            ("DELETE", r"/nodes/(?P<node>[^/]+)/qemu/(?P<vmid>\d+)/snapshot/(?P<snapname>[^/]+)", self._delete_snapshot),
+            ("GET", r"/nodes/(?P<node>[^/]+)/tasks/(?P<upid>[^/]+)/status", self._task_status),
+            ("GET", r"/nodes/(?P<node>[^/]+)/network", self._list_network),
+            ("POST", r"/nodes/(?P<node>[^/]+)/network", self._create_network),
+            ("PUT", r"/nodes/(?P<node>[^/]+)/network", self._apply_network),
+            ("DELETE", r"/nodes/(?P<node>[^/]+)/network/(?P<iface>[^/]+)", self._delete_network),
+            ("GET", r"/cluster/resources", self._cluster_resources),
+            ("GET", r"/cluster/nextid", self._next_id),
+            ("GET", r"/cluster/sdn/zones", self._list_zones),
+            ("POST", r"/cluster/sdn/zones", self._create_zone),
+            ("DELETE", r"/cluster/sdn/zones/(?P<zone>[^/]+)", self._delete_zone),
+            ("GET", r"/cluster/sdn/vnets", self._list_vnets),
+            ("POST", r"/cluster/sdn/vnets", self._create_vnet),
+            ("PUT", r"/cluster/sdn/vnets/(?P<vnet>[^/]+)", self._update_vnet),
+            ("DELETE", r"/cluster/sdn/vnets/(?P<vnet>[^/]+)", self._delete_vnet),
+            ("PUT", r"/cluster/sdn", self._apply_sdn),
+        ]
+        self._routes = [(method, re.compile(pattern + r"/?$"), handler) for method, pattern, handler in self._routes]
+
+    # --- Building the cluster ---
+
+    def add_node(self, name: str, maxcpu: int = 32, maxmem_gb: int = 256, local_storage_gb: int = 2000, shared_storage: dict = None):
+        with self._lock:
+            storages = {"local-lvm": {"total": local_storage_gb * GIB, "shared": 0, "type": "lvmthin"}}
+            for storage_name, total_gb in (shared_storage or {}).items():
+                storages[storage_name] = {"total": total_gb * GIB, "shared": 1, "type": "rbd"}
+            self.nodes[name] = {
+                "maxcpu": maxcpu, "maxmem": maxmem_gb * GIB, "storages": storages,
+                "network": {"vmbr0": {"iface": "vmbr0", "type": "bridge", "active": 1, "autostart": 1, "comments": "Management"}},
+                "pending_network": {},
+            }
+
+    def add_vm(self, node: str, vmid: int, name: str, template: bool = False, cores: int = 2, memory: int = 2048,
+               disk_gb: int = 32, storage: str = "local-lvm", bridge: str = "vmbr0", description: str = "",
+               status: str = "stopped", tags: str = "", nics: int = 1):
+        with self._lock:
+            prefix = "base" if template else "vm"
+            config = {
+                "name": name, "cores": cores, "sockets": 1, "cpu": "x86-64-v2-AES", "memory": memory,
+                "boot": "order=scsi0;net0", "ostype": "l26", "scsihw": "virtio-scsi-single",
+                "scsi0": "{}:{}-{}-disk-0,size={}G".format(storage, prefix, vmid, disk_gb),
+                "digest": "0" * 40,
+            }
+            for index in range(nics):
+                config["net{}".format(index)] = "virtio={},bridge={}".format(self._new_mac(), bridge)
+            if description:
+                config["description"] = description
+            if tags:
+                config["tags"] = tags
+            if template:
+                config["template"] = 1
+            self.vms[vmid] = {"node": node, "config": config, "status": "running" if status == "running" and not template else "stopped",
+                              "snapshots": {}, "lock": None, "started": time.time()}
+
+    def add_zone(self, zone: str, type: str = "vlan", bridge: str = "vmbr0"):
+        with self._lock:
+            self.zones[zone] = {"zone": zone, "type": type, "bridge": bridge}
+
+    def add_vnet(self, vnet: str, zone: str, tag: int = None):
+        with self._lock:
+            self.vnets[vnet] = {"vnet": vnet, "zone": zone, "tag": tag, "type": "vnet"}
+
+    @classmethod
+    def synthetic(cls, nodes: int = 3, vms: int = 200, templates: int = 6, lab_groups=("WebLab", "ADLab"),
+                  lab_instances: int = 0, running_ratio: float = 0.5, shared_storage: bool = True, seed: int = 42,
+                  lab_tags: bool = True, maxcpu: int = 32, maxmem_gb: int = 256, **kwargs):
+        """
+        Builds a deterministic cluster: `templates` templates on the first node, tagged
+        round-robin into `lab_groups`; `lab_instances` instantiated labs (linked clones on
+        their own VNET, as `instantiate_lab` would leave them); and plain VMs up to `vms`.
+        Without `lab_tags`, lab membership is only in the descriptions, as it was before
+        app/core/lab_tags.py. Every node has `maxcpu` cores and `maxmem_gb` GiB of memory.
+        """
+        rng = random.Random(seed)
+        cluster = cls(**kwargs)
+        node_names = ["pve{}".format(index + 1) for index in range(nodes)]
+        for node_name in node_names:
+            cluster.add_node(node_name, maxcpu=maxcpu, maxmem_gb=maxmem_gb, shared_storage={"ceph": 8000} if shared_storage else None)
+        cluster.add_zone("labzone", type="vlan", bridge="vmbr0")
+
+        template_storage = "ceph" if shared_storage else "local-lvm"
+        group_templates = {group: [] for group in lab_groups}
+        for index in range(templates):
+            vmid = 100 + index
+            group = lab_groups[index % len(lab_groups)] if lab_groups else None
+            description = "LabGroups:[{}]".format(group) if group else ""
+            cluster.add_vm(node_names[0], vmid, "tpl-{}".format(index), template=True, cores=rng.choice((1, 2, 4)),
+                           memory=rng.choice((1024, 2048, 4096)), disk_gb=rng.choice((16, 32, 64)), storage=template_storage,
+                           description=description, tags="labgroup-{}".format(group) if group and lab_tags else "", nics=rng.choice((1, 1, 2)))
+            if group:
+                group_templates[group].append(vmid)
+
+        created = templates
+        for instance in range(1, lab_instances + 1):
+            group = lab_groups[(instance - 1) % len(lab_groups)]
+            vnet = "vnet{}".format(instance)
+            cluster.add_vnet(vnet, "labzone", tag=100 + instance)
+            for offset, template_id in enumerate(group_templates[group]):
+                vmid = instance * 1000 + offset
+                source = cluster.vms[template_id]["config"]
+                cluster.add_vm(node_names[0], vmid, "{}-{}-{}".format(group.lower(), source["name"], vmid),
+                               cores=source["cores"], memory=source["memory"], bridge=vnet,
+                               description="Lab: {} clone | Instance: {}".format(group, instance),
+                               tags="lab-{}.{};labrole-clone".format(group, instance) if lab_tags else "",
+                               status="running" if rng.random() < running_ratio else "stopped")
+                cluster.vms[vmid]["config"]["scsi0"] = "{}:base-{}-disk-0/vm-{}-disk-0,size=32G".format(template_storage, template_id, vmid)
+                created += 1
+
+        vmid = 500000
+        while created < vms:
+            cluster.add_vm(node_names[created % nodes], vmid, "vm-{}".format(vmid), cores=rng.choice((1, 2, 4, 8)),
+                           memory=rng.choice((1024, 2048, 4096, 8192)), disk_gb=rng.choice((16, 32, 64, 128)),
+                           status="running" if rng.random() < running_ratio else "stopped")
+            vmid += 1
+            created += 1
+        return cluster
+
+    @classmethod
+    def from_config(cls, config: dict):
+        options = {key: config[key] for key in ("latency", "task_durations", "time_scale") if key in config}
+        return cls.synthetic(**config.get("synthetic", {}), **options)
+
+    # --- Request handling ---
+
+    def handle(self, method: str, path: str, data: dict = None):
+        """Serves one API call. `path` is relative to /api2/json. Returns the `data` member of the response."""
+        template, _ = path_template(path)
+        delay = self.latency.get("{} {}".format(method, template), self.latency.get(template, self.latency["*"]))
+        if delay and self.time_scale:
+            time.sleep(delay * self.time_scale)
+        with self._lock:
+            self.calls += 1
+            self._advance_tasks()
+            for route_method, pattern, handler in self._routes:
+                if route_method != method:
+                    continue
+                match = pattern.match(path)
+                if match:
+                    return handler(data or {}, **match.groupdict())
+        raise SimulatorError(501, "Method '{} {}' not implemented".format(method, path))
+
+    def wait_for_tasks(self, timeout: float = 60):
+        """Blocks until every task has finished (useful between benchmark phases)."""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self._lock:
+                self._advance_tasks()
+                if all(task["status"] == "stopped" for task in self.tasks.values()):
+                    return
+            time.sleep(0.01)
+
+    # --- Internal helpers ---
+
+    def _new_mac(self):
+        self._mac_counter += 1
+        value = self._mac_counter
+        return "BC:24:11:{:02X}:{:02X}:{:02X}".format((value >> 16) & 0xFF, (value >> 8) & 0xFF, value & 0xFF)
+
+    def _node(self, node):
+        if node not in self.nodes:
+            raise SimulatorError(500, "no such cluster node '{}'".format(node))
+        return self.nodes[node]
+
+    def _vm(self, node, vmid):
+        vmid = int(vmid)
+        vm = self.vms.get(vmid)
+        if vm is None or vm["node"] != node:
+            raise SimulatorError(500, "Configuration file 'nodes/{}/qemu-server/{}.conf' does not exist".format(node, vmid))
+        return vmid, vm
+
+    def _check_unlocked(self, vmid, vm):
+        if vm["lock"]:
+            raise SimulatorError(500, "VM {} is locked ({})".format(vmid, vm["lock"]))
+
+    def _start_task(self, node, task_type, object_id, on_complete=None, lock=None):
+        self._pid += 1
+        now = time.time()
+        upid = "UPID:{}:{:08X}:{:08X}:{:08X}:{}:{}:root@pam:".format(node, self._pid, self._pid * 7, int(now), task_type, object_id)
+        duration = self.task_durations.get(task_type, self.task_durations["*"]) * self.time_scale
+        self.tasks[upid] = {"upid": upid, "node": node, "type": task_type, "id": str(object_id), "status": "running",
+                            "exitstatus": None, "starttime": int(now), "ends": time.monotonic() + duration,
+                            "on_complete": on_complete, "lock": lock}
+        if duration <= 0:
+            self._advance_tasks()
+        return upid
+
+    def _advance_tasks(self):
+        now = time.monotonic()
+        for task in self.tasks.values():
+            if task["status"] != "running" or task["ends"] > now:
+                continue
+            task["status"] = "stopped"
+            try:
+                if task["on_complete"]:
+                    task["on_complete"]()
+                task["exitstatus"] = "OK"
+            except SimulatorError as e:
+                task["exitstatus"] = e.message
+            if task["lock"] is not None:
+                vm = self.vms.get(task["lock"])
+                if vm is not None:
+                    vm["lock"] = None
+
+    def _vm_resources(self, vm):
+        config = vm["config"]
+        disk = 0
+        for key, value in config.items():
+            if key.startswith(DISK_PREFIXES) and "size=" in str(value):
+                disk += int(re.search(r"size=(\d+)", str(value)).group(1)) * GIB
+        return int(config.get("cores", 1)) * int(config.get("sockets", 1)), int(config.get("memory", 512)) * MIB, disk
+
+    def _vm_summary(self, vmid, vm):
+        cpus, maxmem, maxdisk = self._vm_resources(vm)
+        running = vm["status"] == "running"
+        summary = {
+            "vmid": vmid, "name": vm["config"].get("name"), "status": vm["status"], "cpus": cpus, "maxmem": maxmem,
+            "mem": maxmem // 2 if running else 0, "maxdisk": maxdisk, "disk": 0,
+            "cpu": 0.05 if running else 0, "uptime": int(time.time() - vm["started"]) if running else 0,
+            "tags": vm["config"].get("tags", ""),
+        }
+        if vm["config"].get("template"):
+            summary["template"] = 1
+        if vm["lock"]:
+            summary["lock"] = vm["lock"]
+        return summary
+
+    def _node_usage(self, node):
+        running = [vm for vm in self.vms.values() if vm["node"] == node and vm["status"] == "running"]
+        booting = [task for task in self.tasks.values() if task["node"] == node and task["status"] == "running" and task["type"] == "qmstart"]
+        info = self.nodes[node]
+        cpu = min(1.0, sum(self._vm_resources(vm)[0] for vm in running) * 0.1 / info["maxcpu"] + 0.1 * len(booting))
+        mem = sum(self._vm_resources(vm)[1] for vm in running)
+        return {"cpu": round(cpu, 4), "mem": mem, "iowait": round(min(0.9, 0.04 * len(booting)), 4), "running": len(running)}
+
+    def _storage_used(self, node, storage):
+        used = 0
+        for vm in self.vms.values():
+            for key, value in vm["config"].items():
+                if not key.startswith(DISK_PREFIXES) or not str(value).startswith(storage + ":"):
+                    continue
+                if not self.nodes[node]["storages"][storage]["shared"] and vm["node"] != node:
+                    continue
+                size = int(re.search(r"size=(\d+)", str(value)).group(1)) * GIB
+                # Linked clones only consume a fraction of their nominal size.
+                used += size // 10 if "/" in str(value).split(",")[0] else size
+        return used
+
+    # --- Endpoints ---
+
+    def _get_version(self, data):
+        return {"version": "8.2.4", "release": "8.2", "repoid": "simulator"}
+
+    def _list_nodes(self, data):
+        result = []
+        for name, info in self.nodes.items():
+            usage = self._node_usage(name)
+            result.append({"node": name, "status": "online", "type": "node", "cpu": usage["cpu"], "maxcpu": info["maxcpu"],
+                           "mem": usage["mem"], "maxmem": info["maxmem"], "uptime": 86400})
+        return result
+
+    def _node_status(self, data, node):
+        info = self._node(node)
+        usage = self._node_usage(node)
+        return {"cpu": usage["cpu"], "wait": usage["iowait"], "cpuinfo": {"cpus": info["maxcpu"]},
+                "memory": {"total": info["maxmem"], "used": usage["mem"], "free": info["maxmem"] - usage["mem"]},
+                "loadavg": [str(round(usage["cpu"] * info["maxcpu"], 2))] * 3, "uptime": 86400}
+
+    def _node_rrddata(self, data, node):
+        self._node(node)
+        usage = self._node_usage(node)
+        now = int(time.time())
+        return [{"time": now - 60 * index, "cpu": usage["cpu"], "iowait": usage["iowait"], "memused": usage["mem"]} for index in range(5)]
+
+    def _node_storage(self, data, node):
+        info = self._node(node)
+        result = []
+        for name, storage in info["storages"].items():
+            used = self._storage_used(node, name)
+            result.append({"storage": name, "type": storage["type"], "shared": storage["shared"], "active": 1, "enabled": 1,
+                           "content": "images,rootdir", "total": storage["total"], "used": used, "avail": storage["total"] - used})
+        return result
+
+    def _list_qemu(self, data, node):
+        self._node(node)
+        return [self._vm_summary(vmid, vm) for vmid, vm in self.vms.items() if vm["node"] == node]
+
+    def _create_qemu(self, data, node):
+        self._node(node)
+        vmid = _int(data.get("vmid"))
+        if vmid in self.vms:
+            raise SimulatorError(500, "VM {} already exists".format(vmid))
+        self.vms[vmid] = {"node": node, "config": {key: value for key, value in data.items() if key != "vmid"},
+                          "status": "stopped", "snapshots": {}, "lock": None, "started": time.time()}
+        return self._start_task(node, "qmcreate", vmid)
+
+    def _get_config(self, data, node, vmid):
+        vmid, vm = self._vm(node, vmid)
+        config = dict(vm["config"])
+        if vm["lock"]:
+            config["lock"] = vm["lock"]
+        return config
+
+    def _put_config(self, data, node, vmid):
+        vmid, vm = self._vm(node, vmid)
+        self._check_unlocked(vmid, vm)
+        for key in str(data.get("delete", "")).split(","):
+            vm["config"].pop(key.strip(), None)
+        for key, value in data.items():
+            if key in ("delete", "digest"):
+                continue
+            vm["config"][key] = value
+        # Like Proxmox, every change gets a new digest.
+        content = json.dumps({key: value for key, value in vm["config"].items() if key != "digest"}, sort_keys=True, default=str)
+        vm["config"]["digest"] = hashlib.sha1(content.encode()).hexdigest()
+        return None
+
+    def _delete_qemu(self, data, node, vmid):
+        vmid, vm = self._vm(node, vmid)
+        self._check_unlocked(vmid, vm)
+        if vm["status"] == "running":
+            raise SimulatorError(500, "VM {} is running - destroy failed".format(vmid))
+        if vm["config"].get("template"):
+            for other_id, other in self.vms.items():
+                if "base-{}-".format(vmid) in str(other["config"].get("scsi0", "")) and other_id != vmid:
+                    raise SimulatorError(500, "base volume of template {} is used by linked clone {}".format(vmid, other_id))
+        vm["lock"] = "destroyed"
+        return self._start_task(node, "qmdestroy", vmid, on_complete=lambda: self.vms.pop(vmid, None))
+
+    def _vm_status(self, data, node, vmid):
+        vmid, vm = self._vm(node, vmid)
+        summary = self._vm_summary(vmid, vm)
+        summary["qmpstatus"] = vm["status"]
+        return summary
+
+    def _vm_action(self, data, node, vmid, action):
+        vmid, vm = self._vm(node, vmid)
+        self._check_unlocked(vmid, vm)
+        if vm["config"].get("template"):
+            raise SimulatorError(500, "you can't start a vm if it's a template")
+        target_status = "running" if action in ("start", "reboot") else "stopped"
+
+        def complete():
+            if vmid in self.vms:
+                self.vms[vmid]["status"] = target_status
+                if target_status == "running":
+                    self.vms[vmid]["started"] = time.time()
+        if action == "start" and vm["status"] == "running":
+            raise SimulatorError(500, "VM {} already running".format(vmid))
+        return self._start_task(node, "qm{}".format(action), vmid, on_complete=complete)
+
+    def _clone(self, data, node, vmid):
+        vmid, source = self._vm(node, vmid)
+        unknown = set(data) - CLONE_PARAMS
+        if unknown:
+            raise SimulatorError(400, "Parameter verification failed: {}: property is not defined in schema and the schema does not allow additional properties".format(", ".join(sorted(unknown))))
+        newid = _int(data.get("newid"))
+        if newid is None:
+            raise SimulatorError(400, "Parameter verification failed: newid: property is missing and it is not optional")
+        if newid in self.vms:
+            raise SimulatorError(500, "unable to create VM {}: config file already exists".format(newid))
+        full = bool(_int(data.get("full"), 0 if source["config"].get("template") else 1))
+        if not full and not source["config"].get("template"):
+            raise SimulatorError(500, "Linked clone feature is not supported for a VM that is not a template")
+        target = data.get("target") or node
+        self._node(target)
+        config = {key: value for key, value in source["config"].items() if key not in ("template", "digest")}
+        for key, value in list(config.items()):
+            if key.startswith(DISK_PREFIXES) and ":" in str(value):
+                source_storage, rest = str(value).split(":", 1)
+                volume, _, options = rest.partition(",")
+                if target != node and not self.nodes[node]["storages"].get(source_storage, {}).get("shared"):
+                    raise SimulatorError(500, "can't clone VM to node '{}' (VM uses local storage)".format(target))
+                storage = data.get("storage") or source_storage
+                if storage not in self.nodes[target]["storages"]:
+                    raise SimulatorError(500, "storage '{}' does not exist on node '{}'".format(storage, target))
+                if full:
+                    config[key] = "{}:vm-{}-disk-0,{}".format(storage, newid, options)
+                else:
+                    config[key] = "{}:{}/vm-{}-disk-0,{}".format(storage, volume, newid, options)
+            elif key.startswith("net"):
+                parts = str(value).split(",")
+                model = parts[0].split("=")[0]
+                config[key] = ",".join(["{}={}".format(model, self._new_mac())] + parts[1:])
+        config["name"] = data.get("name") or "Copy-of-VM-{}".format(config.get("name", vmid))
+        if "description" in data:
+            config["description"] = data["description"]
+        self.vms[newid] = {"node": target, "config": config, "status": "stopped", "snapshots": {}, "lock": "clone", "started": time.time()}
+        on_complete = None
+        if not source["config"].get("template"):
+            # A full clone of a regular VM locks the source until the copy is done.
+            source["lock"] = "clone"
+            on_complete = lambda: source.update(lock=None)
+        return self._start_task(node, "qmclone", vmid, on_complete=on_complete, lock=newid)
+
+    def _make_template(self, data, node, vmid):
+        vmid, vm = self._vm(node, vmid)
+        self._check_unlocked(vmid, vm)
+        if vm["status"] == "running":
+            raise SimulatorError(500, "you can't convert a running VM to a template")
+        vm["config"]["template"] = 1
+        for key, value in list(vm["config"].items()):
+            if key.startswith(DISK_PREFIXES):
+                vm["config"][key] = str(value).replace("vm-{}-".format(vmid), "base-{}-".format(vmid))
+        return self._start_task(node, "qmtemplate", vmid)
+
+    def _migrate(self, data, node, vmid):
+        vmid, vm = self._vm(node, vmid)
+        self._check_unlocked(vmid, vm)
+        target = data.get("target")
+        self._node(target)
+        if vm["status"] == "running" and not _int(data.get("online"), 0):
+            raise SimulatorError(500, "can't migrate running VM without --online")
+        target_storage = data.get("targetstorage")
+        if target_storage and target_storage not in self.nodes[target]["storages"]:
+            raise SimulatorError(500, "storage '{}' does not exist on node '{}'".format(target_storage, target))
+
+        def move():
+            vm["node"] = target
+            if target_storage:
+                for key, value in list(vm["config"].items()):
+                    if key.startswith(DISK_PREFIXES) and ":" in str(value):
+                        vm["config"][key] = "{}:{}".format(target_storage, str(value).split(":", 1)[1])
+        vm["lock"] = "migrate"
+        return self._start_task(node, "qmigrate", vmid, on_complete=move, lock=vmid)
+
+    def _list_snapshots(self, data, node, vmid):
+        vmid, vm = self._vm(node, vmid)
+        snapshots = [{"name": name, "snaptime": snap["snaptime"], "description": snap["description"], "parent": snap.get("parent")}
+                     for name, snap in vm["snapshots"].items()]
+        current_parent = vm.get("parent_snapshot")
+        snapshots.append({"name": "current", "description": "You are here!", "parent": current_parent, "running": int(vm["status"] == "running")})
+        return snapshots
+
+    def _create_snapshot(self, data, node, vmid):
+        vmid, vm = self._vm(node, vmid)
+        self._check_unlocked(vmid, vm)
+        name = data.get("snapname")
+        if not name or name in vm["snapshots"] or name == "current":
+            raise SimulatorError(500, "snapshot name '{}' already used or invalid".format(name))
+        vm["snapshots"][name] = {"snaptime": int(time.time()), "description": data.get("description", ""),
+                                 "parent": vm.get("parent_snapshot"), "config": dict(vm["config"])}
+        vm["parent_snapshot"] = name
+        vm["lock"] = "snapshot"
+        return self._start_task(node, "qmsnapshot", vmid, lock=vmid)
+
+    def _rollback_snapshot(self, data, node, vmid, snapname):
+        vmid, vm = self._vm(node, vmid)
+        self._check_unlocked(vmid, vm)
+        if snapname not in vm["snapshots"]:
+            raise SimulatorError(500, "snapshot '{}' does not exist".format(snapname))
+
+        def complete():
+            vm["config"] = dict(vm["snapshots"][snapname]["config"])
+            vm["status"] = "stopped"
+            vm["parent_snapshot"] = snapname
+        vm["lock"] = "rollback"
+        return self._start_task(node, "qmrollback", vmid, on_complete=complete, lock=vmid)
+
+    def _delete_snapshot(self, data, node, vmid, snapname):
+        vmid, vm = self._vm(node, vmid)
+        self._check_unlocked(vmid, vm)
+        if snapname not in vm["snapshots"]:
+            raise SimulatorError(500, "snapshot '{}' does not exist".format(snapname))
+        vm["lock"] = "snapshot-delete"
+        return self._start_task(node, "qmdelsnapshot", vmid, on_complete=lambda: vm["snapshots"].pop(snapname, None), lock=vmid)
+
+    def _task_status(self, data, node, upid):
+        task = self.tasks.get(upid)
+        if task is None or task["node"] != node:
+            raise SimulatorError(500, "no such task")
+        result = {key: task[key] for key in ("upid", "node", "type", "id", "status", "starttime")}
+        result["pid"] = int(upid.split(":")[2], 16)
+        if task["status"] == "stopped":
+            result["exitstatus"] = task["exitstatus"]
+        return result
+
+    def _list_network(self, data, node):
+        info = self._node(node)
+        interfaces = list(info["network"].values()) + list(info["pending_network"].values())
+        if data.get("type"):
+            interfaces = [iface for iface in interfaces if iface["type"] == data["type"]]
+        return interfaces
+
+    def _create_network(self, data, node):
+        info = self._node(node)
+        iface = data.get("iface")
+        if iface in info["network"] or iface in info["pending_network"]:
+            raise SimulatorError(400, "interface '{}' already exists".format(iface))
+        info["pending_network"][iface] = {"iface": iface, "type": data.get("type", "bridge"), "active": 0,
+                                          "autostart": _int(data.get("autostart"), 0), "comments": data.get("comments", "")}
+        return None
+
+    def _apply_network(self, data, node):
+        info = self._node(node)
+
+        def complete():
+            for iface, config in info["pending_network"].items():
+                config["active"] = 1
+                info["network"][iface] = config
+            info["pending_network"].clear()
+        return self._start_task(node, "srvreload", "networking", on_complete=complete)
+
+    def _delete_network(self, data, node, iface):
+        info = self._node(node)
+        if iface not in info["network"] and iface not in info["pending_network"]:
+            raise SimulatorError(500, "interface '{}' does not exist".format(iface))
+        for vm in self.vms.values():
+            if vm["node"] == node and any("bridge={}".format(iface) in str(value) for key, value in vm["config"].items() if key.startswith("net")):
+                raise SimulatorError(500, "cannot delete interface '{}': device is busy".format(iface))
+        info["network"].pop(iface, None)
+        info["pending_network"].pop(iface, None)
+        return None
+
+    def _cluster_resources(self, data):
+        kind = data.get("type")
+        result = []
+        if kind in (None, "vm"):
+            for vmid, vm in self.vms.items():
+                summary = self._vm_summary(vmid, vm)
+                summary.update({"id": "qemu/{}".format(vmid), "type": "qemu", "node": vm["node"], "template": int(bool(vm["config"].get("template"))),
+                                "maxcpu": summary.pop("cpus")})
+                result.append(summary)
+        if kind in (None, "node"):
+            for node in self._list_nodes(data):
+                node.update({"id": "node/{}".format(node["node"])})
+                result.append(node)
+        if kind in (None, "storage"):
+            for node in self.nodes:
+                for storage in self._node_storage(data, node):
+                    result.append({"id": "storage/{}/{}".format(node, storage["storage"]), "type": "storage", "node": node,
+                                   "storage": storage["storage"], "shared": storage["shared"], "disk": storage["used"],
+                                   "maxdisk": storage["total"], "content": storage["content"], "status": "available"})
+        if kind in (None, "sdn"):
+            for zone in self.zones:
+                for node in self.nodes:
+                    result.append({"id": "sdn/{}/{}".format(node, zone), "type": "sdn", "sdn": zone, "node": node, "status": "ok"})
+        return result
+
+    def _next_id(self, data):
+        vmid = 100
+        while vmid in self.vms:
+            vmid += 1
+        return vmid
+
+    def _list_zones(self, data):
+        return [dict(zone) for zone in self.zones.values()]
+
+    def _create_zone(self, data):
+        zone = data.get("zone")
+        if zone in self.zones:
+            raise SimulatorError(500, "zone '{}' already exists".format(zone))
+        self.zones[zone] = {key: value for key, value in data.items()}
+        return None
+
+    def _delete_zone(self, data, zone):
+        if zone not in self.zones:
+            raise SimulatorError(500, "zone '{}' does not exist".format(zone))
+        if any(vnet["zone"] == zone for vnet in self.vnets.values()):
+            raise SimulatorError(500, "cannot delete zone '{}', zone is not empty".format(zone))
+        del self.zones[zone]
+        return None
+
+    def _list_vnets(self, data):
+        return [dict(vnet) for vnet in self.vnets.values()]
+
+    def _create_vnet(self, data):
+        vnet, zone, tag = data.get("vnet"), data.get("zone"), _int(data.get("tag"))
+        if zone not in self.zones:
+            raise SimulatorError(500, "zone '{}' does not exist".format(zone))
+        if vnet in self.vnets:
+            raise SimulatorError(500, "vnet '{}' already exists".format(vnet))
+        if tag is not None and any(other["zone"] == zone and other.get("tag") == tag for other in self.vnets.values()):
+            raise SimulatorError(500, "tag {} already exists in vnet of zone '{}'".format(tag, zone))
+        self.vnets[vnet] = {"vnet": vnet, "zone": zone, "tag": tag, "type": "vnet"}
+        return None
+
+    def _update_vnet(self, data, vnet):
+        if vnet not in self.vnets:
+            raise SimulatorError(500, "vnet '{}' does not exist".format(vnet))
+        current = self.vnets[vnet]
+        tag = _int(data.get("tag"), current.get("tag"))
+        if any(name != vnet and other["zone"] == current["zone"] and other.get("tag") == tag for name, other in self.vnets.items()):
+            raise SimulatorError(500, "tag {} already exists in vnet of zone '{}'".format(tag, current["zone"]))
+        current["tag"] = tag
+        if "alias" in data:
+            current["alias"] = data["alias"]
+        return None
+
+    def _delete_vnet(self, data, vnet):
+        if vnet not in self.vnets:
+            raise SimulatorError(500, "vnet '{}' does not exist".format(vnet))
+        for vmid, vm in self.vms.items():
+            if any("bridge={}".format(vnet) in str(value) for key, value in vm["config"].items() if key.startswith("net")):
+                raise SimulatorError(500, "cannot delete vnet '{}', it is in use by VM {}".format(vnet, vmid))
+        del self.vnets[vnet]
+        return None
+
+    def _apply_sdn(self, data):
+        return self._start_task(next(iter(self.nodes)), "reloadnetworkall", "", on_complete=None)
+
+class SimulatedResponse:
+    """Just enough of requests.Response for proxmoxer's ProxmoxResource._request and JsonSerializer."""
+    def __init__(self, status_code: int, payload: dict, reason: str = "OK"):
+        self.status_code = status_code
+        self.reason = reason
+        self.text = json.dumps(payload)
+        self.content = self.text.encode("utf-8")
+
+class SimulatedSession:
+    """proxmoxer session that answers from a SimulatedCluster instead of the network."""
+    def __init__(self, cluster: SimulatedCluster):
+        self.cluster = cluster
+
+    def request(self, method, url, data=None, params=None, **kwargs):
+        path = urlsplit(url).path
+        if path.startswith("/api2/json"):
+            path = path[len("/api2/json"):]
+        try:
+            result = self.cluster.handle(method, path, {**(params or {}), **(data or {})})
+            return SimulatedResponse(200, {"data": result})
+        except SimulatorError as e:
+            return SimulatedResponse(e.status_code, {"data": None, "errors": {"message": e.message}}, reason=e.message)
+
+def connect(cluster: SimulatedCluster) -> ProxmoxResource:
+    """Returns a proxmoxer resource tree (same interface as ProxmoxAPI) served by `cluster`."""
+    return ProxmoxResource(base_url="https://simulator:8006/api2/json", session=SimulatedSession(cluster), serializer=JsonSerializer())
+
+def connect_remote(url: str) -> ProxmoxResource:
+    """Returns a proxmoxer resource tree talking plain HTTP to a simulator started with `python -m app.core.simulator`."""
+    import requests
+    return ProxmoxResource(base_url=url.rstrip("/") + "/api2/json", session=requests.Session(), serializer=JsonSerializer())
+
+_cluster = None
+_cluster_lock = threading.Lock()
+
+def load_config(source: str) -> dict:
+    if source and source.lower() not in ("1", "true", "yes") and os.path.exists(source):
+        with open(source) as f:
+            return yaml.safe_load(f) or {}
+    return {}
+
+def get_cluster() -> SimulatedCluster:
+    """Process-wide simulated cluster, built on first use from `PROXMOX_SIMULATOR` (flag or YAML path)."""
+    global _cluster
+    with _cluster_lock:
+        if _cluster is None:
+            _cluster = SimulatedCluster.from_config(load_config(os.getenv("PROXMOX_SIMULATOR", "")))
+        return _cluster
+
+def set_cluster(cluster: SimulatedCluster):
+    """Replaces the process-wide simulated cluster (benchmarks build a fresh one per scenario)."""
+    global _cluster
+    with _cluster_lock:
+        _cluster = cluster
+
+def serve(cluster: SimulatedCluster, host: str = "127.0.0.1", port: int = 8006) -> ThreadingHTTPServer:
+    """Creates an HTTP server exposing `cluster` under /api2/json (call serve_forever() on it)."""
+    class Handler(BaseHTTPRequestHandler):
+        def _dispatch(self):
+            url = urlsplit(self.path)
+            data = dict(parse_qsl(url.query, keep_blank_values=True))
+            length = int(self.headers.get("Content-Length") or 0)
+            if length:
+                data.update(parse_qsl(self.rfile.read(length).decode("utf-8"), keep_blank_values=True))
+            response = SimulatedSession(cluster).request(self.command, url.path, data=data)
+            self.send_response(response.status_code, response.reason if response.status_code >= 400 else None)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(response.content)))
+            self.end_headers()
+            self.wfile.write(response.content)
+
+        do_GET = do_POST = do_PUT = do_DELETE = _dispatch
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a simulated Proxmox VE API over HTTP.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8006)
+    parser.add_argument("--config", help="YAML file with latency, task_durations, time_scale and synthetic settings")
+    args = parser.parse_args()
+    cluster = SimulatedCluster.from_config(load_config(args.config))
+    print("Simulated Proxmox API with {} nodes and {} VMs on http://{}:{}/api2/json".format(len(cluster.nodes), len(cluster.vms), args.host, args.port))
+    serve(cluster, args.host, args.port).serve_forever()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+import os
+import time
+import logging
+import threading
+import contextvars
+from contextlib import ExitStack, contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from app.core.metrics import JOB_QUEUE_DEPTH
+
+logger = logging.getLogger("proxmox_api")
+
+# Concurrency limits for work fanned out to the cluster (clones, starts, config writes).
+CLONE_CONCURRENCY_PER_NODE = int(os.getenv("CLONE_CONCURRENCY_PER_NODE", "4"))
+CLONE_CONCURRENCY_PER_STORAGE = int(os.getenv("CLONE_CONCURRENCY_PER_STORAGE", "4"))
+PROXMOX_READ_CONCURRENCY = int(os.getenv("PROXMOX_READ_CONCURRENCY", "8"))
+TASK_TIMEOUT = float(os.getenv("PROXMOX_TASK_TIMEOUT", "600"))
+
+class TaskFailed(Exception):
+    """A Proxmox task finished with an exit status other than OK, or did not finish in time."""
+    def __init__(self, upid: str, exitstatus: str):
+        self.upid = upid
+        self.exitstatus = exitstatus
+        super().__init__("Task {} failed: {}".format(upid, exitstatus))
+
+def is_upid(value) -> bool:
+    return isinstance(value, str) and value.startswith("UPID:")
+
+def wait_for_task(proxmox, node: str, upid: str, timeout: float = TASK_TIMEOUT, interval: float = 0.2, max_interval: float = 2.0) -> dict:
+    """
+    Polls a task until it stops, backing off from `interval` to `max_interval`.
+    Returns the final task status; raises TaskFailed if it did not end with 'OK'.
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        status = proxmox.nodes(node).tasks(upid).status.get()
+        if status.get("status") == "stopped":
+            if status.get("exitstatus") != "OK":
+                raise TaskFailed(upid, status.get("exitstatus"))
+            return status
+        if time.monotonic() >= deadline:
+            raise TaskFailed(upid, "timed out after {}s".format(timeout))
+        time.sleep(interval)
+        interval = min(max_interval, interval * 1.5)
+
+def task_node(upid: str) -> str:
+    """The node a task runs on, from its UPID ('UPID:<node>:...')."""
+    return upid.split(":")[1]
+
+class KeyedLimiter:
+    """
+    One bounded semaphore per key (e.g. per node or per storage), created on demand.
+    `limit("node:pve1", "storage:ceph")` holds a slot on every key for the duration of the block.
+    """
+    def __init__(self, default_limit: int, limits: dict = None):
+        self.default_limit = default_limit
+        self.limits = limits or {}
+        self._semaphores = {}
+        self._lock = threading.Lock()
+
+    def _semaphore(self, key: str):
+        with self._lock:
+            if key not in self._semaphores:
+                prefix = key.split(":", 1)[0]
+                self._semaphores[key] = threading.BoundedSemaphore(self.limits.get(prefix, self.default_limit))
+            return self._semaphores[key]
+
+    @contextmanager
+    def limit(self, *keys):
+        # Acquire in a fixed order so two callers holding overlapping keys cannot deadlock.
+        with ExitStack() as stack:
+            for key in sorted(set(keys)):
+                semaphore = self._semaphore(key)
+                semaphore.acquire()
+                stack.callback(semaphore.release)
+            yield
+
+# Shared by every lab pipeline in this worker so the per-node/per-storage limits hold across requests.
+clone_limiter = KeyedLimiter(CLONE_CONCURRENCY_PER_NODE, {"storage": CLONE_CONCURRENCY_PER_STORAGE})
+
+def submit(executor: ThreadPoolExecutor, fn, *args, queue: str = None, **kwargs):
+    """
+    executor.submit() that runs `fn` in a copy of the caller's context, so request IDs and
+    upstream call tracing follow the work into the pool. With `queue`, the job is counted
+    in the job_queue_depth gauge until it starts running.
+    """
+    context = contextvars.copy_context()
+    if queue:
+        JOB_QUEUE_DEPTH.labels(queue).inc()
+
+    def run():
+        if queue:
+            JOB_QUEUE_DEPTH.labels(queue).dec()
+        return fn(*args, **kwargs)
+    return executor.submit(context.run, run)
+
+def map_concurrent(fn, items, max_workers: int = PROXMOX_READ_CONCURRENCY):
+    """Applies `fn` to every item on a small thread pool, preserving order (for fan-out reads)."""
+    items = list(items)
+    if not items:
+        return []
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as executor:
+        futures = [submit(executor, fn, item) for item in items]
+        return [future.result() for future in futures]
@@ -0,0 +1,127 @@
+import sys
+import asyncio
+import time
+import threading
+import functools
+from collections import Counter
+from contextvars import ContextVar
+from typing import Optional
+from fastapi.routing import APIRoute
+from app.core.metrics import InstrumentedSession
+
+class RequestTrace:
+    """
+    Per-request accounting of upstream Proxmox calls.
+    One instance is created by the tracing middleware and shared (by reference) with
+    every thread that works on the request, so updates are guarded by a lock.
+    """
+    def __init__(self, request_id: str, profile: bool = False, profile_interval: float = 0.005):
+        self.request_id = request_id
+        self.upstream_calls = 0
+        self.upstream_seconds = 0.0
+        self.upstream_by_path = Counter()
+        self.profile = profile
+        self.profile_interval = profile_interval
+        self.profiler = None
+        self._lock = threading.Lock()
+
+    def record(self, method: str, path: str, seconds: float):
+        with self._lock:
+            self.upstream_calls += 1
+            self.upstream_seconds += seconds
+            self.upstream_by_path["{} {}".format(method, path)] += 1
+
+trace_var: ContextVar[Optional[RequestTrace]] = ContextVar("request_trace", default=None)
+
+def get_trace() -> Optional[RequestTrace]:
+    return trace_var.get()
+
+def _record_upstream_call(method, path, node, seconds, status):
+    trace = trace_var.get()
+    if trace is not None:
+        trace.record(method, path, seconds)
+
+InstrumentedSession.add_observer(_record_upstream_call)
+
+class SamplingProfiler:
+    """
+    Periodically samples the stack of one thread (the one running the route handler)
+    and counts how often each stack was seen. Cheap enough to leave on for a single
+    request, and unlike cProfile it also catches time spent blocked on I/O.
+    """
+    def __init__(self, thread_id: int, interval: float = 0.005, max_depth: int = 64):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.max_depth = max_depth
+        self.samples = 0
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None and len(stack) < self.max_depth:
+                code = frame.f_code
+                stack.append("{}:{}:{}".format(code.co_filename.rsplit("/", 1)[-1], code.co_name, frame.f_lineno))
+                frame = frame.f_back
+            self.samples += 1
+            self.stacks[";".join(reversed(stack))] += 1
+
+    def report(self, top: int = 25) -> dict:
+        """Returns folded stacks (flamegraph.pl / speedscope format) and the hottest frames by self time."""
+        self_time = Counter()
+        for stack, count in self.stacks.items():
+            self_time[stack.rsplit(";", 1)[-1]] += count
+        return {
+            "samples": self.samples,
+            "interval_ms": self.interval * 1000,
+            "top_frames": [{"frame": frame, "samples": count} for frame, count in self_time.most_common(top)],
+            "folded_stacks": ["{} {}".format(stack, count) for stack, count in self.stacks.most_common()],
+        }
+
+def _profiled(endpoint):
+    """Wraps an endpoint so that, when the current request asked for it, its thread is sampled while it runs."""
+    if asyncio.iscoroutinefunction(endpoint):
+        @functools.wraps(endpoint)
+        async def async_wrapper(*args, **kwargs):
+            trace = trace_var.get()
+            if trace is None or not trace.profile:
+                return await endpoint(*args, **kwargs)
+            trace.profiler = SamplingProfiler(threading.get_ident(), trace.profile_interval).start()
+            try:
+                return await endpoint(*args, **kwargs)
+            finally:
+                trace.profiler.stop()
+        return async_wrapper
+
+    @functools.wraps(endpoint)
+    def wrapper(*args, **kwargs):
+        trace = trace_var.get()
+        if trace is None or not trace.profile:
+            return endpoint(*args, **kwargs)
+        trace.profiler = SamplingProfiler(threading.get_ident(), trace.profile_interval).start()
+        try:
+            return endpoint(*args, **kwargs)
+        finally:
+            trace.profiler.stop()
+    return wrapper
+
+class TracedRoute(APIRoute):
+    """Route class for the API routers: lets the tracing middleware profile a single handler on request."""
+    def __init__(self, path: str, endpoint, **kwargs):
+        super().__init__(path, _profiled(endpoint), **kwargs)
+
+def elapsed_ms(start: float) -> float:
+    return round((time.perf_counter() - start) * 1000, 1)
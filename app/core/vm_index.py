@@ -0,0 +1,156 @@
+"""
+VM search index.
+
+GET /vms used to read the config of every VM of every node and left all filtering to the
+browser. Its filters (name prefix or substring, status, node, template flag, lab group or lab
+instance, bridge/VNET) are now answered from secondary indexes kept per worker over the
+/cluster/resources snapshots (app/core/inventory.py), rebuilt whenever a new snapshot is fetched.
+
+The bridge of a NIC is only in the VM config, so configs are cached here too, parsed into
+VmRecords (app/core/vm_records.py), and bridge filters are answered from the cached records. A
+cached record outlives inventory invalidations: it is dropped when the VM's listing entry changes
+(node, name, tags or size), and callers that change a VM's NICs without touching its tags (network
+reconfiguration, lab spec NIC changes, snapshot rollbacks) drop it with forget(). For changes made
+elsewhere, records older than VM_CONFIG_MAX_AGE seconds are re-read, at most
+VM_CONFIG_REFRESH_BATCH of them (oldest first) per query, the others being served as they are until
+a later query, so a bridge filter after an invalidation costs one config read per changed VM
+instead of one per VM. Configs are only read for the VMs a query returns, or, for a bridge filter,
+for the VMs that match the other filters.
+"""
+import os
+import time
+import bisect
+import logging
+import threading
+from app.core.inventory import cluster_resources
+from app.core.lab_tags import instance_name, parse
+from app.core.metrics import record_cache_lookup
+from app.core.tasks import map_concurrent
+from app.core.vm_records import parse_config
+
+logger = logging.getLogger("proxmox_api")
+
+VM_CONFIG_MAX_AGE = float(os.getenv("VM_CONFIG_MAX_AGE", "30"))
+VM_CONFIG_REFRESH_BATCH = int(os.getenv("VM_CONFIG_REFRESH_BATCH", "50"))
+
+def _signature(vm: dict) -> tuple:
+    return (vm.get('node'), vm.get('name'), vm.get('tags') or '', vm.get('maxcpu'), vm.get('maxmem'), vm.get('maxdisk'))
+
+class VmIndex:
+    def __init__(self, config_max_age: float = VM_CONFIG_MAX_AGE, refresh_batch: int = VM_CONFIG_REFRESH_BATCH):
+        self.config_max_age = config_max_age
+        self.refresh_batch = refresh_batch
+        # vmid -> /cluster/resources entry
+        self._vms = {}
+        self._by_node = {}
+        self._by_status = {}
+        self._templates = set()
+        # lab group -> vmids tagged with it or members of one of its instances
+        self._by_lab_group = {}
+        # "<group>_cloned<n>" -> member vmids
+        self._by_lab = {}
+        # sorted (lower-case name, vmid)
+        self._names = []
+        # vmid -> (read at, listing signature, VmRecord)
+        self._records = {}
+        # Bumped by forget(), so that a config read started before it is not cached
+        self._forgets = 0
+        self._updated_at = 0.0
+        self._lock = threading.Lock()
+
+    def update(self, resources: list, fetched_at: float):
+        """Rebuilds the indexes from a /cluster/resources snapshot taken at `fetched_at`."""
+        vms, by_node, by_status, templates, by_lab_group, by_lab = {}, {}, {}, set(), {}, {}
+        for entry in resources:
+            if entry.get('type') != 'qemu':
+                continue
+            vmid = entry['vmid']
+            vms[vmid] = entry
+            by_node.setdefault(entry.get('node'), set()).add(vmid)
+            by_status.setdefault(entry.get('status'), set()).add(vmid)
+            if entry.get('template') == 1:
+                templates.add(vmid)
+            if entry.get('tags'):
+                metadata = parse(entry['tags'])
+                for group in metadata.get('lab_groups', []) + ([metadata['lab_name']] if 'lab_name' in metadata else []):
+                    by_lab_group.setdefault(group, set()).add(vmid)
+                if 'lab_instance' in metadata:
+                    by_lab.setdefault(instance_name(metadata), set()).add(vmid)
+        names = sorted(((entry.get('name') or '').lower(), vmid) for vmid, entry in vms.items())
+        with self._lock:
+            if fetched_at <= self._updated_at:
+                return
+            self._vms, self._by_node, self._by_status, self._templates = vms, by_node, by_status, templates
+            self._by_lab_group, self._by_lab, self._names = by_lab_group, by_lab, names
+            for vmid, cached in list(self._records.items()):
+                if vmid not in vms or cached[1] != _signature(vms[vmid]):
+                    del self._records[vmid]
+            self._updated_at = fetched_at
+
+    def forget(self, *vmids: int):
+        """Drops the cached configs of VMs whose NICs were just changed."""
+        with self._lock:
+            self._forgets += 1
+            for vmid in vmids:
+                self._records.pop(vmid, None)
+
+    def records(self, proxmox, vms: list) -> list:
+        """
+        The parsed configs of `vms` (listing entries): the cached ones, and read concurrently the
+        ones not cached plus up to `refresh_batch` of the stale ones, oldest first.
+        """
+        now = time.monotonic()
+        with self._lock:
+            cached = [self._records.get(vm['vmid']) for vm in vms]
+            forgets = self._forgets
+        records = [entry[2] if entry else None for entry in cached]
+        missing = [position for position, record in enumerate(records) if record is None]
+        stale = sorted((entry[0], position) for position, entry in enumerate(cached) if entry and now - entry[0] > self.config_max_age)
+        read = missing + [position for _, position in stale[:self.refresh_batch]]
+        record_cache_lookup("vm_config", not read)
+        if not read:
+            return records
+        fresh = map_concurrent(lambda position: parse_config(proxmox.nodes(vms[position]['node']).qemu(vms[position]['vmid']).config.get()), read)
+        with self._lock:
+            for position, record in zip(read, fresh):
+                vm = vms[position]
+                records[position] = record
+                # Not cached when the VM was forgotten or its listing entry replaced meanwhile
+                signature = _signature(vm)
+                if forgets == self._forgets and _signature(self._vms.get(vm['vmid'], vm)) == signature:
+                    self._records[vm['vmid']] = (now, signature, record)
+        return records
+
+    def query(self, proxmox, max_age: float = None, name_prefix: str = None, name_contains: str = None, status: str = None, node: str = None,
+              template: bool = None, lab_group: str = None, lab: str = None, bridge: str = None) -> list:
+        """The listing entries of the VMs matching every given filter, by VMID, from an inventory at most `max_age` seconds old."""
+        self.update(cluster_resources.get(proxmox, max_age), cluster_resources.fetched_at)
+        with self._lock:
+            candidates = None
+            for selected, index in ((node, self._by_node), (status, self._by_status), (lab_group, self._by_lab_group), (lab, self._by_lab)):
+                if selected is not None:
+                    matches = index.get(selected, set())
+                    candidates = set(matches) if candidates is None else candidates & matches
+            if template is not None:
+                candidates = set(self._vms) if candidates is None else candidates
+                candidates = candidates & self._templates if template else candidates - self._templates
+            if name_prefix:
+                prefix = name_prefix.lower()
+                position = bisect.bisect_left(self._names, (prefix,))
+                matches = set()
+                while position < len(self._names) and self._names[position][0].startswith(prefix):
+                    matches.add(self._names[position][1])
+                    position += 1
+                candidates = matches if candidates is None else candidates & matches
+            if candidates is None:
+                candidates = set(self._vms)
+            if name_contains:
+                needle = name_contains.lower()
+                candidates = {vmid for vmid in candidates if needle in (self._vms[vmid].get('name') or '').lower()}
+            vms = [self._vms[vmid] for vmid in sorted(candidates)]
+        if bridge is None:
+            return vms
+        return [vm for vm, record in zip(vms, self.records(proxmox, vms)) if bridge in record.bridges]
+
+vm_index = VmIndex()
+cluster_resources.subscribe(vm_index.update)
@@ -0,0 +1,122 @@
+"""
+Compact VM records and the VM config parser.
+
+The hardware details of a VM (the `hardware_details` of GET /vms, the template catalog, the
+capacity planner) used to be built by vms._format_vm_details: a loop over every config key with
+an uncompiled regex per key and str.split per NIC, into nested dicts held for every cached VM.
+Configs are now parsed in one pass with precompiled patterns into __slots__ records (VmRecord,
+DiskRecord, NicRecord), a fraction of the size of the equivalent dicts. The template catalog
+and the capacity planner read the record fields directly; to_dict() (the same document as
+before) is only for response bodies, and to_json() its JSON, encoded once per record (records
+are not changed after parsing) so that responses built from cached records do not encode it
+again (see app/core/responses.py).
+
+benchmarks/bench_parser.py measures parse throughput and memory per VM against the old parser.
+"""
+import re
+from app.core.responses import dumps
+
+# Config keys of disks and NICs (every bus and index Proxmox allows), and the values they are parsed from
+DISK_KEYS = frozenset(["scsi{}".format(n) for n in range(31)] + ["sata{}".format(n) for n in range(6)] +
+                      ["ide{}".format(n) for n in range(4)] + ["virtio{}".format(n) for n in range(16)])
+NIC_KEYS = frozenset("net{}".format(n) for n in range(32))
+_DISK_VALUE = re.compile(r"(.+?):(.+?),size=(\d+)G?")
+NIC_MODELS = frozenset(('virtio', 'e1000', 'rtl8139', 'vmxnet3'))
+
+class DiskRecord:
+    __slots__ = ("device", "storage", "file", "size_gb")
+
+    def __init__(self, device: str, storage: str, file: str, size_gb: int):
+        self.device = device
+        self.storage = storage
+        self.file = file
+        self.size_gb = size_gb
+
+    def to_dict(self) -> dict:
+        return {"device": self.device, "storage": self.storage, "file": self.file, "size_gb": self.size_gb}
+
+class NicRecord:
+    __slots__ = ("device", "model", "mac_address", "bridge", "options")
+
+    def __init__(self, device: str, model: str = None, mac_address: str = None, bridge: str = None, options: tuple = ()):
+        self.device = device
+        self.model = model
+        self.mac_address = mac_address
+        self.bridge = bridge
+        # Other key=value settings (firewall, tag, rate, ...), in config order
+        self.options = options
+
+    def to_dict(self) -> dict:
+        nic = {"device": self.device}
+        if self.model is not None:
+            nic["model"] = self.model
+            nic["mac_address"] = self.mac_address
+        if self.bridge is not None:
+            nic["bridge"] = self.bridge
+        nic.update(self.options)
+        return nic
+
+class VmRecord:
+    __slots__ = ("description", "template", "cores", "sockets", "cpu_type", "memory_mb", "boot_order", "disks", "nics", "_json")
+
+    def __init__(self, description: str, template, cores, sockets, cpu_type, memory_mb, boot_order, disks: tuple, nics: tuple):
+        self.description = description
+        self.template = template
+        self.cores = cores
+        self.sockets = sockets
+        self.cpu_type = cpu_type
+        self.memory_mb = memory_mb
+        self.boot_order = boot_order
+        self.disks = disks
+        self.nics = nics
+        self._json = None
+
+    @property
+    def bridges(self) -> set:
+        return {nic.bridge for nic in self.nics if nic.bridge}
+
+    def to_dict(self) -> dict:
+        """The hardware details document of GET /vms."""
+        return {
+            "description": self.description,
+            "template": self.template,
+            "cpu": {"cores": self.cores, "sockets": self.sockets, "type": self.cpu_type},
+            "memory_mb": self.memory_mb,
+            "boot_order": self.boot_order,
+            "disks": [disk.to_dict() for disk in self.disks],
+            "network_interfaces": [nic.to_dict() for nic in self.nics],
+        }
+
+    def to_json(self) -> bytes:
+        """to_dict() as JSON, encoded on first use."""
+        if self._json is None:
+            self._json = dumps(self.to_dict())
+        return self._json
+
+def _parse_nic(device: str, value: str) -> NicRecord:
+    model = mac_address = bridge = None
+    options = []
+    for part in value.split(','):
+        key, separator, setting = part.partition('=')
+        if not separator:
+            continue
+        if key in NIC_MODELS:
+            model, mac_address = key, setting
+        elif key == 'bridge':
+            bridge = setting
+        else:
+            options.append((key, setting))
+    return NicRecord(device, model, mac_address, bridge, tuple(options))
+
+def parse_config(vm_config: dict) -> VmRecord:
+    """Parses a /nodes/{node}/qemu/{vmid}/config document in one pass over its keys."""
+    disks, nics = [], []
+    for key, value in vm_config.items():
+        if key in DISK_KEYS:
+            disk = _DISK_VALUE.match(str(value))
+            if disk:
+                disks.append(DiskRecord(key, disk.group(1), disk.group(2), int(disk.group(3))))
+        elif key in NIC_KEYS:
+            nics.append(_parse_nic(key, str(value)))
+    return VmRecord(vm_config.get("description", ""), vm_config.get("template", 0), vm_config.get("cores"), vm_config.get("sockets"),
+                    vm_config.get("cpu"), vm_config.get("memory"), vm_config.get("boot"), tuple(disks), tuple(nics))
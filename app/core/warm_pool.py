@@ -0,0 +1,294 @@
+"""
+Warm pool of pre-cloned lab instances.
+
+For every lab group with a configured pool size, the refiller keeps that many instances cloned
+ahead of time: each on its own VNET (tagged from the pool's VLAN range), NICs already moved to
+it, VMs stopped. Pooled VMs are described as "WarmPool: <group> | Slot: <n> | Members: <m>"
+rather than "Lab: ...", and tagged labpool-<group> instead of with a lab instance (see
+app/core/lab_tags.py), so the rest of the API (and the frontend) ignores them until they are
+claimed; " | Ready" is appended once a member is fully reconfigured.
+
+Claiming a slot re-tags its VNET with the VLAN tag the user asked for, rewrites the members to
+the regular "Lab: <group> clone | Instance: <n>" description and tags and starts them, which costs a
+handful of API calls instead of a clone pipeline. The pool is then refilled in the background.
+Only one worker refills at a time (non-blocking file lock). Pooled clones are placed like any
+other clone (app/core/placement.py), counting pooled VMs as running, and a refill stops once no
+node keeps WARM_POOL_MEMORY_HEADROOM of its memory free.
+
+The pool is found from the /cluster/resources listing: pooled VMs by their labpool-<group> tag
+(only their configs are read, for the slot markers) and a group's templates from the template
+catalog (app/core/catalog.py), so a refill pass or GET /labs/pool does not read every VM config.
+"""
+import os
+import re
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from filelock import FileLock, Timeout
+from app import models
+from app.database import SessionLocal
+from app.logging_helper import save_error
+from app.core.proxmox import get_proxmox_connection
+from app.core.metrics import timed_lock
+from app.core.tasks import is_upid, map_concurrent, submit, wait_for_task
+from app.core.placement import cluster_placer
+from app.core import replicas
+from app.core import lab_tags
+from app.core.catalog import template_catalog
+from app.core.lab_tags import POOL_DESCRIPTION, POOL_PATTERN
+from app.core.lab_pipeline import LAB_BASELINE_SNAPSHOT, net_bridge, next_vnet_name, provision_clone, start_vms, take_snapshot, wait_for_sdn_apply
+
+logger = logging.getLogger("proxmox_api")
+
+WARM_POOL_INTERVAL = float(os.getenv("WARM_POOL_INTERVAL", "60"))
+WARM_POOL_MEMORY_HEADROOM = float(os.getenv("WARM_POOL_MEMORY_HEADROOM", "0.1"))
+WARM_POOL_VMID_BASE = int(os.getenv("WARM_POOL_VMID_BASE", "900000"))
+
+refill_lock = FileLock("/tmp/warm_pool_refill.lock")
+claim_lock = FileLock("/tmp/warm_pool_claim.lock")
+
+def pool_members(proxmox, all_vms: list, lab_group: str = None) -> list:
+    """(summary, config) of the pooled VMs (of `lab_group`), found by their labpool-<group> tag; only their configs are read."""
+    vms = [vm for vm in all_vms if vm['lab'].get('pool_group') and (lab_group is None or vm['lab']['pool_group'] == lab_group)]
+    return list(zip(vms, map_concurrent(lambda vm: proxmox.nodes(vm['node']).qemu(vm['vmid']).config.get(), vms)))
+
+def read_inventory(proxmox, max_age: float = None):
+    """The lab_vms() entries of the cluster and the (summary, config) of every pooled VM."""
+    all_vms = lab_tags.lab_vms(proxmox, max_age)
+    return all_vms, pool_members(proxmox, all_vms)
+
+def pool_slots(members: list, lab_group: str = None) -> dict:
+    """
+    {(lab_group, slot): {"members": expected count, "vms": [(summary, config), ...], "ready": bool}}
+    from pool_members(). A slot is ready when all of its expected members exist and were fully reconfigured.
+    """
+    slots = {}
+    for vm_summary, config in members:
+        match = POOL_PATTERN.search(config.get('description', ''))
+        if not match or (lab_group and match.group(1) != lab_group):
+            continue
+        slot = slots.setdefault((match.group(1), int(match.group(2))), {"members": int(match.group(3)), "vms": [], "ready": True})
+        slot["vms"].append((vm_summary, config))
+        if not match.group(4):
+            slot["ready"] = False
+    for slot in slots.values():
+        if len(slot["vms"]) != slot["members"]:
+            slot["ready"] = False
+    return slots
+
+def group_templates(proxmox, all_vms: list, lab_group: str) -> list:
+    """(summary, config) of the templates of `lab_group`, from the template catalog."""
+    return [(entry['summary'], entry['config']) for entry in template_catalog.refresh(proxmox, vms=all_vms).templates(lab_group)]
+
+def pool_status(all_vms, members: list, pools: list) -> list:
+    """One entry per lab group (from template tags or pool settings) with its pool settings and slot counts."""
+    groups = set(pool.lab_group for pool in pools)
+    for vm_summary in all_vms:
+        if vm_summary.get('template') == 1:
+            groups.update(lab_tags.parse(vm_summary.get('tags')).get('lab_groups', []))
+    settings = {pool.lab_group: pool for pool in pools}
+    slots = pool_slots(members)
+    status = []
+    for group in sorted(groups):
+        pool = settings.get(group)
+        group_slots = [slot for (slot_group, _), slot in slots.items() if slot_group == group]
+        status.append({
+            "lab_group": group,
+            "size": pool.size if pool else 0,
+            "vlan_zone": pool.vlan_zone if pool else None,
+            "vlan_tag_range": [pool.vlan_tag_start, pool.vlan_tag_end] if pool else None,
+            "ready": sum(1 for slot in group_slots if slot["ready"]),
+            "incomplete": sum(1 for slot in group_slots if not slot["ready"]),
+        })
+    return status
+
+def claim(proxmox, lab_group: str, vlan_zone: str, vlan_tag: int, instance_num: int, members: list):
+    """
+    Hands out a ready pooled instance of `lab_group` (from `members`, see pool_members()) as lab
+    instance `instance_num`. Returns None (and leaves the pool untouched) when there is no ready slot in `vlan_zone`.
+    """
+    slots = pool_slots(members, lab_group)
+    candidates = sorted(slot_key[1] for slot_key, slot in slots.items() if slot["ready"])
+    if not candidates:
+        return None
+    claimed = None
+    with timed_lock(claim_lock, "warm_pool_claim", timeout=30):
+        vnets = {vnet['vnet']: vnet for vnet in proxmox.cluster.sdn.vnets.get()}
+        for slot_num in candidates:
+            members = slots[(lab_group, slot_num)]["vms"]
+            # Another worker may have claimed the slot since the inventory was read.
+            try:
+                fresh = map_concurrent(lambda member: proxmox.nodes(member[0]['node']).qemu(member[0]['vmid']).config.get(), members)
+            except Exception:
+                continue
+            if not all(POOL_PATTERN.search(config.get('description', '')) for config in fresh):
+                continue
+            vnet_name = net_bridge(fresh[0])
+            if vnets.get(vnet_name, {}).get('zone') != vlan_zone:
+                logger.info(f"Warm pool slot {slot_num} of '{lab_group}' is not in zone '{vlan_zone}', not using the pool.")
+                return None
+            try:
+                proxmox.cluster.sdn.vnets(vnet_name).put(tag=vlan_tag)
+                sdn_apply_upid = proxmox.cluster.sdn.put()
+            except Exception as vnet_error:
+                logger.error(f"Failed to re-tag pooled SDN VNET (Normally is vnet tag alr exist): {save_error(vnet_error)}")
+                raise Exception("Failed to create SDN VNET. Proxmox Error: {}".format(vnet_error))
+            description = "Lab: {} clone | Instance: {}".format(lab_group, instance_num)
+            map_concurrent(lambda member: proxmox.nodes(member[0][0]['node']).qemu(member[0][0]['vmid']).config.put(
+                description=description, tags=lab_tags.with_lab_instance(member[1].get('tags'), lab_group, instance_num, "clone")), list(zip(members, fresh)))
+            claimed = (slot_num, vnet_name, sdn_apply_upid, members, fresh)
+            break
+    if claimed is None:
+        return None
+    slot_num, vnet_name, sdn_apply_upid, members, configs = claimed
+    wait_for_sdn_apply(proxmox, sdn_apply_upid)
+    if LAB_BASELINE_SNAPSHOT:
+        # Taken now rather than when the slot was filled, so a reset restores the lab's description, not the pool marker.
+        map_concurrent(lambda member: take_snapshot(proxmox, member[0]['node'], member[0]['vmid'], LAB_BASELINE_SNAPSHOT, "Lab baseline"), members)
+    failed = [result for result in start_vms(proxmox, [member[0] for member in members], configs) if result['result'] == 'error']
+    if failed:
+        raise Exception("Failed to start pooled VMs: {}".format("; ".join("{}: {}".format(result['vmid'], result['detail']) for result in failed)))
+    logger.info(f"Lab '{lab_group}' instance {instance_num} claimed from warm pool slot {slot_num} on VNET '{vnet_name}'.")
+    refiller.trigger()
+    return {"vnet": vnet_name, "cloned_vms": [{"name": member[0].get('name'), "id": member[0]['vmid']} for member in members]}
+
+def _free_vlan_tag(vnets: list, pool) -> int:
+    used = {vnet.get('tag') for vnet in vnets if vnet.get('zone') == pool.vlan_zone}
+    for tag in range(pool.vlan_tag_start, pool.vlan_tag_end + 1):
+        if tag not in used:
+            return tag
+    return None
+
+def _discard_slot(proxmox, lab_group: str, slot_num: int, slot: dict):
+    """Removes the VMs and VNET of a slot left incomplete by a failed refill."""
+    vnet_name = None
+    # Claims rewrite a whole slot under the claim lock, so under it a member is either still pooled or claimed.
+    with timed_lock(claim_lock, "warm_pool_claim", timeout=30):
+        for vm_summary, _ in slot["vms"]:
+            vm = proxmox.nodes(vm_summary['node']).qemu(vm_summary['vmid'])
+            config = vm.config.get()
+            if not POOL_PATTERN.search(config.get('description', '')):
+                continue
+            vnet_name = vnet_name or net_bridge(config)
+            upid = vm.delete()
+            if is_upid(upid):
+                wait_for_task(proxmox, vm_summary['node'], upid)
+    if vnet_name and re.match(r"vnet\d+$", vnet_name):
+        try:
+            proxmox.cluster.sdn.vnets(vnet_name).delete()
+            proxmox.cluster.sdn.put()
+        except Exception as vnet_error:
+            logger.error(f"Could not delete VNET {vnet_name} of discarded warm pool slot: {save_error(vnet_error)}")
+    logger.warning(f"Discarded incomplete warm pool slot {slot_num} of '{lab_group}'.")
+
+def _fill_slot(proxmox, pool, slot_num: int, templates: list, placements: list, existing_ids: set):
+    """Clones one pooled instance: a new VNET from the pool's tag range, every template cloned onto it, nothing started."""
+    vnets = proxmox.cluster.sdn.vnets.get()
+    vlan_tag = _free_vlan_tag(vnets, pool)
+    if vlan_tag is None:
+        raise Exception("No free VLAN tag left in {}-{} of zone '{}'.".format(pool.vlan_tag_start, pool.vlan_tag_end, pool.vlan_zone))
+    vnet_name = next_vnet_name(vnets)
+    proxmox.cluster.sdn.vnets.post(vnet=vnet_name, zone=pool.vlan_zone, tag=vlan_tag)
+    sdn_apply_upid = proxmox.cluster.sdn.put()
+
+    marker = POOL_DESCRIPTION.format(pool.lab_group, slot_num, len(templates))
+    next_vmid = WARM_POOL_VMID_BASE
+    jobs = []
+    for (template_summary, template_config), (target_node, source) in zip(templates, placements):
+        while next_vmid in existing_ids:
+            next_vmid += 1
+        existing_ids.add(next_vmid)
+        name = "{}-{}-{}".format(pool.lab_group.lower(), template_summary.get('name', 'vm'), next_vmid)
+        jobs.append((source['node'], source['vmid'], template_config, next_vmid, name, marker, target_node, source['storages'],
+                     lab_tags.pool_tags(template_config.get('tags'), pool.lab_group)))
+    with ThreadPoolExecutor(max_workers=min(16, len(jobs) + 1)) as executor:
+        sdn_ready = submit(executor, wait_for_sdn_apply, proxmox, sdn_apply_upid)
+        futures = [submit(executor, provision_clone, proxmox, *job[:6], vnet_name, target_node=job[6], source_storages=job[7], start=False, final_description=marker + " | Ready", tags=job[8], queue="warm_pool")
+                   for job in jobs]
+        for future in futures:
+            future.result()
+        sdn_ready.result()
+    logger.info(f"Warm pool slot {slot_num} of '{pool.lab_group}' ready on VNET '{vnet_name}'.")
+
+def refill_group(proxmox, pool, all_vms, members):
+    templates = group_templates(proxmox, all_vms, pool.lab_group)
+    if not templates:
+        logger.warning(f"Warm pool for '{pool.lab_group}' has no templates tagged with that lab group.")
+        return 0
+    slots = pool_slots(members, pool.lab_group)
+    # The refill lock is held, so an incomplete slot is a leftover of a failed refill rather than one in progress.
+    for (_, slot_num), slot in list(slots.items()):
+        if not slot["ready"]:
+            _discard_slot(proxmox, pool.lab_group, slot_num, slot)
+            del slots[(pool.lab_group, slot_num)]
+
+    # Pooled VMs are stopped, so /cluster/resources does not count their memory yet; they will run once claimed.
+    placer = cluster_placer(proxmox, headroom=WARM_POOL_MEMORY_HEADROOM, max_age=0)
+    for vm_summary, config in members:
+        if vm_summary.get('status') != 'running' and POOL_PATTERN.search(config.get('description', '')):
+            placer.reserve(vm_summary['node'], vm_summary.get('maxmem', 0))
+    sources_by_template = replicas.replica_sources(replicas.load_index(), all_vms)
+    existing_ids = {vm['vmid'] for vm in all_vms}
+    used_slots = {slot_num for (_, slot_num) in slots}
+    filled = 0
+    for _ in range(pool.size - len(slots)):
+        placements = placer.place_all(templates, strict=True, replicas=sources_by_template)
+        if placements is None:
+            logger.warning(f"Warm pool for '{pool.lab_group}' stays at {len(slots) + filled}/{pool.size}: node memory capacity reached.")
+            break
+        slot_num = next(num for num in range(1, len(used_slots) + 2) if num not in used_slots)
+        used_slots.add(slot_num)
+        _fill_slot(proxmox, pool, slot_num, templates, placements, existing_ids)
+        filled += 1
+    return filled
+
+def refill_all():
+    """One refill pass over every configured pool. A no-op while another worker is refilling."""
+    db = SessionLocal()
+    try:
+        pools = db.query(models.WarmPool).filter(models.WarmPool.size > 0).all()
+        db.expunge_all()
+    finally:
+        db.close()
+    if not pools:
+        return
+    try:
+        with refill_lock.acquire(timeout=0):
+            proxmox = get_proxmox_connection()
+            lab_tags.ensure_migrated(proxmox)
+            all_vms, members = read_inventory(proxmox, max_age=0)
+            for pool in pools:
+                try:
+                    if refill_group(proxmox, pool, all_vms, members):
+                        all_vms, members = read_inventory(proxmox, max_age=0)
+                except Exception as e:
+                    logger.error(f"Refilling the warm pool for '{pool.lab_group}' failed: {save_error(e)}")
+    except Timeout:
+        logger.debug("Another worker is refilling the warm pool.")
+
+class WarmPoolRefiller:
+    """Background thread running refill_all() every WARM_POOL_INTERVAL seconds, or as soon as triggered."""
+    def __init__(self, interval: float = WARM_POOL_INTERVAL):
+        self.interval = interval
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="warm-pool-refiller", daemon=True)
+            self._thread.start()
+            self.trigger()
+
+    def trigger(self):
+        self._wakeup.set()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            try:
+                refill_all()
+            except Exception as e:
+                logger.error(f"Warm pool refill failed: {save_error(e)}")
+
+refiller = WarmPoolRefiller()
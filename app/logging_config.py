@@ -1,5 +1,13 @@
+import os
+import json
+import queue
+import atexit
+import random
 import logging
+import logging.handlers
+from logging.config import dictConfig
 from pydantic import BaseModel
+from app.core.context import get_request_id
 
 class JsonFormatter(logging.Formatter):
     """
@@ -9,6 +17,7 @@ class JsonFormatter(logging.Formatter):
         log_object = {
             "timestamp": self.formatTime(record, self.datefmt),
             "level": record.levelname,
+            "request_id": getattr(record, "request_id", "-"),
             "message": record.getMessage(),
             "module": record.module,
             "function": record.funcName,
@@ -16,21 +25,87 @@ class JsonFormatter(logging.Formatter):
         }
         if record.exc_info:
             log_object['exc_info'] = self.formatException(record.exc_info)
-        return str(log_object).replace("'", '"')
+        elif record.exc_text:
+            log_object['exc_info'] = record.exc_text
+        return json.dumps(log_object, default=str, ensure_ascii=False, separators=(",", ":"))
+
+class RequestIdFilter(logging.Filter):
+    """
+    Stamps every record with the ID of the request that produced it.
+    Runs on the calling thread, before the record is handed to the queue.
+    """
+    def filter(self, record):
+        record.request_id = get_request_id()
+        return True
+
+class SamplingFilter(logging.Filter):
+    """
+    Keeps only a fraction of low-severity records.
+    `rates` maps a level name to the probability (0.0 - 1.0) of a record at that
+    level being kept. Levels not listed (WARNING and above by default) are always kept.
+    """
+    def __init__(self, rates: dict = None):
+        super().__init__()
+        self.rates = {logging.getLevelName(name): float(rate) for name, rate in (rates or {}).items()}
+
+    def filter(self, record):
+        rate = self.rates.get(record.levelno)
+        if rate is None or rate >= 1.0:
+            return True
+        return random.random() < rate
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that never blocks the request thread.
+    Only the cheap parts of formatting (message interpolation, traceback text) are done
+    here; the actual formatting and file I/O happen on the QueueListener thread.
+    Records are dropped (and counted) when the queue is full.
+    """
+    dropped = 0
+
+    def prepare(self, record):
+        message = record.getMessage()
+        record = logging.makeLogRecord(record.__dict__)
+        record.message = message
+        record.msg = message
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            NonBlockingQueueHandler.dropped += 1
 
 class LogConfig(BaseModel):
     """Logging configuration to be set for the server"""
 
     LOGGER_NAME: str = "proxmox_api"
-    LOG_LEVEL: str = "DEBUG"
+    LOG_LEVEL: str = os.getenv("LOG_LEVEL", "DEBUG")
+    LOG_QUEUE_SIZE: int = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
 
     # Logging config
     version: int = 1
     disable_existing_loggers: bool = False
+    filters: dict = {
+        "request_id": {
+            "()": "app.logging_config.RequestIdFilter",
+        },
+        "sampling": {
+            "()": "app.logging_config.SamplingFilter",
+            "rates": {
+                "DEBUG": os.getenv("LOG_SAMPLE_DEBUG", "1.0"),
+                "INFO": os.getenv("LOG_SAMPLE_INFO", "1.0"),
+            },
+        },
+    }
     formatters: dict = {
         "default": {
             "()": "uvicorn.logging.DefaultFormatter",
-            "fmt": "%(levelprefix)s | %(asctime)s | %(message)s",
+            "fmt": "%(levelprefix)s | %(asctime)s | %(request_id)s | %(message)s",
             "datefmt": "%Y-%m-%d %H:%M:%S",
         },
         "json": {
@@ -53,5 +128,25 @@ class LogConfig(BaseModel):
         },
     }
     loggers: dict = {
-        LOGGER_NAME: {"handlers": ["default", "file_json"], "level": LOG_LEVEL},
+        LOGGER_NAME: {"handlers": ["default", "file_json"], "level": LOG_LEVEL, "filters": ["sampling", "request_id"]},
     }
+
+def setup_logging(config: LogConfig = None) -> logging.handlers.QueueListener:
+    """
+    Applies the logging config, then moves the app logger's handlers behind a
+    QueueHandler/QueueListener pair so request threads only pay for an enqueue.
+    """
+    config = config or LogConfig()
+    dictConfig(config.dict())
+
+    app_logger = logging.getLogger(config.LOGGER_NAME)
+    handlers = list(app_logger.handlers)
+    for handler in handlers:
+        app_logger.removeHandler(handler)
+
+    log_queue = queue.Queue(maxsize=config.LOG_QUEUE_SIZE)
+    app_logger.addHandler(NonBlockingQueueHandler(log_queue))
+    listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
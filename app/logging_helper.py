@@ -1,33 +1,135 @@
 import os
+import atexit
+import hashlib
+import logging
+import threading
 import traceback
-from datetime import datetime
+from datetime import datetime, timezone
+from sqlalchemy import func
+from sqlalchemy.dialects.sqlite import insert
+from app.database import SessionLocal
+from app import models
+
+logger = logging.getLogger("proxmox_api")
+
+ERROR_FLUSH_INTERVAL = float(os.getenv("ERROR_FLUSH_INTERVAL", "5"))
+ERROR_FLUSH_BATCH = int(os.getenv("ERROR_FLUSH_BATCH", "200"))
+
+def _fingerprint(e: Exception) -> str:
+    """
+    Identifies an error by its type and the code path that raised it.
+    The message is left out on purpose so that e.g. the same timeout on different
+    VMIDs collapses into one record.
+    """
+    frames = traceback.extract_tb(e.__traceback__)
+    key = "|".join([type(e).__module__, type(e).__qualname__] + ["{}:{}:{}".format(f.filename, f.name, f.lineno) for f in frames])
+    return hashlib.sha1(key.encode("utf-8", "replace")).hexdigest()
+
+class ErrorStore:
+    """
+    Aggregates exceptions in memory by fingerprint and writes them to the
+    `error_records` table in batches from a background thread.
+    """
+    def __init__(self, flush_interval: float = ERROR_FLUSH_INTERVAL, batch_size: int = ERROR_FLUSH_BATCH):
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def record(self, e: Exception, traceback_str: str) -> str:
+        fingerprint = _fingerprint(e)
+        now = datetime.now(timezone.utc)
+        with self._lock:
+            entry = self._pending.get(fingerprint)
+            if entry:
+                entry["count"] += 1
+                entry["message"] = str(e)
+                entry["last_seen"] = now
+            else:
+                self._pending[fingerprint] = {
+                    "exc_type": type(e).__name__,
+                    "message": str(e),
+                    "traceback": traceback_str,
+                    "count": 1,
+                    "first_seen": now,
+                    "last_seen": now,
+                }
+            pending_count = len(self._pending)
+        self._ensure_started()
+        if pending_count >= self.batch_size:
+            self._wakeup.set()
+        return fingerprint
+
+    def flush(self):
+        """Writes all pending aggregates to the database in a single transaction."""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, {}
+            if not batch:
+                return
+            db = SessionLocal()
+            try:
+                # One upsert per batch: several workers may flush the same new fingerprint at
+                # once, and a read-then-insert would lose the whole batch to the unique constraint.
+                table = models.ErrorRecord.__table__
+                statement = insert(table).values([{"fingerprint": fingerprint, **entry} for fingerprint, entry in batch.items()])
+                statement = statement.on_conflict_do_update(index_elements=[table.c.fingerprint], set_={
+                    "count": table.c.count + statement.excluded.count,
+                    "message": statement.excluded.message,
+                    "last_seen": func.max(table.c.last_seen, statement.excluded.last_seen),
+                })
+                db.execute(statement)
+                db.commit()
+            except Exception:
+                db.rollback()
+                self._requeue(batch)
+                logger.warning(f"Failed to write {len(batch)} error record(s) to the error store; retrying on the next flush.", exc_info=True)
+            finally:
+                db.close()
+
+    def _requeue(self, batch: dict):
+        """Merges a batch that could not be written back into the pending aggregates."""
+        with self._lock:
+            for fingerprint, entry in batch.items():
+                pending = self._pending.get(fingerprint)
+                if pending is None:
+                    self._pending[fingerprint] = entry
+                    continue
+                # Errors recorded since the batch was taken are newer: keep their message and last_seen
+                pending["count"] += entry["count"]
+                pending["first_seen"] = min(pending["first_seen"], entry["first_seen"])
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="error-store-writer", daemon=True)
+                self._thread.start()
+                atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+error_store = ErrorStore()
 
 def save_error(e: Exception) -> str:
     """
-    Catches an exception, formats the full traceback, saves it to a timestamped file,
-    and returns the traceback as a string.
+    Records an exception in the deduplicated error store and returns the traceback
+    as a string. The database write happens later, in a background batch.
 
     Args:
         e (Exception): The exception object caught.
 
     Returns:
-        str: The full traceback string.
+        str: The error fingerprint and the full traceback string.
     """
-    log_dir = "log_error"
-    # 1. Ensure the log directory exists
-    os.makedirs(log_dir, exist_ok=True)
-
-    # 2. Generate a unique, sortable filename using a timestamp
-    timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S.%f")
-    filepath = os.path.join(log_dir, f"error_{timestamp}.log")
-
-    # 3. Get the full traceback as a string
-    traceback_str = traceback.format_exc()
-
-    # 4. Write the traceback to the file
-    with open(filepath, "w") as f:
-        f.write(f"Error: {str(e)}\n\n")
-        f.write(traceback_str)
-    
-    # 5. Return the traceback string to be logged
-    return f"Error saved to {filepath}. Traceback: {traceback_str}"
+    traceback_str = "".join(traceback.format_exception(type(e), e, e.__traceback__))
+    fingerprint = error_store.record(e, traceback_str)
+    return f"Error {fingerprint[:12]} recorded. Traceback: {traceback_str}"
@@ -1,23 +1,115 @@
-from fastapi import FastAPI
-from app.routers import vms, networks, sdn, lab_builder, labs, auth
+import os
+import time
+import logging
+import secrets
+from typing import Optional
+from fastapi import FastAPI, Request, Response, Depends, Header, HTTPException
+from fastapi.responses import JSONResponse, ORJSONResponse
+from starlette.concurrency import run_in_threadpool
+from app.routers import vms, networks, sdn, lab_builder, labs, auth, errors, dashboard
 from app import models # <-- Import models
 from app.database import engine # <-- Import engine
-from logging.config import dictConfig # <-- Import this
-from .logging_config import LogConfig #
+from app.core.compression import CompressionMiddleware
+from app.core.context import request_id_var, new_request_id
+from app.core.metrics import HTTP_REQUEST_SECONDS, render_latest
+from app.core.tracing import RequestTrace, trace_var, elapsed_ms
+from app.core.warm_pool import refiller
+from app.routers.auth import is_admin_token
+from .logging_config import setup_logging
 
-dictConfig(LogConfig().dict())
+setup_logging()
+logger = logging.getLogger("proxmox_api")
 models.Base.metadata.create_all(bind=engine) # <-- Add this line
 
 app = FastAPI(
     title="Proxmox Cyber Range API",
     description="An API to manage Proxmox virtual machines for a cyber range.",
     version="1.0.0",
+    default_response_class=ORJSONResponse,
 )
 
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    """Observes request latency labelled by the matched route template (not the raw path)."""
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        route_path = getattr(route, "path", "unmatched")
+        HTTP_REQUEST_SECONDS.labels(request.method, route_path, str(status)).observe(time.perf_counter() - start)
+
+@app.middleware("http")
+async def trace_request(request: Request, call_next):
+    """
+    Tags the request with an ID (reusing the client's X-Request-ID if sent), counts the
+    Proxmox calls made on its behalf and reports them in the access log and response headers.
+    Admins can send `X-Profile: 1` to get a sampled profile of the handler instead of its body.
+    """
+    start = time.perf_counter()
+    request_id = request.headers.get("X-Request-ID") or new_request_id()
+    profile = False
+    if request.headers.get("X-Profile") == "1":
+        authorization = request.headers.get("Authorization", "")
+        if authorization.startswith("Bearer "):
+            profile = await run_in_threadpool(is_admin_token, authorization[len("Bearer "):])
+    trace = RequestTrace(request_id, profile=profile)
+    request_id_token = request_id_var.set(request_id)
+    trace_token = trace_var.set(trace)
+    try:
+        response = await call_next(request)
+        wall_ms = elapsed_ms(start)
+        upstream_ms = round(trace.upstream_seconds * 1000, 1)
+        logger.info(f"{request.method} {request.url.path} -> {response.status_code} in {wall_ms}ms "
+                    f"[proxmox_calls={trace.upstream_calls} proxmox_ms={upstream_ms}]")
+    finally:
+        trace_var.reset(trace_token)
+        request_id_var.reset(request_id_token)
+    if trace.profiler is not None:
+        response = JSONResponse({
+            "request_id": request_id,
+            "path": request.url.path,
+            "status_code": response.status_code,
+            "wall_ms": wall_ms,
+            "proxmox_calls": trace.upstream_calls,
+            "proxmox_ms": upstream_ms,
+            "proxmox_calls_by_path": dict(trace.upstream_by_path.most_common()),
+            "profile": trace.profiler.report(),
+        })
+    response.headers["X-Request-ID"] = request_id
+    response.headers["X-Upstream-Calls"] = str(trace.upstream_calls)
+    response.headers["Server-Timing"] = 'proxmox;dur={};desc="{} calls", total;dur={}'.format(upstream_ms, trace.upstream_calls, wall_ms)
+    return response
+
+# Added last, so it is the outermost middleware and compresses the final body and headers.
+app.add_middleware(CompressionMiddleware)
+
+@app.on_event("startup")
+def start_warm_pool_refiller():
+    refiller.start()
+
 @app.get("/")
 def read_root():
     return {"message": "Welcome to the Proxmox API"}
 
+# Static bearer token for the Prometheus scraper; admins' own tokens are accepted too.
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
+def require_metrics_access(authorization: Optional[str] = Header(None)):
+    """/metrics exposes node names and route timings, so it takes METRICS_TOKEN or an admin token."""
+    token = authorization[len("Bearer "):] if authorization and authorization.startswith("Bearer ") else None
+    if token and ((METRICS_TOKEN and secrets.compare_digest(token, METRICS_TOKEN)) or is_admin_token(token)):
+        return
+    raise HTTPException(status_code=401, detail="Not authenticated", headers={"WWW-Authenticate": "Bearer"})
+
+@app.get("/metrics", include_in_schema=False, dependencies=[Depends(require_metrics_access)])
+def metrics():
+    body, content_type = render_latest()
+    return Response(content=body, media_type=content_type)
+
 # --- THIS IS THE CORRECTED LINE ---
 # The prefix="/api" has been removed.
 app.include_router(vms.router)
@@ -26,4 +118,6 @@ app.include_router(sdn.router)
 app.include_router(lab_builder.router)
 app.include_router(labs.router)
 app.include_router(auth.router)
+app.include_router(errors.router)
+app.include_router(dashboard.router)
 
@@ -1,4 +1,4 @@
-from sqlalchemy import Boolean, Column, Integer, String
+from sqlalchemy import Boolean, Column, DateTime, Integer, String, Text
 from .database import Base
 
 class User(Base):
@@ -12,3 +12,68 @@ class User(Base):
     disabled = Column(Boolean, default=False)
     active_token_jti = Column(String, nullable=True)
     is_admin = Column(Boolean, default=False)
+
+class ErrorRecord(Base):
+    __tablename__ = "error_records"
+
+    id = Column(Integer, primary_key=True, index=True)
+    fingerprint = Column(String, unique=True, index=True)
+    exc_type = Column(String)
+    message = Column(Text)
+    traceback = Column(Text)
+    count = Column(Integer, default=0)
+    first_seen = Column(DateTime, index=True)
+    last_seen = Column(DateTime, index=True)
+
+class WarmPool(Base):
+    __tablename__ = "warm_pools"
+
+    lab_group = Column(String, primary_key=True, index=True)
+    size = Column(Integer, default=0)
+    vlan_zone = Column(String)
+    vlan_tag_start = Column(Integer)
+    vlan_tag_end = Column(Integer)
+
+class TemplateReplica(Base):
+    __tablename__ = "template_replicas"
+
+    id = Column(Integer, primary_key=True, index=True)
+    template_vmid = Column(Integer, index=True)
+    replica_vmid = Column(Integer, unique=True, index=True)
+    node = Column(String)
+    storage = Column(String)
+    source_digest = Column(String, nullable=True)
+    created_at = Column(DateTime)
+
+class LabOperation(Base):
+    __tablename__ = "lab_operations"
+
+    id = Column(Integer, primary_key=True, index=True)
+    kind = Column(String, index=True)
+    lab_group = Column(String, index=True)
+    status = Column(String, index=True)
+    params = Column(Text)
+    error = Column(Text, nullable=True)
+    created_by = Column(String, nullable=True)
+    created_at = Column(DateTime)
+    updated_at = Column(DateTime)
+
+class LabOperationStep(Base):
+    __tablename__ = "lab_operation_steps"
+
+    id = Column(Integer, primary_key=True, index=True)
+    operation_id = Column(Integer, index=True)
+    position = Column(Integer)
+    key = Column(String)
+    status = Column(String, default="pending")
+    stage = Column(String, nullable=True)
+    data = Column(Text)
+    error = Column(Text, nullable=True)
+    updated_at = Column(DateTime)
+
+class DataMigration(Base):
+    __tablename__ = "data_migrations"
+
+    name = Column(String, primary_key=True, index=True)
+    applied_at = Column(DateTime)
+    detail = Column(Text, nullable=True)
@@ -18,6 +18,7 @@ from sqlalchemy.orm import Session
 # Import your new database models and session manager
 from .. import models
 from ..database import SessionLocal
+from app.core.tracing import TracedRoute
 
 load_dotenv()
 # --- Configuration (unchanged) ---
@@ -29,7 +30,7 @@ if SECRET_KEY is None:
     raise ValueError("SECRET_KEY not found in environment. Make sure you have a .env file with the SECRET_KEY set.")
 # --- Setup ---
 logger = logging.getLogger("proxmox_api")
-router = APIRouter()
+router = APIRouter(route_class=TracedRoute)
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="api/token")
 
@@ -134,6 +135,19 @@ async def get_current_admin_user(
     if not current_user.is_admin:
         raise HTTPException(status_code=403, detail="Not enough permissions")
     return current_user
+
+def is_admin_token(token: str) -> bool:
+    """Non-dependency variant of get_current_admin_user, for middleware that only sees the raw bearer token."""
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        return False
+    db = SessionLocal()
+    try:
+        user = get_user(db, username=payload.get("sub"))
+        return bool(user and not user.disabled and user.is_admin and user.active_token_jti == payload.get("jti"))
+    finally:
+        db.close()
 # --- API Endpoints ---
 @router.post("/token", response_model=Token, tags=["Authentication"])
 async def login_for_access_token(
@@ -0,0 +1,51 @@
+import logging
+from typing import Optional
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import APIRouter, HTTPException, Depends
+from app.logging_helper import save_error
+from app.core.proxmox import get_proxmox_connection
+from app.core.tasks import submit
+from app.core.responses import EncodedJSONResponse, dumps, encode_object
+from app.routers.auth import get_current_active_user
+from app.core.tracing import TracedRoute
+from .vms import _vm_list
+from .networks import _bridges_by_node
+
+logger = logging.getLogger("proxmox_api")
+router = APIRouter(route_class=TracedRoute)
+
+# section -> fn(proxmox) returning the same document as its own endpoint (or its JSON, as bytes)
+SECTIONS = {
+    "vms": _vm_list,
+    "zones": lambda proxmox: proxmox.cluster.sdn.zones.get(),
+    "vnets": lambda proxmox: proxmox.cluster.sdn.vnets.get(),
+    "networks": _bridges_by_node,
+}
+
+@router.get("/dashboard", tags=["Dashboard"])
+def get_dashboard(sections: Optional[str] = None, current_user: dict = Depends(get_current_active_user)):
+    logger.info(f"User '{current_user.username}' requested the dashboard ({sections or 'all sections'}).")
+    """
+    The documents of /vms, /sdn/zones, /sdn/vnets and /networks in one response, for the views
+    that used to request them separately. `sections` is a comma-separated subset (all by
+    default). The sections are read concurrently over one Proxmox connection, sharing the
+    inventory cache; a section that fails is reported under "errors" without failing the others.
+    Sections already encoded (the VM list) are spliced into the response as they are.
+    """
+    selected = [section.strip() for section in (sections or ",".join(SECTIONS)).split(",") if section.strip()]
+    unknown = [section for section in selected if section not in SECTIONS]
+    if unknown or not selected:
+        raise HTTPException(status_code=400, detail="Unknown dashboard section(s) '{}'. Available: {}".format(",".join(unknown), ", ".join(SECTIONS)))
+    proxmox = get_proxmox_connection()
+    dashboard, errors = {}, {}
+    with ThreadPoolExecutor(max_workers=len(selected)) as executor:
+        futures = {section: submit(executor, SECTIONS[section], proxmox, queue="dashboard") for section in dict.fromkeys(selected)}
+        for section, future in futures.items():
+            try:
+                dashboard[section] = future.result()
+            except Exception as e:
+                logger.error(f"Error reading dashboard section '{section}': {save_error(e)}.")
+                errors[section] = str(e)
+    if errors and not dashboard:
+        raise HTTPException(status_code=500, detail=errors)
+    return EncodedJSONResponse(encode_object({"errors": errors}, {section: data if isinstance(data, bytes) else dumps(data) for section, data in dashboard.items()}))
@@ -0,0 +1,62 @@
+import logging
+from typing import Optional
+from fastapi import APIRouter, HTTPException, Depends
+from sqlalchemy.orm import Session
+from app import models
+from app.logging_helper import error_store
+from app.routers.auth import get_current_admin_user, get_db
+from app.core.tracing import TracedRoute
+
+logger = logging.getLogger("proxmox_api")
+router = APIRouter(route_class=TracedRoute)
+
+def _serialize(record: models.ErrorRecord, include_traceback: bool = False) -> dict:
+    data = {
+        "fingerprint": record.fingerprint,
+        "exc_type": record.exc_type,
+        "message": record.message,
+        "count": record.count,
+        "first_seen": record.first_seen,
+        "last_seen": record.last_seen,
+    }
+    if include_traceback:
+        data["traceback"] = record.traceback
+    return data
+
+@router.get("/errors", tags=["Admin"])
+def list_errors(q: Optional[str] = None, exc_type: Optional[str] = None, order_by: str = "last_seen", limit: int = 50, offset: int = 0,
+                db: Session = Depends(get_db), current_user: dict = Depends(get_current_admin_user)):
+    logger.info(f"Admin '{current_user.username}' requested the error store.")
+    """
+    Lists distinct errors, most recent first (or most frequent with order_by=count).
+    `q` filters on the error message, `exc_type` on the exception class name.
+    """
+    if order_by not in ("last_seen", "count", "first_seen"):
+        raise HTTPException(status_code=400, detail="order_by must be one of: last_seen, count, first_seen.")
+    error_store.flush()
+    query = db.query(models.ErrorRecord)
+    if q:
+        query = query.filter(models.ErrorRecord.message.contains(q))
+    if exc_type:
+        query = query.filter(models.ErrorRecord.exc_type == exc_type)
+    total = query.count()
+    records = query.order_by(getattr(models.ErrorRecord, order_by).desc()).offset(offset).limit(min(limit, 500)).all()
+    return {"total": total, "errors": [_serialize(record) for record in records]}
+
+@router.get("/errors/{fingerprint}", tags=["Admin"])
+def get_error(fingerprint: str, db: Session = Depends(get_db), current_user: dict = Depends(get_current_admin_user)):
+    """Returns one error with its full traceback. Accepts the short 12-character fingerprint from the logs."""
+    error_store.flush()
+    record = db.query(models.ErrorRecord).filter(models.ErrorRecord.fingerprint.startswith(fingerprint)).first()
+    if not record:
+        raise HTTPException(status_code=404, detail="Error {} not found.".format(fingerprint))
+    return _serialize(record, include_traceback=True)
+
+@router.delete("/errors", tags=["Admin"])
+def clear_errors(db: Session = Depends(get_db), current_user: dict = Depends(get_current_admin_user)):
+    logger.info(f"Admin '{current_user.username}' cleared the error store.")
+    """Removes every record from the error store."""
+    error_store.flush()
+    deleted = db.query(models.ErrorRecord).delete()
+    db.commit()
+    return {"message": "Error store cleared.", "deleted": deleted}
@@ -1,16 +1,31 @@
 import re
-import time
 import logging
 from app.logging_helper import save_error
 from fastapi import APIRouter, HTTPException, Depends
 from pydantic import BaseModel
-from typing import List
+from typing import List, Optional
+from sqlalchemy.orm import Session
+from app import models
 from app.core.proxmox import get_proxmox_connection
+from concurrent.futures import ThreadPoolExecutor
+from app.core.tasks import clone_limiter, is_upid, map_concurrent, submit, wait_for_task
+from app.core.lab_pipeline import LAB_BASELINE_SNAPSHOT, boot_batch_for, disk_storages, next_vnet_name, provision_clone, provision_existing, wait_for_sdn_apply
+from app.core.boot import boot_priority
+from app.core import warm_pool
+from app.core import lab_tags
+from app.core.placement import POLICIES, cluster_placer, record_placement, template_source
+from app.core.planner import CapacityError, ensure_capacity, plan_clones
+from app.core.inventory import cluster_resources
+from app.core.catalog import template_catalog
+from app.core.lab_index import lab_index
+from app.core import replicas
+from app.core.journal import Journal
 from .vms import _find_vm_node_by_id
-from app.routers.auth import get_current_active_user
+from app.routers.auth import get_current_active_user, get_current_admin_user, get_db
+from app.core.tracing import TracedRoute
 
 logger = logging.getLogger("proxmox_api")
-router = APIRouter()
+router = APIRouter(route_class=TracedRoute)
 
 class TemplateTagRequest(BaseModel):
     lab_groups: List[str]
@@ -19,18 +34,23 @@ class LabInstantiateRequest(BaseModel):
     lab_group: str
     vlan_zone: str
     vlan_tag: int
+    placement_policy: Optional[str] = None
+    queue_timeout: int = 0
 
-def _parse_tags_from_description(description: str) -> dict:
-    tags = {}
-    group_match = re.search(r"LabGroups:\[(.*?)\]", description)
-    if group_match and group_match.group(1):
-        tags['lab_groups'] = group_match.group(1).split(',')
-    
-    instance_match = re.search(r"Lab: (.*?) \| Instance: (\d+)", description)
-    if instance_match:
-        tags['lab_name'] = instance_match.group(1)
-        tags['lab_instance'] = int(instance_match.group(2))
-    return tags
+class ReplicaTarget(BaseModel):
+    node: str
+    storage: str
+
+class TemplateReplicationRequest(BaseModel):
+    lab_group: Optional[str] = None
+    template_ids: Optional[List[int]] = None
+    targets: List[ReplicaTarget]
+
+class WarmPoolRequest(BaseModel):
+    size: int
+    vlan_zone: str
+    vlan_tag_start: int
+    vlan_tag_end: int
 
 def _build_description_with_tags(existing_desc: str, lab_groups: List[str]) -> str:
     # First, remove any existing LabGroups tag to avoid duplication
@@ -43,6 +63,37 @@ def _build_description_with_tags(existing_desc: str, lab_groups: List[str]) -> s
         
     return new_desc
 
+def _catalog_template(entry: dict) -> dict:
+    return {key: entry[key] for key in ("vmid", "name", "node", "lab_groups", "footprint", "disks", "nics")}
+
+@router.get("/templates", tags=["Lab Builder"])
+def list_templates(lab_group: Optional[str] = None, current_user: dict = Depends(get_current_active_user)):
+    logger.info(f"User '{current_user.username}' requested the template catalog.")
+    """
+    Every template with its lab groups, footprint and NICs, and per lab group its templates,
+    total footprint and NIC count, served from the template catalog (app/core/catalog.py).
+    With `lab_group`, only that group.
+    """
+    proxmox = get_proxmox_connection()
+    try:
+        template_catalog.refresh(proxmox)
+        groups = template_catalog.groups()
+        if lab_group is not None:
+            if lab_group not in groups:
+                raise HTTPException(status_code=404, detail="No templates found in lab group '{}'.".format(lab_group))
+            groups = {lab_group: groups[lab_group]}
+        templates = template_catalog.templates()
+        return {
+            "lab_groups": [{"lab_group": name, "templates": [_catalog_template(entry) for entry in template_catalog.templates(name)],
+                            "footprint": index["footprint"], "nics": index["nics"]} for name, index in sorted(groups.items())],
+            "untagged": [_catalog_template(entry) for entry in templates if not entry["lab_groups"]] if lab_group is None else [],
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error reading the template catalog: {save_error(e)}.")
+        raise HTTPException(status_code=500, detail=str(e))
+
 @router.put("/templates/{vmid}/tag", tags=["Lab Builder"])
 def tag_template(vmid: int, request: TemplateTagRequest, current_user: dict = Depends(get_current_active_user)):
     logger.info(f"User '{current_user.username}' requested to tag template {vmid}.")
@@ -59,8 +110,11 @@ def tag_template(vmid: int, request: TemplateTagRequest, current_user: dict = De
 
         existing_desc = current_config.get('description', '')
         new_description = _build_description_with_tags(existing_desc, request.lab_groups)
+        new_tags = lab_tags.with_lab_groups(current_config.get('tags', ''), request.lab_groups)
         
-        proxmox.nodes(node_name).qemu(vmid).config.put(description=new_description)
+        proxmox.nodes(node_name).qemu(vmid).config.put(description=new_description, **lab_tags.tag_update(new_tags))
+        cluster_resources.invalidate()
+        template_catalog.record(vmid, {**current_config, "description": new_description}, new_tags)
         logger.info(f"Template {vmid} tags updated successfully.")
         return {"message": "Template tags updated successfully."}
     except Exception as e:
@@ -70,133 +124,355 @@ def tag_template(vmid: int, request: TemplateTagRequest, current_user: dict = De
 @router.post("/labs/instantiate", tags=["Lab Builder"])
 def instantiate_lab(request: LabInstantiateRequest, current_user: dict = Depends(get_current_active_user)):
     logger.info(f"User '{current_user.username}' requested to launch/instantiate lab.")
+    """
+    Creates a new instance of a lab group on its own VNET.
+    Every member VM runs through its own clone -> reconfigure -> start pipeline; the pipelines
+    run concurrently (bounded per node and per storage), so the lab is up in about the time
+    of its slowest clone. Clones are spread over the nodes by the placement policy and made
+    from the nearest replica of each template. Nothing is created unless the capacity plan fits;
+    with `queue_timeout` the request waits up to that many seconds for capacity instead of
+    failing with 409. When the lab group's warm pool has a ready instance, that instance is
+    handed out instead and the pool refills in the background.
+    Every step is journalled (app/core/journal.py); a partly provisioned lab can be resumed or
+    rolled back through /labs/operations/{operation_id}.
+    """
+    if request.placement_policy and request.placement_policy not in POLICIES:
+        raise HTTPException(status_code=400, detail="Unknown placement policy '{}'. Available: {}".format(request.placement_policy, ", ".join(sorted(POLICIES))))
     proxmox = get_proxmox_connection()
+    journal = None
     try:
         nodes = proxmox.nodes.get()
         if not nodes:
             logger.error(f"No Proxmox nodes found.")
             raise HTTPException(status_code=500, detail="No Proxmox nodes found.")
 
-        # 1. Create the new VNET
-        all_vnets = proxmox.cluster.sdn.vnets.get()
-        highest_num = 0
-        for vnet in all_vnets:
-            match = re.match(r"vnet(\d+)", vnet.get('vnet', ''))
-            if match:
-                num = int(match.group(1))
-                if num > highest_num:
-                    highest_num = num
-        new_vnet_name = "vnet{}".format(highest_num + 1)
+        # 1. Read every VM with its lab tags from one /cluster/resources call; used for the instance number,
+        #    the warm pool and the lab members. Configs are only read for the VMs of this lab group.
+        all_vms = lab_tags.lab_vms(proxmox, max_age=0)
+
+        highest_instance = 0
+        for vm_summary in all_vms:
+            if vm_summary['lab'].get('lab_name') == request.lab_group:
+                highest_instance = max(highest_instance, vm_summary['lab']['lab_instance'])
         
+        next_instance_num = highest_instance + 1
+
+        # 2. Hand out a pre-cloned instance if the warm pool has one ready
+        pooled = None
+        pool_vms = warm_pool.pool_members(proxmox, all_vms, request.lab_group)
+        if pool_vms:
+            pooled = warm_pool.claim(proxmox, request.lab_group, request.vlan_zone, request.vlan_tag, next_instance_num, pool_vms)
+        if pooled:
+            lab_index.record_vnet(request.lab_group, next_instance_num, pooled['vnet'])
+            return {
+                "message": "Lab '{}' instance {} instantiated successfully on VNET '{}'.".format(request.lab_group, next_instance_num, pooled['vnet']),
+                "cloned_vms": pooled['cloned_vms'],
+                "added_vms": [],
+                "failed_to_add_vms": [],
+                "from_warm_pool": True
+            }
+
+        # 3. Pick the members: templates to clone (from the template catalog), free regular VMs to "consume"
+        catalog_entries = template_catalog.refresh(proxmox, vms=all_vms).templates(request.lab_group)
+        templates = [(entry['summary'], entry['config']) for entry in catalog_entries]
+        existing_members = []
+        failed_to_add_vms = []
+        group_vms = [vm_summary for vm_summary in all_vms if vm_summary.get('template') != 1 and request.lab_group in vm_summary['lab'].get('lab_groups', [])]
+        group_configs = map_concurrent(lambda vm: proxmox.nodes(vm['node']).qemu(vm['vmid']).config.get(), group_vms)
+        for vm_summary, config in zip(group_vms, group_configs):
+            if 'lab_instance' not in vm_summary['lab']:
+                existing_members.append((vm_summary, config))
+            else:
+                failed_to_add_vms.append({"name": vm_summary.get('name'), "reason": "Already part of another lab"})
+
+        if not templates and not existing_members:
+            logger.error(f"No available templates or VMs found in lab group '{request.lab_group}'.")
+            raise HTTPException(status_code=404, detail="No available templates or VMs found in lab group '{}'.".format(request.lab_group))
+
+        # 4. Check the cluster can hold the clones, and where each goes, before anything is created
+        sources_by_template = replicas.replica_sources(replicas.load_index(), all_vms)
+        plan = ensure_capacity(proxmox, [(entry['summary'], entry['config'], entry['record']) for entry in catalog_entries],
+                               sources_by_template, request.placement_policy, queue_timeout=request.queue_timeout)
+
+        # 5. Plan every member's pipeline and journal the whole operation before anything is created
+        new_vnet_name = next_vnet_name(proxmox.cluster.sdn.vnets.get())
+        existing_ids = {vm['vmid'] for vm in all_vms}
+        next_vmid = next_instance_num * 1000
+        clone_jobs = []
+        for (vm_summary, config), placement in zip(templates, plan['placements']):
+            while next_vmid in existing_ids:
+                next_vmid += 1
+            new_clone_name = "{}-{}-{}".format(request.lab_group.lower(), vm_summary.get('name', 'vm'), next_vmid)
+            clone_description = "Lab: {} clone | Instance: {}".format(request.lab_group, next_instance_num)
+            sources = [template_source(vm_summary, config)] + sources_by_template.get(vm_summary['vmid'], [])
+            source = next(source for source in sources if source['vmid'] == placement['source'])
+            record_placement(placement['node'], vm_summary.get('maxmem', 0), vm_summary.get('maxcpu', 0))
+            clone_jobs.append((source['node'], source['vmid'], config, next_vmid, new_clone_name, clone_description, placement['node'], source['storages'],
+                               lab_tags.clone_tags(vm_summary.get('tags'), request.lab_group, next_instance_num)))
+            next_vmid += 1
+        existing_jobs = []
+        for vm_summary, config in existing_members:
+            new_description = "{}\nLab: {} | Instance: {}".format(config.get('description', ''), request.lab_group, next_instance_num).strip()
+            existing_jobs.append((vm_summary['node'], vm_summary['vmid'], vm_summary.get('name'), config, new_description,
+                                  lab_tags.with_lab_instance(vm_summary.get('tags'), request.lab_group, next_instance_num, "added")))
+
+        steps = [("vnet", {"vnet": new_vnet_name})]
+        steps += [("clone:{}".format(job[3]), {"source_node": job[0], "source_vmid": job[1], "vmid": job[3], "name": job[4], "description": job[5],
+                                              "target_node": job[6], "source_storages": sorted(job[7]), "tags": job[8]}) for job in clone_jobs]
+        steps += [("add:{}".format(job[1]), {"node": job[0], "vmid": job[1], "name": job[2], "description": job[4], "tags": job[5],
+                                            "original_description": job[3].get('description', ''), "original_net0": job[3].get('net0', ''),
+                                            "original_tags": job[3].get('tags', ''), "original_status": vm_summary.get('status')})
+                  for job, (vm_summary, _) in zip(existing_jobs, existing_members)]
+        journal = Journal.open("instantiate", "{}_cloned{}".format(request.lab_group, next_instance_num),
+                               {"lab_group": request.lab_group, "instance": next_instance_num, "vnet": new_vnet_name,
+                                "vlan_zone": request.vlan_zone, "vlan_tag": request.vlan_tag, "baseline": LAB_BASELINE_SNAPSHOT or None}, steps, current_user.username)
+
+        # 6. Create the new VNET
         try:
             proxmox.cluster.sdn.vnets.post(vnet=new_vnet_name, zone=request.vlan_zone, tag=request.vlan_tag)
-            time.sleep(2)
-            proxmox.cluster.sdn.put()
+            sdn_apply_upid = proxmox.cluster.sdn.put()
+            journal.step("vnet", status="done")
+            lab_index.record_vnet(request.lab_group, next_instance_num, new_vnet_name)
             logger.info(f"New SDN Vnet '{new_vnet_name}' Created.")
         except Exception as vnet_error:
             logger.error(f"Failed to create SDN VNET (Normally is vnet tag alr exist): {save_error(vnet_error)}")
+            journal.step("vnet", status="failed", error=str(vnet_error))
             raise Exception("Failed to create SDN VNET. Proxmox Error: {}".format(vnet_error))
-        
-        # 2. Find existing instances to determine the next instance number
-        all_vms = []
-        for node in nodes:
-            for vm_summary in proxmox.nodes(node['node']).qemu.get():
-                all_vms.append({**vm_summary, 'node': node['node']})
 
-        highest_instance = 0
-        for vm_summary in all_vms:
-            config = proxmox.nodes(vm_summary['node']).qemu(vm_summary['vmid']).config.get()
-            desc = config.get('description', '')
-            desc_match = re.search(r"Lab: (.*?) \| Instance: (\d+)", desc)
-            if desc_match:
-                # Normalize the lab name from the description before comparing
-                lab_name_from_desc = desc_match.group(1).replace(' clone', '').replace(' added', '')
-                instance_num_from_desc = int(desc_match.group(2))
-                
-                if lab_name_from_desc == request.lab_group:
-                    if instance_num_from_desc > highest_instance:
-                        highest_instance = instance_num_from_desc
-        
-        next_instance_num = highest_instance + 1
-        
-        # 3. Determine starting VMID for the new instance
-        existing_ids = {vm['vmid'] for vm in all_vms}
-        vmid_prefix = next_instance_num * 1000
-        next_vmid = vmid_prefix
-
-        # 4. Clone and reconfigure
+        # 7. Run the pipelines, one per member: clone templates onto the planned node from the planned source,
+        #    "consume" free regular VMs. The SDN apply is waited on in parallel; VMs only start once it is done,
+        #    in startup order through the boot scheduler. Pipelines are submitted in that order, so a pipeline
+        #    waiting for its turn never holds the worker an earlier one needs.
         cloned_vms = []
         added_vms = []
-        failed_to_add_vms = []
+        errors = []
+        members = [(job[3], job[4], job[2]) for job in clone_jobs] + [(job[1], job[2], job[3]) for job in existing_jobs]
+        boot_batch = boot_batch_for(members)
+        submission_order = sorted(range(len(members)), key=lambda index: boot_priority(members[index][1], members[index][2]))
+        with ThreadPoolExecutor(max_workers=min(16, len(members) + 1)) as executor:
+            sdn_ready = submit(executor, wait_for_sdn_apply, proxmox, sdn_apply_upid)
+            futures = {}
+            for index in submission_order:
+                if index < len(clone_jobs):
+                    job = clone_jobs[index]
+                    futures[index] = submit(executor, journal.run, "clone:{}".format(job[3]), provision_clone, proxmox, *job[:6], new_vnet_name, sdn_ready,
+                                            target_node=job[6], source_storages=job[7], progress=journal.progress("clone:{}".format(job[3])),
+                                            boot_batch=boot_batch, baseline_snapshot=LAB_BASELINE_SNAPSHOT or None, tags=job[8], queue="lab_pipeline")
+                else:
+                    job = existing_jobs[index - len(clone_jobs)]
+                    futures[index] = submit(executor, journal.run, "add:{}".format(job[1]), provision_existing, proxmox, *job[:5], new_vnet_name, sdn_ready,
+                                            boot_batch=boot_batch, baseline_snapshot=LAB_BASELINE_SNAPSHOT or None, tags=job[5], queue="lab_pipeline")
+            for index, job in enumerate(clone_jobs):
+                try:
+                    cloned_vms.append(futures[index].result())
+                except Exception as job_error:
+                    errors.append("Clone of template {} to VM {} failed: {}".format(job[1], job[3], job_error))
+            for index, job in enumerate(existing_jobs, len(clone_jobs)):
+                try:
+                    added_vms.append(futures[index].result())
+                except Exception as job_error:
+                    errors.append("Adding VM {} failed: {}".format(job[1], job_error))
 
-        for node in nodes:
-            node_name = node['node']
-            for vm_summary in proxmox.nodes(node_name).qemu.get():
-                config = proxmox.nodes(node_name).qemu(vm_summary['vmid']).config.get()
-                tags = _parse_tags_from_description(config.get('description', ''))
-                
-                if request.lab_group in tags.get('lab_groups', []):
-                    # If it's a template, clone it
-                    if vm_summary.get('template') == 1:
-                        while next_vmid in existing_ids:
-                            next_vmid += 1
-                        
-                        template_id = vm_summary['vmid']
-                        new_clone_name = "{}-{}-{}".format(request.lab_group.lower(), vm_summary.get('name', 'vm'), next_vmid)
-                        clone_description = "Lab: {} clone | Instance: {}".format(request.lab_group, next_instance_num)
-                        
-                        proxmox.nodes(node_name).qemu(template_id).clone.post(newid=next_vmid, name=new_clone_name, full=0, description=clone_description)
-                        
-                        time.sleep(2)
-                        new_vm = proxmox.nodes(node_name).qemu(next_vmid)
-                        
-                        template_config = proxmox.nodes(node_name).qemu(template_id).config.get()
-                        net0_config = template_config.get('net0', '')
-                        if net0_config:
-                            model_and_mac = net0_config.split(',')[0]
-                            new_net_config_str = "{},bridge={}".format(model_and_mac, new_vnet_name)
-                            new_vm.config.put(net0=new_net_config_str)
-                        #START VM FOR NEW CLONED VM
-                        new_vm.status.start.post()
-                        cloned_vms.append({"name": new_clone_name, "id": next_vmid})
-                        next_vmid += 1
-                    # If it's a regular VM, "consume" it if not busy
-                    else:
-                        desc = config.get('description', '')
-                        if "Lab:" not in desc and "Instance:" not in desc:
-                            vm_id = vm_summary['vmid']
-                            vm_node = _find_vm_node_by_id(proxmox, vm_id)
-                            if vm_node:
-                                vm = proxmox.nodes(vm_node).qemu(vm_id)
-                                new_description = "{}\nLab: {} | Instance: {}".format(desc, request.lab_group, next_instance_num).strip()
-                                
-                                net0_config = config.get('net0', '')
-                                if net0_config:
-                                    model_and_mac = net0_config.split(',')[0]
-                                    new_net_config_str = "{},bridge={}".format(model_and_mac, new_vnet_name)
-                                    vm.config.put(description=new_description, net0=new_net_config_str)
-                                else:
-                                    vm.config.put(description=new_description)
-                                #FOR EXISTING VM
-                                vm.status.start.post()
-                                added_vms.append({"name": vm_summary.get('name'), "id": vm_id})
-                        else:
-                            failed_to_add_vms.append({"name": vm_summary.get('name'), "reason": "Already part of another lab"})
-
-
-        if not cloned_vms and not added_vms:
-            proxmox.cluster.sdn.vnets(new_vnet_name).delete()
-            proxmox.cluster.sdn.put()
-            logger.error(f"No available templates or VMs found in lab group '{request.lab_group}'. Deleting newly created Vnet {new_vnet_name}.")
-            raise HTTPException(status_code=404, detail="No available templates or VMs found in lab group '{}'.".format(request.lab_group))
+        if errors:
+            logger.error(f"Lab '{request.lab_group}' instance {next_instance_num} only partially provisioned. Cloned: {cloned_vms} Added: {added_vms} Errors: {errors}")
+            raise Exception("Lab instance {} partially provisioned. {}".format(next_instance_num, "; ".join(errors)))
+        journal.finish("completed")
+        cluster_resources.invalidate()
         logger.info(f"Lab '{request.lab_group}' instance {next_instance_num} instantiated successfully on VNET '{new_vnet_name}'.")
         return {
             "message": "Lab '{}' instance {} instantiated successfully on VNET '{}'.".format(request.lab_group, next_instance_num, new_vnet_name),
             "cloned_vms": cloned_vms,
             "added_vms": added_vms,
-            "failed_to_add_vms": failed_to_add_vms
+            "failed_to_add_vms": failed_to_add_vms,
+            "from_warm_pool": False,
+            "operation_id": journal.operation_id
         }
+    except CapacityError as e:
+        logger.warning(f"Lab '{request.lab_group}' rejected: {e}")
+        raise HTTPException(status_code=409, detail={"message": str(e), "plan": e.plan})
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"An error occurred: {save_error(e)}.")
+        if journal:
+            journal.finish("failed", str(e))
+            raise HTTPException(status_code=500, detail="An error occurred: {} Resume or roll back with operation {}.".format(e, journal.operation_id))
         raise HTTPException(status_code=500, detail="An error occurred: {}".format(e))
 
+@router.get("/labs/plan", tags=["Lab Builder"])
+def plan_lab(lab_group: str, instances: int = 1, placement_policy: Optional[str] = None, current_user: dict = Depends(get_current_active_user)):
+    logger.info(f"User '{current_user.username}' requested a capacity plan for {instances} instance(s) of '{lab_group}'.")
+    """
+    Dry run of the pre-flight check done by /labs/instantiate: the CPU, memory and disk of
+    `instances` new instances of the lab group, the node each clone would land on, the free
+    capacity left afterwards and, if it does not fit, why.
+    """
+    if placement_policy and placement_policy not in POLICIES:
+        raise HTTPException(status_code=400, detail="Unknown placement policy '{}'. Available: {}".format(placement_policy, ", ".join(sorted(POLICIES))))
+    proxmox = get_proxmox_connection()
+    try:
+        vm_resources = lab_tags.lab_vms(proxmox)
+        entries = [(entry['summary'], entry['config'], entry['record'])
+                   for entry in template_catalog.refresh(proxmox, vms=vm_resources).templates(lab_group)]
+        if not entries:
+            raise HTTPException(status_code=404, detail="No templates found in lab group '{}'.".format(lab_group))
+        sources_by_template = replicas.replica_sources(replicas.load_index(), vm_resources)
+        plan = plan_clones(cluster_resources.get(proxmox), entries * max(1, instances), sources_by_template, placement_policy,
+                           placer=cluster_placer(proxmox, placement_policy))
+        return {"lab_group": lab_group, "instances": max(1, instances), **plan}
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error planning lab '{lab_group}': {save_error(e)}.")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/labs/pool", tags=["Lab Builder"])
+def get_warm_pools(db: Session = Depends(get_db), current_user: dict = Depends(get_current_active_user)):
+    logger.info(f"User '{current_user.username}' requested the warm pool status.")
+    """Lists every lab group with its warm pool size and how many pre-cloned instances are ready."""
+    proxmox = get_proxmox_connection()
+    try:
+        all_vms, members = warm_pool.read_inventory(proxmox)
+        return warm_pool.pool_status(all_vms, members, db.query(models.WarmPool).all())
+    except Exception as e:
+        logger.error(f"Error reading the warm pool: {save_error(e)}.")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.put("/labs/pool/{lab_group}", tags=["Lab Builder"])
+def set_warm_pool(lab_group: str, request: WarmPoolRequest, db: Session = Depends(get_db), current_user: dict = Depends(get_current_admin_user)):
+    logger.info(f"Admin '{current_user.username}' set the warm pool of '{lab_group}' to {request.size}.")
+    """
+    Sets how many ready instances of `lab_group` to keep pre-cloned, and the zone and VLAN tag range
+    their VNETs are created with. A size of 0 stops refilling; already pooled instances stay claimable.
+    """
+    if request.size < 0 or request.vlan_tag_start > request.vlan_tag_end:
+        raise HTTPException(status_code=400, detail="Size must be >= 0 and the VLAN tag range must not be empty.")
+    pool = db.query(models.WarmPool).filter(models.WarmPool.lab_group == lab_group).first()
+    if not pool:
+        pool = models.WarmPool(lab_group=lab_group)
+        db.add(pool)
+    pool.size = request.size
+    pool.vlan_zone = request.vlan_zone
+    pool.vlan_tag_start = request.vlan_tag_start
+    pool.vlan_tag_end = request.vlan_tag_end
+    db.commit()
+    warm_pool.refiller.trigger()
+    return {"message": "Warm pool for '{}' set to {} instances.".format(lab_group, request.size)}
+
+@router.post("/templates/replicas", tags=["Lab Builder"])
+def replicate_templates(request: TemplateReplicationRequest, db: Session = Depends(get_db), current_user: dict = Depends(get_current_admin_user)):
+    logger.info(f"Admin '{current_user.username}' requested template replication to {[target.node for target in request.targets]}.")
+    """
+    Copies the templates of `lab_group` (or the given `template_ids`) to every target node/storage,
+    skipping copies that already exist. Lab instantiation then clones from the nearest copy.
+    """
+    if not request.lab_group and not request.template_ids:
+        raise HTTPException(status_code=400, detail="Give a lab_group or template_ids to replicate.")
+    proxmox = get_proxmox_connection()
+    try:
+        all_vms = lab_tags.lab_vms(proxmox, max_age=0)
+        templates = [vm for vm in all_vms if vm.get('template') == 1 and
+                     (vm['vmid'] in (request.template_ids or []) or (request.lab_group and request.lab_group in vm['lab'].get('lab_groups', [])))]
+        template_configs = map_concurrent(lambda vm: proxmox.nodes(vm['node']).qemu(vm['vmid']).config.get(), templates)
+        selected = [(template, config) for template, config in zip(templates, template_configs)
+                    if "TemplateReplica:" not in config.get('description', '')]
+        if not selected:
+            raise HTTPException(status_code=404, detail="No templates to replicate.")
+
+        index = replicas.load_index(db)
+        node_storages = {}
+        for node_name in {template['node'] for template, _ in selected}:
+            node_storages[node_name] = {storage['storage']: bool(storage.get('shared')) for storage in proxmox.nodes(node_name).storage.get()}
+        existing_ids = {vm['vmid'] for vm in all_vms}
+        next_vmid = 100
+        jobs = []
+        skipped = []
+        for template, config in selected:
+            for target in request.targets:
+                if target.node == template['node'] and target.storage in disk_storages(config):
+                    skipped.append({"template": template['vmid'], "node": target.node, "reason": "The template itself is there"})
+                    continue
+                if any(replica.node == target.node and replica.storage == target.storage for replica in index.get(template['vmid'], [])):
+                    skipped.append({"template": template['vmid'], "node": target.node, "reason": "Replica already exists"})
+                    continue
+                while next_vmid in existing_ids:
+                    next_vmid += 1
+                existing_ids.add(next_vmid)
+                jobs.append((template, config, target, next_vmid))
+
+        def replicate(template, config, target, new_vmid):
+            with clone_limiter.limit("node:{}".format(template['node']), "storage:{}".format(target.storage)):
+                return replicas.replicate_template(proxmox, template['node'], template['vmid'], config, template.get('name', 'template'),
+                                                   target.node, target.storage, new_vmid, node_storages[template['node']])
+
+        created = []
+        errors = []
+        with ThreadPoolExecutor(max_workers=min(16, len(jobs) or 1)) as executor:
+            futures = [submit(executor, replicate, *job, queue="template_replication") for job in jobs]
+            for (template, config, target, new_vmid), future in zip(jobs, futures):
+                try:
+                    future.result()
+                    replicas.record_replica(db, template['vmid'], new_vmid, target.node, target.storage, replicas.source_digest(config))
+                    created.append({"template": template['vmid'], "replica": new_vmid, "node": target.node, "storage": target.storage})
+                except Exception as job_error:
+                    errors.append("Replicating template {} to {}:{} failed: {}".format(template['vmid'], target.node, target.storage, job_error))
+        if errors:
+            logger.error(f"Template replication finished with errors: {errors}")
+        else:
+            logger.info(f"Template replication finished. Created: {created}")
+        return {"created": created, "skipped": skipped, "errors": errors}
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error replicating templates: {save_error(e)}.")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/templates/replicas", tags=["Lab Builder"])
+def list_template_replicas(db: Session = Depends(get_db), current_user: dict = Depends(get_current_active_user)):
+    logger.info(f"User '{current_user.username}' requested the template replica index.")
+    """Lists every replica with whether it still exists and whether its template changed since it was copied."""
+    proxmox = get_proxmox_connection()
+    try:
+        live = {(vm['vmid'], vm['node']): vm for vm in proxmox.cluster.resources.get(type='vm')}
+        template_nodes = {vmid: node for (vmid, node) in live}
+        index = replicas.load_index(db)
+        template_configs = {}
+        for template_vmid in index:
+            if template_vmid in template_nodes:
+                template_configs[template_vmid] = proxmox.nodes(template_nodes[template_vmid]).qemu(template_vmid).config.get()
+        result = []
+        for template_vmid, template_replicas in sorted(index.items()):
+            for replica in template_replicas:
+                result.append({
+                    "template": template_vmid,
+                    "replica": replica.replica_vmid,
+                    "node": replica.node,
+                    "storage": replica.storage,
+                    "created_at": replica.created_at,
+                    "exists": (replica.replica_vmid, replica.node) in live,
+                    "stale": template_vmid in template_configs and replicas.is_stale(replica, template_configs[template_vmid]),
+                })
+        return result
+    except Exception as e:
+        logger.error(f"Error listing template replicas: {save_error(e)}.")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.delete("/templates/replicas/{replica_vmid}", tags=["Lab Builder"])
+def delete_template_replica(replica_vmid: int, db: Session = Depends(get_db), current_user: dict = Depends(get_current_admin_user)):
+    logger.info(f"Admin '{current_user.username}' requested to delete template replica {replica_vmid}.")
+    replica = db.query(models.TemplateReplica).filter(models.TemplateReplica.replica_vmid == replica_vmid).first()
+    if not replica:
+        raise HTTPException(status_code=404, detail="Replica {} not found.".format(replica_vmid))
+    proxmox = get_proxmox_connection()
+    try:
+        node_name = _find_vm_node_by_id(proxmox, replica_vmid)
+        if node_name:
+            upid = proxmox.nodes(node_name).qemu(replica_vmid).delete()
+            if is_upid(upid):
+                wait_for_task(proxmox, node_name, upid)
+        db.delete(replica)
+        db.commit()
+        return {"message": "Replica {} deleted.".format(replica_vmid)}
+    except Exception as e:
+        logger.error(f"Error deleting template replica {replica_vmid}: {save_error(e)}.")
+        raise HTTPException(status_code=500, detail=str(e))
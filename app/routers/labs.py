@@ -5,13 +5,27 @@ from app.logging_helper import save_error
 from fastapi import APIRouter, HTTPException, Depends
 from pydantic import BaseModel
 from app.core.proxmox import get_proxmox_connection
-from .vms import _find_vm_node_by_id
-from app.routers.auth import get_current_active_user
+from .vms import _capacity_entries
+from app.core.planner import CapacityError, ensure_capacity
+from app.core.lab_pipeline import LAB_BASELINE_SNAPSHOT, bridge_net_config, net_bridge, start_vms, start_vms_in_background
+from app.core.bulk import run_bulk, summarize
+from app.core.tasks import is_upid, map_concurrent, wait_for_task
+from app.core.lab_index import lab_index
+from app.core.catalog import template_catalog
+from app.core import lab_spec
+from app.core import lab_tags
+from app.core import replicas
+from app.core.journal import Journal, describe, resume_instantiate, rollback_instantiate, run_delete
+from app import models
+from sqlalchemy.orm import Session
+from app.routers.auth import get_current_active_user, get_db
 from filelock import FileLock, Timeout
-from typing import List
+from app.core.metrics import timed_lock
+from app.core.tracing import TracedRoute
+from typing import List, Optional
 
 logger = logging.getLogger("proxmox_api")
-router = APIRouter()
+router = APIRouter(route_class=TracedRoute)
 creation_lock = FileLock("/tmp/lab_creation.lock")
 deletion_lock = FileLock("/tmp/lab_deletion.lock")
 
@@ -22,116 +36,144 @@ class VlanLabRequest(BaseModel):
 class LabMemberUpdateRequest(BaseModel):
     vm_ids: List[int]
 
-def _clear_lab_description(existing_desc: str) -> str:
-    """Removes any 'Lab: ...' line from a description."""
-    return re.sub(r"Lab: .*? \| Instance: \d+\n?", "", existing_desc).strip()
+class LabSpecRequest(BaseModel):
+    spec: str
+    dry_run: bool = False
+    placement_policy: Optional[str] = None
+
+class LabSnapshotRequest(BaseModel):
+    name: str
+
+class LabResetRequest(BaseModel):
+    snapshot: str = LAB_BASELINE_SNAPSHOT or "clean"
+    start: bool = True
+    wait: bool = False
+
+def _lab_members(proxmox, lab_group_name: str) -> list:
+    """The /cluster/resources entries of every member of a lab instance, found by their lab tags."""
+    return lab_tags.lab_members(proxmox, lab_group_name, max_age=0)
+
+def _lab_vnet(proxmox, members: list):
+    """The VNET of a lab instance: the bridge of a member's net0, clones first. Usually one config read."""
+    for vm_summary in sorted(members, key=lambda vm: vm['lab'].get('lab_role') != 'clone'):
+        vnet_name = net_bridge(proxmox.nodes(vm_summary['node']).qemu(vm_summary['vmid']).config.get())
+        if vnet_name:
+            return vnet_name
+    return None
+
+@router.get("/labs", tags=["Labs"])
+def list_labs(lab_group: Optional[str] = None, current_user: dict = Depends(get_current_active_user)):
+    logger.info(f"User '{current_user.username}' requested the list of labs.")
+    """
+    Every lab instance (of `lab_group`) with its VNET, member count, running and stopped
+    members, allocated resources and current usage, from the lab index (app/core/lab_index.py).
+    """
+    proxmox = get_proxmox_connection()
+    try:
+        lab_tags.ensure_migrated(proxmox)
+        return lab_index.labs(proxmox, lab_group=lab_group)
+    except Exception as e:
+        logger.error(f"Error listing labs: {save_error(e)}.")
+        raise HTTPException(status_code=500, detail=str(e))
 
 @router.put("/labs/{lab_group_name}/members", tags=["Labs"])
 def update_lab_members(lab_group_name: str, request: LabMemberUpdateRequest, current_user: dict = Depends(get_current_active_user)):
     logger.info(f"User '{current_user.username}' is requesting to edit Lab '{lab_group_name}'.")
     """
     Updates the list of VMs in a lab group.
-    Adds specified VMs and removes any not in the list.
+    Adds specified VMs and removes any not in the list, one config put per changed VM
+    (see lab_spec.membership_plan).
     """
     proxmox = get_proxmox_connection()
     try:
         # Extract lab name and instance number from the group name
-        match = re.match(r"(.*?)_cloned(\d+)", lab_group_name)
+        match = re.match(r"(.*?)_cloned(\d+)$", lab_group_name)
         if not match:
             logger.error(f"Invalid lab group name format.")
             raise HTTPException(status_code=400, detail="Invalid lab group name format.")
-        lab_name, instance_num = match.groups()
-        instance_num = int(instance_num)
-
-        # 1. Get all VMs to find the VNET
-        vnet_name = None
-        current_vms_in_group = []
-        all_vms = []
-        nodes = proxmox.nodes.get()
-        for node in nodes:
-            node_name = node['node']
-            for vm_summary in proxmox.nodes(node_name).qemu.get():
-                all_vms.append({**vm_summary, 'node': node_name})
-
-        for vm_summary in all_vms:
-            config = proxmox.nodes(vm_summary['node']).qemu(vm_summary['vmid']).config.get()
-            desc = config.get('description', '')
-            desc_match = re.search(r"Lab: (.*?) \| Instance: (\d+)", desc)
-            if desc_match:
-                lab_name_from_desc = desc_match.group(1).replace(' clone', '').replace(' added', '')
-                instance_num_from_desc = desc_match.group(2)
-                reconstructed_group_name = f"{lab_name_from_desc}_cloned{instance_num_from_desc}"
-                
-                if reconstructed_group_name == lab_group_name:
-                    current_vms_in_group.append(vm_summary['vmid'])
-                    if not vnet_name:
-                        net0 = config.get('net0', '')
-                        if 'bridge=' in net0:
-                            vnet_name = net0.split('bridge=')[1].split(',')[0]
-        
+        lab_name, instance_num = match.group(1), int(match.group(2))
+
+        # 1. Find the members from their lab tags, and the VNET from the lab index or a member's NIC
+        vms = lab_tags.lab_vms(proxmox, max_age=0)
+        members = [vm_summary for vm_summary in vms if lab_tags.instance_name(vm_summary['lab']) == lab_group_name]
+        vnet_name = lab_index.vnet(lab_name, instance_num) or _lab_vnet(proxmox, members)
         if not vnet_name:
              logger.error(f"Could not determine the VNET for lab group {lab_group_name}.")
              raise HTTPException(status_code=404, detail=f"Could not determine the VNET for lab group {lab_group_name}.")
 
-        # 2. Determine which VMs to add and remove
-        current_vm_set = set(current_vms_in_group)
-        requested_vm_set = set(request.vm_ids)
-        
-        vms_to_add = requested_vm_set - current_vm_set
-        vms_to_remove = current_vm_set - requested_vm_set
-        
-        # 3. Add new VMs to the group
-        for vmid in vms_to_add:
-            node_name = _find_vm_node_by_id(proxmox, vmid)
-            if node_name:
-                vm = proxmox.nodes(node_name).qemu(vmid)
-                current_config = vm.config.get()
-                current_desc = current_config.get('description', '')
-                
-                # Set description to 'added'
-                new_desc = f"{_clear_lab_description(current_desc)}\nLab: {lab_name} added | Instance: {instance_num}".strip()
-                logger.info(f"Added VM{vmid} to lab {lab_name}.")
-                # Reconfigure network
-                net0_config_str = current_config.get('net0', '')
-                new_net_config = ""
-                if net0_config_str:
-                    model_and_mac = net0_config_str.split(',')[0]
-                    new_net_config = f"{model_and_mac},bridge={vnet_name}"
-                    vm.config.put(description=new_desc, net0=new_net_config)
-                else:
-                    vm.config.put(description=new_desc)
-
-        # 4. Remove VMs from the group
-        for vmid in vms_to_remove:
-            node_name = _find_vm_node_by_id(proxmox, vmid)
-            if node_name:
-                vm = proxmox.nodes(node_name).qemu(vmid)
-                current_config = vm.config.get()
-                current_desc = vm.config.get().get('description', '')
-                new_desc = _clear_lab_description(current_desc)
-                logger.info(f"Removed VM{vmid} from lab {lab_name}.")
-                net0_config_str = current_config.get('net0', '')
-                if net0_config_str:
-                    model_and_mac = net0_config_str.split(',')[0]
-                    new_net_config = f"{model_and_mac},bridge=vmbr0"
-                    vm.config.put(description=new_desc, net0=new_net_config)
-                else:
-                    vm.config.put(description=new_desc)
+        # 2. Plan the adds and removes, reading each changed VM's config once, and run them concurrently
+        plan = lab_spec.membership_plan(proxmox, lab_name, instance_num, vnet_name, vms, request.vm_ids)
+        result = lab_spec.apply(proxmox, plan, [])
+        logger.info(f"Lab {lab_name}: added {[step['vmid'] for step in plan['steps'] if step['action'] == 'add']}, "
+                    f"removed {[step['vmid'] for step in plan['steps'] if step['action'] == 'release']}.")
+        if result['errors']:
+            raise Exception("; ".join(result['errors']))
         logger.info(f"Successfully updated members for lab {lab_group_name}.")
         return {"message": f"Successfully updated members for lab {lab_group_name}."}
 
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error updating lab members for {lab_group_name}: {save_error(e)}.")
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.post("/labs/reconcile", tags=["Labs"])
+def reconcile_lab(request: LabSpecRequest, current_user: dict = Depends(get_current_active_user)):
+    logger.info(f"User '{current_user.username}' requested to reconcile a lab spec (dry run: {request.dry_run}).")
+    """
+    Converges a lab instance to a YAML spec (app/core/lab_spec.py): creates its VNET if it has
+    none, clones missing template copies, deletes surplus clones, adds and releases VMs and moves
+    NICs, with one config put per changed VM. With `dry_run`, returns the plan and its estimated
+    upstream calls without changing anything.
+    """
+    proxmox = get_proxmox_connection()
+    try:
+        spec = lab_spec.load_spec(request.spec)
+        vms = lab_tags.lab_vms(proxmox, max_age=0)
+        templates = template_catalog.refresh(proxmox, vms=vms).templates()
+        plan = lab_spec.plan(proxmox, spec, vms, templates, lab_index.vnet(spec['lab_group'], spec['instance']))
+        if request.dry_run or plan['in_sync']:
+            return {**plan, "dry_run": request.dry_run}
+        with timed_lock(creation_lock, "lab_creation", timeout=300):
+            result = lab_spec.apply(proxmox, plan, templates, request.placement_policy)
+        if result['errors']:
+            logger.error(f"Lab {plan['lab']} only partially reconciled: {result['errors']}")
+            raise HTTPException(status_code=500, detail={"message": "Lab {} only partially reconciled.".format(plan['lab']), **result})
+        logger.info(f"Lab {plan['lab']} reconciled in {len(plan['steps'])} step(s).")
+        return {**plan, "dry_run": False, "result": result}
+    except lab_spec.SpecError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except CapacityError as e:
+        logger.warning(f"Lab spec rejected: {e}")
+        raise HTTPException(status_code=409, detail={"message": str(e), "plan": e.plan})
+    except Timeout:
+        raise HTTPException(status_code=503, detail="Another lab creation is already in progress. Please try again in a few moments.")
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error reconciling lab spec: {save_error(e)}.")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+def _attach_net0(proxmox, node_name: str, vmid: int, upid, net0: str):
+    # The clone API cannot set net0, so the bridge is switched once the clone task is done.
+    if is_upid(upid):
+        wait_for_task(proxmox, node_name, upid)
+    proxmox.nodes(node_name).qemu(vmid).config.put(net0=net0)
 
 @router.post("/labs/create_vlan_lab", tags=["Labs"])
 def create_vlan_lab(request: VlanLabRequest, current_user: dict = Depends(get_current_active_user)):
     logger.info(f"User '{current_user.username}' requested to create vlan lab.")
     try:
         # This will wait up to 5 minutes (300 seconds) for other lab creations to finish
-        with creation_lock.acquire(timeout=300):
+        with timed_lock(creation_lock, "lab_creation", timeout=300):
             proxmox = get_proxmox_connection()
+
+            # Every template gets a linked clone on its own node; check they fit before creating anything
+            replica_ids = replicas.replica_vmids()
+            templates = [{**vm, 'node': node['node']} for node in proxmox.nodes.get() for vm in proxmox.nodes(node['node']).qemu.get()
+                         if vm.get('template') == 1 and vm['vmid'] not in replica_ids]
+            ensure_capacity(proxmox, _capacity_entries(proxmox, templates), policy="local")
             
             # --- The rest of your lab creation logic goes here ---
             # It is now protected from race conditions
@@ -161,39 +203,45 @@ def create_vlan_lab(request: VlanLabRequest, current_user: dict = Depends(get_cu
             vmid_prefix = (highest_num + 1) * 1000
             next_vmid = vmid_prefix
             created_vms = []
+            clones = []
+            bridged = []
             clone_index = 1
             
             for node in nodes:
                 node_name = node['node']
                 for template_summary in proxmox.nodes(node_name).qemu.get():
-                    if template_summary.get('template') == 1:
+                    if template_summary.get('template') == 1 and template_summary['vmid'] not in replica_ids:
                         template_id = template_summary['vmid']
                         while next_vmid in existing_ids:
                             next_vmid += 1
+                        existing_ids.add(next_vmid)
                         new_clone_name = "{}-{}".format(template_summary.get('name', 'vm'), next_vmid)
                         clone_description = "Lab VNET: {}".format(new_vnet_name)
                         template_config = proxmox.nodes(node_name).qemu(template_id).config.get()
                         net0_config = template_config.get('net0', '')
-                        new_net_config = ""
-                        if net0_config:
-                            model_and_mac = net0_config.split(',')[0]
-                            new_net_config = "{},bridge={}".format(model_and_mac, new_vnet_name)
 
-                        proxmox.nodes(node_name).qemu(template_id).clone.post(
+                        upid = proxmox.nodes(node_name).qemu(template_id).clone.post(
                             newid=next_vmid, 
                             name=new_clone_name, 
                             full=0, 
-                            description=clone_description,
-                            net0=new_net_config
+                            description=clone_description
                         )
+                        clones.append((node_name, next_vmid, upid, template_summary.get('tags')))
+                        if net0_config:
+                            bridged.append((node_name, next_vmid, upid, bridge_net_config(net0_config, new_vnet_name)))
                         created_vms.append({"name": new_clone_name, "id": next_vmid})
                         clone_index += 1
+            map_concurrent(lambda clone: _attach_net0(proxmox, *clone), bridged)
+            lab_tags.strip_inherited(proxmox, clones)
             logger.info(f"Vlan Lab created successfully. Vnet: {new_vnet_name} Created VMs: {created_vms}")
             return {"message": "Vlan Lab created successfully.", "vnet": new_vnet_name, "created_vms": created_vms}
 
     except Timeout:
         logger.error(f"Another lab creation is already in progress. Please try again in a few moments.")
         raise HTTPException(status_code=503, detail="Another lab creation is already in progress. Please try again in a few moments.")
+    except CapacityError as e:
+        logger.warning(f"Vlan Lab rejected: {e}")
+        raise HTTPException(status_code=409, detail={"message": str(e), "plan": e.plan})
     except Exception as e:
         logger.error(f"Error creating Vlan Lab: {save_error(e)}.")
         raise HTTPException(status_code=500, detail="An error occurred: {}".format(e))
@@ -204,68 +252,31 @@ def delete_lab(lab_group_name: str, current_user: dict = Depends(get_current_act
     logger.info(f"User '{current_user.username}' requested to delete vlan lab.")
     """
     Deletes all VMs in a lab group, and then deletes the VNET they are connected to.
+    The deletion is journalled; if it fails part way, resume it through /labs/operations/{operation_id}/resume.
     """
     try:
         # This will wait up to 5 minutes for other lab deletions to finish
-        with deletion_lock.acquire(timeout=300):
+        with timed_lock(deletion_lock, "lab_deletion", timeout=300):
             proxmox = get_proxmox_connection()
-            deleted_vms = []
-            vnet_to_delete = None
-            
-            nodes = proxmox.nodes.get()
-            vms_to_delete = []
 
-            # First, loop through all VMs on all nodes to identify which ones to delete
-            for node in nodes:
-                node_name = node['node']
-                for vm_summary in proxmox.nodes(node_name).qemu.get():
-                    vmid = vm_summary.get('vmid')
-                    if not vmid: continue
-
-                    config = proxmox.nodes(node_name).qemu(vmid).config.get()
-                    desc = config.get('description', '')
-                    match = re.search(r"Lab: (.*?) \| Instance: (\d+)", desc)
-
-                    if match:
-                        lab_name = match.group(1).replace(' clone', '').replace(' added', '')
-                        instance_num = match.group(2)
-                        current_group_name = "{}_cloned{}".format(lab_name, instance_num)
-
-                        if current_group_name == lab_group_name:
-                            vm_summary['node'] = node_name
-                            vms_to_delete.append(vm_summary)
-                            
-                            if not vnet_to_delete:
-                                net0 = config.get('net0', '')
-                                if 'bridge=' in net0:
-                                    vnet_to_delete = net0.split('bridge=')[1].split(',')[0]
-            
-            # Now, delete the VMs we found
-            for vm_summary in vms_to_delete:
-                vmid = vm_summary['vmid']
-                node_name = vm_summary['node']
-                vm = proxmox.nodes(node_name).qemu(vmid)
-
-                if vm.status.current.get()['status'] == 'running':
-                    vm.status.stop.post()
-                    for _ in range(20):
-                        time.sleep(3)
-                        if vm.status.current.get()['status'] == 'stopped': break
-                    else:
-                        logger.error(f"Timed out waiting for VM {vmid} to stop.")
-                        raise Exception("Timed out waiting for VM {} to stop.".format(vmid))
-                
-                vm.delete()
-                deleted_vms.append(vm_summary.get('name'))
-                time.sleep(2)
+            # First, identify the VMs to delete from their lab tags, and the VNET from one of their NICs
+            vms_to_delete = _lab_members(proxmox, lab_group_name)
+            vnet_to_delete = _lab_vnet(proxmox, vms_to_delete)
             
-            # After all VMs are deleted, delete the VNET if we found one
+            # Journal the deletion before it starts, so a failure part way can be resumed
+            steps = [("delete:{}".format(vm_summary['vmid']), {"vmid": vm_summary['vmid'], "node": vm_summary['node'], "name": vm_summary.get('name')})
+                     for vm_summary in vms_to_delete]
             if vnet_to_delete:
-                proxmox.cluster.sdn.vnets(vnet_to_delete).delete()
-                time.sleep(2)
-                proxmox.cluster.sdn.put()
+                steps.append(("vnet", {"vnet": vnet_to_delete}))
+            journal = Journal.open("delete", lab_group_name, {"vnet": vnet_to_delete}, steps, current_user.username)
+            try:
+                result = run_delete(proxmox, journal)
+            except Exception as step_error:
+                raise Exception("{} Resume with operation {}.".format(step_error, journal.operation_id))
+            deleted_vms = result['deleted_vms']
             logger.info(f"Successfully deleted lab '{lab_group_name}' and VNET '{vnet_to_delete}'. Deleted VMs: {deleted_vms}")
-            return {"message": "Successfully deleted lab '{}' and VNET '{}'.".format(lab_group_name, vnet_to_delete), "deleted_vms": deleted_vms}
+            return {"message": "Successfully deleted lab '{}' and VNET '{}'.".format(lab_group_name, vnet_to_delete), "deleted_vms": deleted_vms,
+                    "operation_id": journal.operation_id}
 
     except Timeout:
         logger.error(f"Another lab deletion is already in progress. Please try again.")
@@ -275,35 +286,23 @@ def delete_lab(lab_group_name: str, current_user: dict = Depends(get_current_act
         raise HTTPException(status_code=500, detail="An error occurred during lab deletion: {}".format(e))
         
 @router.post("/labs/{lab_group_name}/start", tags=["Labs"])
-def start_lab(lab_group_name: str, current_user: dict = Depends(get_current_active_user)):
+def start_lab(lab_group_name: str, wait: bool = False, current_user: dict = Depends(get_current_active_user)):
     logger.info(f"User '{current_user.username}' requested to start vlan lab {lab_group_name}.")
     """
-    Starts all VMs that belong to a specific lab group instance.
+    Starts all VMs that belong to a specific lab group instance, through the boot scheduler:
+    routers and other low `startup: order` VMs first, staggered by node load. Without `wait`
+    the starts are queued in the background; with it, returns once the lab is up.
     """
     proxmox = get_proxmox_connection()
-    started_vms = []
     try:
-        nodes = proxmox.nodes.get()
-        for node in nodes:
-            node_name = node['node']
-            for vm_summary in proxmox.nodes(node_name).qemu.get():
-                vmid = vm_summary.get('vmid')
-                if not vmid: continue
-
-                config = proxmox.nodes(node_name).qemu(vmid).config.get()
-                desc = config.get('description', '')
-                match = re.search(r"Lab: (.*?) \| Instance: (\d+)", desc)
-
-                if match:
-                    lab_name = match.group(1).replace(' clone', '').replace(' added', '')
-                    instance_num = match.group(2)
-                    current_group_name = "{}_cloned{}".format(lab_name, instance_num)
-
-                    # If this VM is part of the lab we want to start
-                    if current_group_name == lab_group_name:
-                        if vm_summary.get('status') == 'stopped':
-                            proxmox.nodes(node_name).qemu(vmid).status.start.post()
-                            started_vms.append(vm_summary.get('name'))
+        # Only the stopped members' configs are read (for their startup order and disks)
+        vms = [vm_summary for vm_summary in _lab_members(proxmox, lab_group_name) if vm_summary.get('status') == 'stopped']
+        configs = map_concurrent(lambda vm: proxmox.nodes(vm['node']).qemu(vm['vmid']).config.get(), vms)
+        results = (start_vms if wait else start_vms_in_background)(proxmox, vms, configs)
+        started_vms = [result.get('name') for result in results if result['result'] in ('ok', 'queued')]
+        errors = ["{}: {}".format(result['vmid'], result['detail']) for result in results if result['result'] == 'error']
+        if errors:
+            raise Exception("Failed to start VMs {}".format("; ".join(errors)))
         logger.info(f"Start command sent to all VMs in lab '{lab_group_name}'. Started VMs: {started_vms}")
         return {"message": "Start command sent to all VMs in lab '{}'.".format(lab_group_name), "started_vms": started_vms}
     except Exception as e:
@@ -319,26 +318,10 @@ def stop_lab(lab_group_name: str, current_user: dict = Depends(get_current_activ
     proxmox = get_proxmox_connection()
     stopped_vms = []
     try:
-        nodes = proxmox.nodes.get()
-        for node in nodes:
-            node_name = node['node']
-            for vm_summary in proxmox.nodes(node_name).qemu.get():
-                vmid = vm_summary.get('vmid')
-                if not vmid: continue
-
-                config = proxmox.nodes(node_name).qemu(vmid).config.get()
-                desc = config.get('description', '')
-                match = re.search(r"Lab: (.*?) \| Instance: (\d+)", desc)
-
-                if match:
-                    lab_name = match.group(1).replace(' clone', '').replace(' added', '')
-                    instance_num = match.group(2)
-                    current_group_name = "{}_cloned{}".format(lab_name, instance_num)
-
-                    if current_group_name == lab_group_name:
-                        if vm_summary.get('status') == 'running':
-                            proxmox.nodes(node_name).qemu(vmid).status.stop.post()
-                            stopped_vms.append(vm_summary.get('name'))
+        for vm_summary in _lab_members(proxmox, lab_group_name):
+            if vm_summary.get('status') == 'running':
+                proxmox.nodes(vm_summary['node']).qemu(vm_summary['vmid']).status.stop.post()
+                stopped_vms.append(vm_summary.get('name'))
         logger.info(f"Stop command sent to all VMs in lab '{lab_group_name}'. Stopped VMs: {stopped_vms}")
         return {"message": "Stop command sent to all VMs in lab '{}'.".format(lab_group_name), "stopped_vms": stopped_vms}
     except Exception as e:
@@ -346,3 +329,172 @@ def stop_lab(lab_group_name: str, current_user: dict = Depends(get_current_activ
         raise HTTPException(status_code=500, detail="An error occurred while stopping the lab: {}".format(e))
 
 
+
+@router.get("/labs/operations", tags=["Labs"])
+def list_lab_operations(lab_group: Optional[str] = None, status: Optional[str] = None, limit: int = 50,
+                        db: Session = Depends(get_db), current_user: dict = Depends(get_current_active_user)):
+    logger.info(f"User '{current_user.username}' requested the lab operation journal.")
+    """
+    Lists journalled lab instantiations and deletions, newest first.
+    """
+    query = db.query(models.LabOperation)
+    if lab_group:
+        query = query.filter(models.LabOperation.lab_group == lab_group)
+    if status:
+        query = query.filter(models.LabOperation.status == status)
+    return [describe(operation) for operation in query.order_by(models.LabOperation.id.desc()).limit(limit).all()]
+
+@router.get("/labs/operations/{operation_id}", tags=["Labs"])
+def get_lab_operation(operation_id: int, db: Session = Depends(get_db), current_user: dict = Depends(get_current_active_user)):
+    logger.info(f"User '{current_user.username}' requested lab operation {operation_id}.")
+    """
+    Shows one journalled lab operation with every step, its status and the pipeline stage it reached.
+    """
+    operation = db.query(models.LabOperation).get(operation_id)
+    if not operation:
+        raise HTTPException(status_code=404, detail="Lab operation {} not found.".format(operation_id))
+    steps = db.query(models.LabOperationStep).filter_by(operation_id=operation_id).order_by(models.LabOperationStep.position).all()
+    return describe(operation, steps)
+
+def _claim_operation(db: Session, operation_id: int, force: bool) -> tuple:
+    operation = db.query(models.LabOperation).get(operation_id)
+    if not operation:
+        raise HTTPException(status_code=404, detail="Lab operation {} not found.".format(operation_id))
+    journal = Journal.claim(operation_id, force)
+    if not journal:
+        raise HTTPException(status_code=409, detail="Lab operation {} is {}; only failed operations (or running ones, with force) can be resumed or rolled back.".format(operation_id, operation.status))
+    return operation, journal
+
+@router.post("/labs/operations/{operation_id}/resume", tags=["Labs"])
+def resume_lab_operation(operation_id: int, force: bool = False, db: Session = Depends(get_db), current_user: dict = Depends(get_current_active_user)):
+    logger.info(f"User '{current_user.username}' requested to resume lab operation {operation_id}.")
+    """
+    Continues a failed lab operation from its last completed step: steps already done are skipped,
+    and a clone that got part way through its pipeline picks up at the next stage.
+    `force` takes over an operation still marked running, e.g. after its worker was restarted.
+    """
+    operation, journal = _claim_operation(db, operation_id, force)
+    try:
+        proxmox = get_proxmox_connection()
+        if operation.kind == "delete":
+            with timed_lock(deletion_lock, "lab_deletion", timeout=300):
+                result = run_delete(proxmox, journal)
+        else:
+            result = resume_instantiate(proxmox, journal)
+            if result['errors']:
+                raise Exception("; ".join(result['errors']))
+        logger.info(f"Lab operation {operation_id} ({operation.kind} of '{operation.lab_group}') resumed successfully.")
+        return {"message": "Lab operation {} resumed successfully.".format(operation_id), **result}
+    except Timeout:
+        journal.finish("failed", "Another lab deletion was in progress.")
+        logger.error(f"Another lab deletion is already in progress. Please try again.")
+        raise HTTPException(status_code=503, detail="Another lab deletion is already in progress. Please try again.")
+    except Exception as e:
+        logger.error(f"Failed to resume lab operation {operation_id}: {save_error(e)}")
+        raise HTTPException(status_code=500, detail="Failed to resume lab operation {}: {}".format(operation_id, e))
+
+@router.post("/labs/operations/{operation_id}/rollback", tags=["Labs"])
+def rollback_lab_operation(operation_id: int, force: bool = False, db: Session = Depends(get_db), current_user: dict = Depends(get_current_active_user)):
+    logger.info(f"User '{current_user.username}' requested to roll back lab operation {operation_id}.")
+    """
+    Undoes a failed lab instantiation: deletes the clones it created and its VNET, and restores the
+    description, NIC and power state of the VMs it added. Deletions cannot be rolled back, only resumed.
+    """
+    operation = db.query(models.LabOperation).get(operation_id)
+    if operation and operation.kind != "instantiate":
+        raise HTTPException(status_code=409, detail="Only lab instantiations can be rolled back; resume a {} instead.".format(operation.kind))
+    operation, journal = _claim_operation(db, operation_id, force)
+    try:
+        result = rollback_instantiate(get_proxmox_connection(), journal)
+        if result['errors']:
+            raise Exception("; ".join(result['errors']))
+        logger.info(f"Lab operation {operation_id} ('{operation.lab_group}') rolled back.")
+        return {"message": "Lab operation {} rolled back.".format(operation_id), **result}
+    except Exception as e:
+        logger.error(f"Failed to roll back lab operation {operation_id}: {save_error(e)}")
+        raise HTTPException(status_code=500, detail="Failed to roll back lab operation {}: {}".format(operation_id, e))
+
+@router.get("/labs/{lab_group_name}/snapshots", tags=["Labs"])
+def list_lab_snapshots(lab_group_name: str, current_user: dict = Depends(get_current_active_user)):
+    logger.info(f"User '{current_user.username}' requested the snapshots of lab {lab_group_name}.")
+    """
+    Lists the snapshots of a lab instance, with how many of its VMs have each one.
+    A snapshot the lab can be reset to is `complete` (every member has it).
+    """
+    proxmox = get_proxmox_connection()
+    try:
+        members = _lab_members(proxmox, lab_group_name)
+        if not members:
+            raise HTTPException(status_code=404, detail="Lab '{}' not found.".format(lab_group_name))
+        snapshot_lists = map_concurrent(lambda vm: proxmox.nodes(vm['node']).qemu(vm['vmid']).snapshot.get(), members)
+        snapshots = {}
+        for snapshot_list in snapshot_lists:
+            for snapshot in snapshot_list:
+                if snapshot.get('name') == 'current':
+                    continue
+                entry = snapshots.setdefault(snapshot['name'], {"name": snapshot['name'], "description": snapshot.get('description', ''), "snaptime": snapshot.get('snaptime'), "vms": 0})
+                entry["vms"] += 1
+        for entry in snapshots.values():
+            entry["complete"] = entry["vms"] == len(members)
+        return {"lab": lab_group_name, "members": len(members), "snapshots": sorted(snapshots.values(), key=lambda entry: entry.get('snaptime') or 0)}
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error listing the snapshots of lab {lab_group_name}: {save_error(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/labs/{lab_group_name}/snapshots", tags=["Labs"])
+def create_lab_snapshot(lab_group_name: str, request: LabSnapshotRequest, current_user: dict = Depends(get_current_active_user)):
+    logger.info(f"User '{current_user.username}' requested snapshot '{request.name}' of lab {lab_group_name}.")
+    """
+    Snapshots every VM of a lab instance concurrently (limited per node) and waits for the snapshot
+    tasks. Returns one result per VM; `complete` is false when any of them failed.
+    """
+    proxmox = get_proxmox_connection()
+    try:
+        members = _lab_members(proxmox, lab_group_name)
+        if not members:
+            raise HTTPException(status_code=404, detail="Lab '{}' not found.".format(lab_group_name))
+        results = run_bulk(proxmox, "snapshot", [vm['vmid'] for vm in members], request.name, wait=True, vms=members)
+        summary = summarize(results)
+        logger.info(f"Snapshot '{request.name}' of lab {lab_group_name}: {summary}")
+        return {"message": "Snapshot '{}' of lab '{}' created.".format(request.name, lab_group_name) if not summary['error'] else
+                "Snapshot '{}' of lab '{}' failed on {} VM(s).".format(request.name, lab_group_name, summary['error']),
+                "complete": summary['ok'] == len(members), "summary": summary, "results": results}
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error creating snapshot of lab {lab_group_name}: {save_error(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/labs/{lab_group_name}/reset", tags=["Labs"])
+def reset_lab(lab_group_name: str, request: LabResetRequest = LabResetRequest(), current_user: dict = Depends(get_current_active_user)):
+    logger.info(f"User '{current_user.username}' requested to reset lab {lab_group_name} to '{request.snapshot}'.")
+    """
+    Rolls every VM of a lab instance back to a snapshot (by default the baseline taken when the lab
+    was instantiated) concurrently, waiting for the rollback tasks, then starts the lab again
+    through the boot scheduler (queued in the background unless `wait`). This replaces a delete
+    and re-instantiation: no clone, VNET or SDN change is involved.
+    """
+    proxmox = get_proxmox_connection()
+    try:
+        members = _lab_members(proxmox, lab_group_name)
+        if not members:
+            raise HTTPException(status_code=404, detail="Lab '{}' not found.".format(lab_group_name))
+        results = run_bulk(proxmox, "rollback", [vm['vmid'] for vm in members], request.snapshot, wait=True, vms=members)
+        summary = summarize(results)
+        started = []
+        if request.start:
+            # A rollback to a snapshot without RAM state leaves the VM stopped.
+            rolled_back = [{**vm, 'status': 'stopped'} for vm, result in zip(members, results) if result['result'] == 'ok']
+            started = (start_vms if request.wait else start_vms_in_background)(proxmox, rolled_back)
+        if summary['error']:
+            logger.error(f"Reset of lab {lab_group_name} failed on {summary['error']} VM(s): {results}")
+            raise Exception("Rollback to '{}' failed: {}".format(request.snapshot, "; ".join("{}: {}".format(result['vmid'], result['detail']) for result in results if result['result'] == 'error')))
+        logger.info(f"Lab {lab_group_name} reset to snapshot '{request.snapshot}'.")
+        return {"message": "Lab '{}' reset to snapshot '{}'.".format(lab_group_name, request.snapshot), "results": results, "started": started}
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error resetting lab {lab_group_name}: {save_error(e)}")
+        raise HTTPException(status_code=500, detail="Error resetting lab {}: {}".format(lab_group_name, e))
@@ -4,30 +4,32 @@ import logging
 from fastapi import APIRouter, HTTPException, Depends
 from pydantic import BaseModel
 from app.core.proxmox import get_proxmox_connection
+from app.core.tasks import map_concurrent
+from app.core.inventory import cluster_resources
 from app.routers.auth import get_current_active_user
+from app.core.tracing import TracedRoute
 
 logger = logging.getLogger("proxmox_api")
-router = APIRouter()
+router = APIRouter(route_class=TracedRoute)
 
 class NetworkCreateRequest(BaseModel):
     node: str
     iface: str
     comments: str = None
 
+def _bridges_by_node(proxmox) -> dict:
+    """node -> its network bridges; the nodes come from the inventory cache and are read concurrently."""
+    node_names = sorted(node['node'] for node in cluster_resources.nodes(proxmox))
+    networks = map_concurrent(lambda node_name: [net for net in proxmox.nodes(node_name).network.get() if net.get('type') == 'bridge'], node_names)
+    return dict(zip(node_names, networks))
+
 @router.get("/networks", tags=["Networks"])
 def list_networks(current_user: dict = Depends(get_current_active_user)):
     logger.info(f"User '{current_user.username}' requested to list all networks bridge.")
     proxmox = get_proxmox_connection()
-    all_networks = {}
     try:
         logger.info(f"Retrieving all network bridges.......")
-        for node in proxmox.nodes.get():
-            node_name = node['node']
-            all_networks[node_name] = [
-                net for net in proxmox.nodes(node_name).network.get()
-                if net.get('type') == 'bridge'
-            ]
-        return all_networks
+        return _bridges_by_node(proxmox)
     except Exception as e:
         logger.error(f"Error retrieving all network bridges: {save_error(e)}.")
         raise HTTPException(status_code=500, detail=str(e))
@@ -6,9 +6,10 @@ from pydantic import BaseModel
 from app.core.proxmox import get_proxmox_connection
 from typing import Optional
 from app.routers.auth import get_current_active_user
+from app.core.tracing import TracedRoute
 
 logger = logging.getLogger("proxmox_api")
-router = APIRouter()
+router = APIRouter(route_class=TracedRoute)
 
 class SdnZoneRequest(BaseModel):
     zone: str
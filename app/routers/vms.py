@@ -2,16 +2,28 @@ import re
 import sys
 import time
 import logging
-from typing import List
+from typing import List, Optional
 from app.logging_helper import save_error
 from fastapi import APIRouter, HTTPException, Depends # <-- Add Depends
 from pydantic import BaseModel
 from app.core.proxmox import get_proxmox_connection
 from app.routers.auth import get_current_active_user # <-- Import the security function
 from filelock import FileLock, Timeout
+from app.core.metrics import timed_lock
+from app.core.tasks import map_concurrent
+from app.core.planner import CapacityError, ensure_capacity
+from app.core.inventory import cluster_resources, vm_node_index
+from app.core.bulk import ACTIONS, SNAPSHOT_ACTIONS, run_bulk, summarize
+from app.core import lab_tags
+from app.core import replicas
+from app.core.catalog import template_catalog
+from app.core.vm_index import vm_index
+from app.core.vm_records import parse_config
+from app.core.responses import EncodedJSONResponse, encode_array, encode_object
+from app.core.tracing import TracedRoute
 
 logger = logging.getLogger("proxmox_api")
-router = APIRouter()
+router = APIRouter(route_class=TracedRoute)
 clone_lock = FileLock("/tmp/clone_templates.lock")
 delete_clones_lock = FileLock("/tmp/delete_clones.lock")
 
@@ -31,37 +43,21 @@ class SnapshotRequest(BaseModel):
 
 class LabCreateRequest(BaseModel):
     lab_name: str
-# Helper functions (_find_vm_node_by_id, _format_vm_details) are unchanged
+
+class BulkVmRequest(BaseModel):
+    action: str  # start, stop, shutdown, delete, snapshot or rollback
+    vmids: List[int]
+    snapshot: Optional[str] = None  # snapshot name, for snapshot and rollback
+    wait: bool = False
 def _find_vm_node_by_id(proxmox_conn, vmid):
-    try:
-        all_resources = proxmox_conn.cluster.resources.get(type='vm')
-        for resource in all_resources:
-            if resource.get('vmid') == vmid:
-                return resource.get('node')
-    except Exception:
-        for node in proxmox_conn.nodes.get():
-            for vm in proxmox_conn.nodes(node['node']).qemu.get():
-                if vm['vmid'] == vmid:
-                    return node['node']
-    return None
-
-def _format_vm_details(vm_config):
-    details = { "description": vm_config.get("description", ""), "template": vm_config.get("template", 0), "cpu": { "cores": vm_config.get("cores"), "sockets": vm_config.get("sockets"), "type": vm_config.get("cpu") }, "memory_mb": vm_config.get("memory"), "boot_order": vm_config.get("boot"), "disks": [], "network_interfaces": [] }
-    for key, value in vm_config.items():
-        if key.startswith(('scsi', 'sata', 'ide', 'virtio')):
-            disk_match = re.match(r"(.+?):(.+?),size=(\d+G?)", str(value));
-            if disk_match: details["disks"].append({ "device": key, "storage": disk_match.group(1), "file": disk_match.group(2), "size_gb": int(disk_match.group(3).replace('G', '')) })
-        if key.startswith('net'):
-            parts = str(value).split(','); nic_details = { "device": key };
-            for part in parts:
-                if '=' in part:
-                    k, v = part.split('=', 1)
-                    if k in ['virtio', 'e1000', 'rtl8139', 'vmxnet3']: nic_details['model'] = k; nic_details['mac_address'] = v
-                    else: nic_details[k] = v
-            details["network_interfaces"].append(nic_details)
-    return details
-    
-    
+    # Served from the worker's vmid -> node index; the cluster is only listed on a miss.
+    return vm_node_index.lookup(proxmox_conn, vmid)
+
+def _capacity_entries(proxmox_conn, template_summaries):
+    """(summary, config, VmRecord) per template, as the capacity planner takes them. Summaries need a 'node'."""
+    configs = map_concurrent(lambda vm: proxmox_conn.nodes(vm['node']).qemu(vm['vmid']).config.get(), template_summaries)
+    return [(summary, config, parse_config(config)) for summary, config in zip(template_summaries, configs)]
+
 def _build_description_with_tags(existing_desc: str, lab_groups: List[str]) -> str:
     new_desc = re.sub(r"LabGroups:\[.*?\]\n?", "", existing_desc).strip()
     if lab_groups:
@@ -70,23 +66,42 @@ def _build_description_with_tags(existing_desc: str, lab_groups: List[str]) -> s
     return new_desc
     
     
+def _vm_rows(proxmox, lab_group=None, lab=None, **filters) -> list:
+    """(listing entry, VmRecord) of the VMs matching `filters` (see vm_index.query)."""
+    if lab_group or lab:
+        lab_tags.ensure_migrated(proxmox)
+    vms = vm_index.query(proxmox, lab_group=lab_group, lab=lab, **filters)
+    return list(zip(vms, vm_index.records(proxmox, vms)))
+
+def _encode_vm_rows(rows: list) -> bytes:
+    """The /vms document of `rows` as JSON; the hardware details of cached records are not encoded again."""
+    return encode_array(encode_object({ 'proxmox_id': vm_summary['vmid'], 'name': vm_summary.get('name'), 'status': vm_summary.get('status'), 'node': vm_summary['node'] },
+                                      { 'hardware_details': record.to_json() }) for vm_summary, record in rows)
+
+def _vm_list(proxmox, **filters) -> bytes:
+    return _encode_vm_rows(_vm_rows(proxmox, **filters))
+
 @router.get("/vms", tags=["Virtual Machines"])
-def list_vms(current_user: dict = Depends(get_current_active_user)): # <-- Security added here
+def list_vms(name_prefix: Optional[str] = None, name_contains: Optional[str] = None, status: Optional[str] = None, node: Optional[str] = None,
+             template: Optional[bool] = None, lab_group: Optional[str] = None, lab: Optional[str] = None, bridge: Optional[str] = None,
+             current_user: dict = Depends(get_current_active_user)): # <-- Security added here
     logger.info(f"User '{current_user.username}' requested to list all VMs.")
-    proxmox = get_proxmox_connection(); all_vms_list = []
+    """
+    Lists the VMs matching every given filter (all VMs without filters): name prefix or
+    substring, status, node, template flag, lab group, lab instance ("<group>_cloned<n>") and
+    bridge/VNET of any NIC. Filters are answered from the VM search index (app/core/vm_index.py);
+    configs are only read for the VMs returned, and only when not cached.
+    """
+    proxmox = get_proxmox_connection()
     try:
-        for node in proxmox.nodes.get():
-            node_name = node['node']
-            for vm_summary in proxmox.nodes(node_name).qemu.get():
-                vmid = vm_summary.get('vmid');
-                if not vmid: continue
-                vm_config = proxmox.nodes(node_name).qemu(vmid).config.get(); formatted_details = _format_vm_details(vm_config);
-                full_details = { 'proxmox_id': vmid, 'name': vm_summary.get('name'), 'status': vm_summary.get('status'), 'node': node_name, 'hardware_details': formatted_details }; all_vms_list.append(full_details)
+        rows = _vm_rows(proxmox, name_prefix=name_prefix, name_contains=name_contains, status=status, node=node, template=template,
+                        lab_group=lab_group, lab=lab, bridge=bridge)
+        body = _encode_vm_rows(rows)
     except Exception as e: 
     	logger.error(f"Error listing VMs: {save_error(e)}")
     	raise HTTPException(status_code=500, detail=str(e))
-    logger.info(f"Successfully retrieved {len(all_vms_list)} VMs.")
-    return all_vms_list
+    logger.info(f"Successfully retrieved {len(rows)} VMs.")
+    return EncodedJSONResponse(body)
 
 @router.put("/vms/{vmid}/rename", tags=["Virtual Machines"])
 def rename_vm(vmid: int, request: VmRenameRequest, current_user: dict = Depends(get_current_active_user)):
@@ -101,6 +116,7 @@ def rename_vm(vmid: int, request: VmRenameRequest, current_user: dict = Depends(
         logger.info(f"Successfully renamed VM {vmid} to {request.new_name}")
         return {"message": "Successfully renamed VM {} to {}".format(vmid, request.new_name)}
     except Exception as e:   
+        vm_node_index.invalidate(vmid)
         logger.error(f"Failed to rename VMs: {save_error(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -123,69 +139,97 @@ def delete_vm(vmid: int, current_user: dict = Depends(get_current_active_user)):
                 logger.error(f"Timed out waiting for VM to stop.", exc_info=True)
                 raise Exception("Timed out waiting for VM to stop.")
         vm.delete()
+        vm_node_index.forget(vmid)
         logger.info(f"Successfully deleted VM {vmid}.")
         return {"message": "Successfully deleted VM {}".format(vmid)}
     except Exception as e:
+        vm_node_index.invalidate(vmid)
         logger.error(f"Failed to delete VMs: {save_error(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.post("/vms/start_all", tags=["Virtual Machines"])
-def start_all_vms(current_user: dict = Depends(get_current_active_user)):
+def start_all_vms(wait: bool = False, current_user: dict = Depends(get_current_active_user)):
     logger.info(f"User '{current_user.username}' requested to start all VMs.")
+    """
+    Starts every stopped VM through the boot scheduler (staggered by node load and startup order).
+    Without `wait` the starts are queued in the background; with it, returns once every VM is up.
+    """
     proxmox = get_proxmox_connection()
-    started_vms = []
     try:
-        for node in proxmox.nodes.get():
-            node_name = node['node']
-            for vm in proxmox.nodes(node_name).qemu.get():
-                if vm.get('template') != 1 and vm.get('status') == 'stopped':
-                    proxmox.nodes(node_name).qemu(vm['vmid']).status.start.post()
-                    started_vms.append(vm.get('name'))
+        vms = cluster_resources.vms(proxmox, max_age=0)
+        targets = [vm for vm in vms if vm.get('template') != 1 and vm.get('status') == 'stopped']
+        results = run_bulk(proxmox, "start", [vm['vmid'] for vm in targets], wait=wait, vms=vms)
+        started_vms = [result.get('name') for result in results if result['result'] in ('ok', 'queued')]
         logger.info(f"Successfully started all VMs. VMs started:{started_vms}")
-        return {"message": "Start command sent to all stopped VMs.", "started": started_vms}
+        return {"message": "Start command sent to all stopped VMs.", "started": started_vms, "results": results}
     except Exception as e:
         logger.error(f"Failed to start all VMs: {save_error(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.post("/vms/stop_all", tags=["Virtual Machines"])
-def stop_all_vms(current_user: dict = Depends(get_current_active_user)):
+def stop_all_vms(wait: bool = False, current_user: dict = Depends(get_current_active_user)):
     logger.info(f"User '{current_user.username}' requested to stop all VMs.")
+    """Stops every running VM, concurrently per node. With `wait`, returns once the stop tasks have finished."""
     proxmox = get_proxmox_connection()
-    stopped_vms = []
     try:
-        for node in proxmox.nodes.get():
-            node_name = node['node']
-            for vm in proxmox.nodes(node_name).qemu.get():
-                if vm.get('template') != 1 and vm.get('status') == 'running':
-                    proxmox.nodes(node_name).qemu(vm['vmid']).status.stop.post()
-                    stopped_vms.append(vm.get('name'))
+        vms = cluster_resources.vms(proxmox, max_age=0)
+        targets = [vm for vm in vms if vm.get('template') != 1 and vm.get('status') == 'running']
+        results = run_bulk(proxmox, "stop", [vm['vmid'] for vm in targets], wait=wait, vms=vms)
+        stopped_vms = [result.get('name') for result in results if result['result'] == 'ok']
         logger.info(f"Successfully stopped all runnign VMs. VMs stopped: {stopped_vms}")
-        return {"message": "Stop command sent to all running VMs.", "stopped": stopped_vms}
+        return {"message": "Stop command sent to all running VMs.", "stopped": stopped_vms, "results": results}
     except Exception as e:
         logger.error(f"Failed to stop all VMs: {save_error(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.post("/vms/bulk", tags=["Virtual Machines"])
+def bulk_vm_action(request: BulkVmRequest, current_user: dict = Depends(get_current_active_user)):
+    logger.info(f"User '{current_user.username}' requested bulk {request.action} of {len(request.vmids)} VMs.")
+    """
+    Runs one action (start, stop, shutdown, delete, snapshot, rollback) on a list of VMs.
+    Nodes are resolved from a single /cluster/resources call and the actions run concurrently,
+    limited per node. With `wait`, each result reflects the finished task. Returns one result per
+    VM (ok, skipped, error or not_found) instead of failing the whole request.
+    """
+    if request.action not in ACTIONS:
+        raise HTTPException(status_code=400, detail="Unknown action '{}'. Available: {}".format(request.action, ", ".join(ACTIONS)))
+    if request.action in SNAPSHOT_ACTIONS and not request.snapshot:
+        raise HTTPException(status_code=400, detail="A snapshot name is required for {}.".format(request.action))
+    proxmox = get_proxmox_connection()
+    try:
+        results = run_bulk(proxmox, request.action, list(dict.fromkeys(request.vmids)), request.snapshot, request.wait)
+        summary = summarize(results)
+        logger.info(f"Bulk {request.action} finished: {summary}")
+        return {"action": request.action, "summary": summary, "results": results}
+    except Exception as e:
+        logger.error(f"Bulk {request.action} failed: {save_error(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 @router.post("/clone_templates", tags=["Virtual Machines"])
 def clone_all_templates(current_user: dict = Depends(get_current_active_user)):
     logger.info(f"User '{current_user.username}' requested to clone all VM templates.")
     try:
-        with clone_lock.acquire(timeout=300):
+        with timed_lock(clone_lock, "clone_templates", timeout=300):
             proxmox = get_proxmox_connection()
             all_vms_and_templates = [];
             for node in proxmox.nodes.get(): all_vms_and_templates.extend(proxmox.nodes(node['node']).qemu.get())
             existing_ids = {vm['vmid'] for vm in all_vms_and_templates}
             max_id = max([id for id in existing_ids if id >= 1000] or [999]); next_vmid = max_id + 1
             cloned_vms = []
+            clones = []
+            replica_ids = replicas.replica_vmids()
             for node in proxmox.nodes.get():
                 node_name = node['node']
                 for template_summary in proxmox.nodes(node_name).qemu.get():
-                    if template_summary.get('template') == 1:
+                    if template_summary.get('template') == 1 and template_summary['vmid'] not in replica_ids:
                         template_id = template_summary['vmid']
                         new_clone_name = "{}-clone-{}".format(template_summary.get('name', 'template'), next_vmid)
                         clone_description = "Cloned from template: {}".format(template_summary.get('name', 'unknown'))
-                        proxmox.nodes(node_name).qemu(template_id).clone.post(newid=next_vmid, name=new_clone_name, full=0, description=clone_description)
+                        upid = proxmox.nodes(node_name).qemu(template_id).clone.post(newid=next_vmid, name=new_clone_name, full=0, description=clone_description)
+                        clones.append((node_name, next_vmid, upid, template_summary.get('tags')))
                         cloned_vms.append({"template": template_summary.get('name'), "new_id": next_vmid, "new_name": new_clone_name})
                         next_vmid += 1
+            lab_tags.strip_inherited(proxmox, clones)
             if not cloned_vms: 
             	logger.info(f"No templates found to clone.")
             	return {"message": "No templates found to clone."}
@@ -202,7 +246,7 @@ def clone_all_templates(current_user: dict = Depends(get_current_active_user)):
 def delete_all_clones(current_user: dict = Depends(get_current_active_user)):
     logger.info(f"User '{current_user.username}' requested to delete all cloned VM templates.")
     try:
-        with delete_clones_lock.acquire(timeout=300):
+        with timed_lock(delete_clones_lock, "delete_clones", timeout=300):
             proxmox = get_proxmox_connection()
             deleted_vms = []
             errors = []
@@ -254,6 +298,7 @@ def list_snapshots(vmid: int, current_user: dict = Depends(get_current_active_us
         logger.info(f"Succesfully retrieved snapshot for VM {vmid}")
         return snapshots
     except Exception as e:
+        vm_node_index.invalidate(vmid)
         logger.error(f"Error retrieving snapshot for VM {vmid}: {save_error(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -273,6 +318,7 @@ def create_snapshot(vmid: int, request: SnapshotRequest, current_user: dict = De
         logger.info(f"Successfully created snapshot '{request.name}' for VM {vmid}")
         return {"message": "Successfully created snapshot '{}' for VM {}".format(request.name, vmid), "task_id": result}
     except Exception as e:
+        vm_node_index.invalidate(vmid)
         logger.error(f"Error creating snapshot for VM {vmid}: {save_error(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -289,9 +335,11 @@ def rollback_snapshot(vmid: int, snapname: str, current_user: dict = Depends(get
         
         # Proxmox API call to roll back to a snapshot
         result = proxmox.nodes(node_name).qemu(vmid).snapshot(snapname).rollback.post()
+        vm_index.forget(vmid)
         logger.info(f"Successfully initiated rollback to snapshot '{snapname}' for VM {vmid}, Task ID: {result}")
         return {"message": "Successfully initiated rollback to snapshot '{}' for VM {}".format(snapname, vmid), "task_id": result}
     except Exception as e:
+        vm_node_index.invalidate(vmid)
         logger.error(f"Error rolling back snapshot: {save_error(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -319,16 +367,18 @@ def reconfigure_network(vmid: int, request: VmNetworkRequest, current_user: dict
         update_data = {request.iface: new_config}
 
         vm.config.put(**update_data)
+        vm_index.forget(vmid)
         logger.info(f"Successfully moved VM {vmid} to bridge {request.bridge}.")
         return {"message": "Successfully moved {} on VM {} to bridge {}".format(request.iface, vmid, request.bridge)}
     except Exception as e:
+        vm_node_index.invalidate(vmid)
         logger.error(f"Error with reconfig network on VM {vmid} to bridge {request.bridge}: {save_error(e)}.")
         raise HTTPException(status_code=500, detail=str(e))
 
 # The full, correct create_lab function
 @router.post("/labs/create", tags=["Labs"])
 def create_lab(request: LabCreateRequest, current_user: dict = Depends(get_current_active_user)):
-    logger.info(f"User '{current_user.username}' requested to create lab (not the lab_builder) for VM {vmid}")
+    logger.info(f"User '{current_user.username}' requested to create lab (not the lab_builder).")
     proxmox = get_proxmox_connection()
     try:
         lab_name_clean = re.sub(r'[^a-zA-Z0-9]', '', request.lab_name).lower()
@@ -340,6 +390,12 @@ def create_lab(request: LabCreateRequest, current_user: dict = Depends(get_curre
         if not nodes:
             logger.error(f"No Proxmox nodes found.", exc_info=True)
             raise HTTPException(status_code=500, detail="No Proxmox nodes found.")
+
+        # 0. Every template gets a linked clone on its own node; check they fit before creating anything
+        replica_ids = replicas.replica_vmids()
+        templates = [{**vm, 'node': node['node']} for node in nodes for vm in proxmox.nodes(node['node']).qemu.get()
+                     if vm.get('template') == 1 and vm['vmid'] not in replica_ids]
+        ensure_capacity(proxmox, _capacity_entries(proxmox, templates), policy="local")
         
         # 1. Determine a valid, new bridge name
         existing_bridges = set()
@@ -376,7 +432,7 @@ def create_lab(request: LabCreateRequest, current_user: dict = Depends(get_curre
         for node in nodes:
             node_name = node['node']
             for template_summary in proxmox.nodes(node_name).qemu.get():
-                if template_summary.get('template') == 1:
+                if template_summary.get('template') == 1 and template_summary['vmid'] not in replica_ids:
                     template_id = template_summary['vmid']
                     
                     new_clone_name = "{}-{}-{}".format(lab_name_clean, template_summary.get('name', 'vm'), next_vmid)
@@ -389,18 +445,25 @@ def create_lab(request: LabCreateRequest, current_user: dict = Depends(get_curre
                     new_vm = proxmox.nodes(node_name).qemu(next_vmid)
                     new_vm_config = new_vm.config.get()
                     
-                    # 6. Reconfigure the network for net0
+                    # 6. Reconfigure the network for net0, and drop the lab group tags copied from the template
+                    updates = {}
                     net0_config = new_vm_config.get('net0', '')
                     if net0_config:
                         model_and_mac = net0_config.split(',')[0]
-                        new_net0_config = "{},bridge={}".format(model_and_mac, bridge_name)
-                        new_vm.config.put(net0=new_net0_config)
+                        updates['net0'] = "{},bridge={}".format(model_and_mac, bridge_name)
+                    if lab_tags.parse(new_vm_config.get('tags')).get('lab_groups'):
+                        updates.update(lab_tags.tag_update(lab_tags.with_lab_groups(new_vm_config.get('tags'), [])))
+                    if updates:
+                        new_vm.config.put(**updates)
 
                     created_vms.append({"name": new_clone_name, "id": next_vmid})
                     next_vmid += 1
                 
         logger.info(f"Lab '{request.lab_name}' created successfully on network '{bridge_name}'. VMs created: {created_vms}")
         return {"message": "Lab '{}' created successfully on network '{}'.".format(request.lab_name, bridge_name), "created_vms": created_vms}
+    except CapacityError as e:
+        logger.warning(f"Lab '{request.lab_name}' rejected: {e}")
+        raise HTTPException(status_code=409, detail={"message": str(e), "plan": e.plan})
     except Exception as e:
         logger.error(f"Error when creating lab (not the lab_builder): {save_error(e)}.")
         raise HTTPException(status_code=500, detail="An error occurred: {}".format(e))
@@ -417,9 +480,13 @@ def tag_vm(vmid: int, request: TemplateTagRequest, current_user: dict = Depends(
         current_config = proxmox.nodes(node_name).qemu(vmid).config.get()
         existing_desc = current_config.get('description', '')
         new_description = _build_description_with_tags(existing_desc, request.lab_groups)
-        proxmox.nodes(node_name).qemu(vmid).config.put(description=new_description)
+        new_tags = lab_tags.with_lab_groups(current_config.get('tags', ''), request.lab_groups)
+        proxmox.nodes(node_name).qemu(vmid).config.put(description=new_description, **lab_tags.tag_update(new_tags))
+        cluster_resources.invalidate()
+        template_catalog.record(vmid, {**current_config, "description": new_description}, new_tags)
         logger.info(f"VM tags updated successfully.")
         return {"message": "VM tags updated successfully."}
     except Exception as e:
+        vm_node_index.invalidate(vmid)
         logger.error(f"Error tagging VM: {save_error(e)}.")
         raise HTTPException(status_code=500, detail=str(e))
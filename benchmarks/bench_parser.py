@@ -0,0 +1,129 @@
+"""
+Benchmark of the VM config parser (app/core/vm_records.py) against the loop it replaced.
+
+On the configs of a synthetic cluster this reports parse throughput (configs per second) for
+the previous _format_vm_details loop, for parse_config() alone and for parse_config() followed
+by to_dict(), the memory held per VM by the raw configs, the nested-dict details and the
+__slots__ records, and the time to encode the GET /vms document: FastAPI's jsonable_encoder plus
+json.dumps (as before) against rows spliced from the records' cached JSON (app/core/responses.py).
+
+    python -m benchmarks.bench_parser                   # 2000 VMs, best of 10
+    python -m benchmarks.bench_parser --vms 10000 --repeat 3
+"""
+import re
+import sys
+import json
+import time
+import argparse
+import tracemalloc
+from benchmarks.common import setup_environment, build_cluster
+
+setup_environment()
+
+from fastapi.encoders import jsonable_encoder
+from app.core.vm_records import parse_config
+from app.core.responses import encode_array, encode_object
+
+def legacy_format_vm_details(vm_config):
+    """The parser before app/core/vm_records.py, kept as the reference point."""
+    details = { "description": vm_config.get("description", ""), "template": vm_config.get("template", 0), "cpu": { "cores": vm_config.get("cores"), "sockets": vm_config.get("sockets"), "type": vm_config.get("cpu") }, "memory_mb": vm_config.get("memory"), "boot_order": vm_config.get("boot"), "disks": [], "network_interfaces": [] }
+    for key, value in vm_config.items():
+        if key.startswith(('scsi', 'sata', 'ide', 'virtio')):
+            disk_match = re.match(r"(.+?):(.+?),size=(\d+G?)", str(value))
+            if disk_match: details["disks"].append({ "device": key, "storage": disk_match.group(1), "file": disk_match.group(2), "size_gb": int(disk_match.group(3).replace('G', '')) })
+        if key.startswith('net'):
+            parts = str(value).split(','); nic_details = { "device": key }
+            for part in parts:
+                if '=' in part:
+                    k, v = part.split('=', 1)
+                    if k in ['virtio', 'e1000', 'rtl8139', 'vmxnet3']: nic_details['model'] = k; nic_details['mac_address'] = v
+                    else: nic_details[k] = v
+            details["network_interfaces"].append(nic_details)
+    return details
+
+# "records" is what the template catalog and the capacity planner run, "records+to_dict" what response bodies need
+PARSERS = {
+    "legacy": legacy_format_vm_details,
+    "records": parse_config,
+    "records+to_dict": lambda config: parse_config(config).to_dict(),
+}
+
+def throughput(parsers: dict, configs: list, repeat: int) -> dict:
+    """Configs per second of every parser, best of `repeat` rounds; the parsers alternate within a round so machine noise hits them alike."""
+    best = {}
+    for _ in range(repeat):
+        for name, parse in parsers.items():
+            start = time.process_time()
+            for config in configs:
+                parse(config)
+            elapsed = time.process_time() - start
+            best[name] = min(best.get(name, elapsed), elapsed)
+    return {name: len(configs) / max(elapsed, 1e-9) for name, elapsed in best.items()}
+
+def encode_rate(encode, repeat: int) -> float:
+    """/vms documents encoded per second."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        encode()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return 1 / best
+
+def retained_bytes(build) -> int:
+    """Bytes still allocated by `build()` once it returns (its result is kept alive meanwhile)."""
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = build()
+    retained = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del result
+    return retained
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--vms", type=int, default=2000)
+    parser.add_argument("--nodes", type=int, default=3)
+    parser.add_argument("--repeat", type=int, default=10, help="timing rounds (best is kept)")
+    args = parser.parse_args(argv)
+
+    cluster = build_cluster(args.nodes, args.vms)
+    configs = [dict(vm["config"]) for vm in cluster.vms.values()]
+    mismatches = sum(legacy_format_vm_details(config) != parse_config(config).to_dict() for config in configs)
+    print("{} configs from a synthetic cluster ({} nodes), {} output mismatches".format(len(configs), args.nodes, mismatches))
+
+    print("\nThroughput")
+    rates = throughput(PARSERS, configs, args.repeat)
+    for name, rate in rates.items():
+        print("  {:<18} {:>10.0f} configs/s  {:>5.2f}x".format(name, rate, rate / rates["legacy"]))
+
+    print("\nMemory held per VM")
+    sizes = {
+        "raw config": retained_bytes(lambda: [dict(config) for config in configs]),
+        "details dicts": retained_bytes(lambda: [legacy_format_vm_details(config) for config in configs]),
+        "records": retained_bytes(lambda: [parse_config(config) for config in configs]),
+    }
+    for name, size in sizes.items():
+        print("  {:<18} {:>8.0f} bytes".format(name, size / len(configs)))
+
+    print("\nEncoding the /vms document")
+    summaries = [{"vmid": vmid, "name": vm["config"].get("name"), "status": vm["status"], "node": vm["node"]} for vmid, vm in cluster.vms.items()]
+    rows = [{"proxmox_id": summary["vmid"], "name": summary["name"], "status": summary["status"], "node": summary["node"],
+             "hardware_details": legacy_format_vm_details(config)} for summary, config in zip(summaries, configs)]
+    records = [parse_config(config) for config in configs]
+    for record in records:
+        record.to_json()
+    encoders = {
+        "jsonable+json": lambda: json.dumps(jsonable_encoder(rows), ensure_ascii=False, separators=(",", ":")).encode(),
+        "cached records": lambda: encode_array(encode_object({"proxmox_id": summary["vmid"], "name": summary["name"], "status": summary["status"], "node": summary["node"]},
+                                                             {"hardware_details": record.to_json()}) for summary, record in zip(summaries, records)),
+    }
+    if json.loads(encoders["jsonable+json"]()) != json.loads(encoders["cached records"]()):
+        mismatches += 1
+    rates = {name: encode_rate(encode, args.repeat) for name, encode in encoders.items()}
+    for name, rate in rates.items():
+        print("  {:<18} {:>10.1f} documents/s  {:>5.2f}x".format(name, rate, rate / rates["jsonable+json"]))
+    return 1 if mismatches else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,158 @@
+"""
+Micro-benchmarks for the router hot paths, run against the simulated Proxmox cluster.
+
+For every handler and synthetic cluster size this reports wall time, the number of
+upstream Proxmox API calls and the peak Python memory allocated by the handler.
+Results can be saved as a baseline and later runs are compared against it.
+
+    python -m benchmarks.bench_routers                       # full grid, compare with baseline
+    python -m benchmarks.bench_routers --save-baseline       # record a new baseline
+    python -m benchmarks.bench_routers --nodes 3 --vms 500 --handlers list_vms,start_lab
+
+The exit status is 1 when a regression is flagged, so the suite can gate CI.
+"""
+import sys
+import json
+import time
+import argparse
+import tracemalloc
+from benchmarks.common import setup_environment, create_tables, build_cluster, BenchUser, ROOT
+
+setup_environment()
+create_tables()
+
+from fastapi import HTTPException
+from app.core import simulator
+from app.core import lab_tags
+from app.core.inventory import cluster_resources
+from app.core.proxmox import get_proxmox_connection
+from app.routers import vms, labs, lab_builder
+
+DEFAULT_BASELINE = "{}/benchmarks/baseline.json".format(ROOT)
+USER = BenchUser()
+
+def _lab_members(cluster, instance: int):
+    return sorted(vmid for vmid in cluster.vms if vmid // 1000 == instance and vmid < 500000)
+
+def _plain_vm(cluster):
+    return min(vmid for vmid in cluster.vms if vmid >= 500000)
+
+# Each entry returns a zero-argument callable that runs the handler once against `cluster`.
+HANDLERS = {
+    "list_vms": lambda cluster: lambda: vms.list_vms(current_user=USER),
+    "instantiate_lab": lambda cluster: lambda: lab_builder.instantiate_lab(
+        lab_builder.LabInstantiateRequest(lab_group="WebLab", vlan_zone="labzone", vlan_tag=4000), current_user=USER),
+    "delete_lab": lambda cluster: lambda: labs.delete_lab("WebLab_cloned1", current_user=USER),
+    "start_lab": lambda cluster: lambda: labs.start_lab("WebLab_cloned1", current_user=USER),
+    "update_lab_members": lambda cluster: lambda: labs.update_lab_members(
+        "WebLab_cloned1", labs.LabMemberUpdateRequest(vm_ids=_lab_members(cluster, 1)[:-1] + [_plain_vm(cluster)]), current_user=USER),
+    "clone_all_templates": lambda cluster: lambda: vms.clone_all_templates(current_user=USER),
+}
+
+def run_once(handler: str, nodes: int, vm_count: int, task_scale: float, measure_memory: bool) -> dict:
+    cluster = build_cluster(nodes, vm_count, task_scale=task_scale)
+    simulator.set_cluster(cluster)
+    # Per-worker caches must not carry over from the previous cluster
+    cluster_resources.invalidate()
+    call = HANDLERS[handler](cluster)
+    # The one-time description -> tag migration is not part of any handler's cost.
+    lab_tags.ensure_migrated(get_proxmox_connection())
+    calls_before = cluster.calls
+    error = None
+    if measure_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        call()
+    except HTTPException as e:
+        error = "{}: {}".format(e.status_code, e.detail)
+    wall = time.perf_counter() - start
+    peak = 0
+    if measure_memory:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return {"wall_s": round(wall, 4), "calls": cluster.calls - calls_before, "peak_kb": round(peak / 1024, 1), "error": error}
+
+def run_suite(handlers, node_counts, vm_counts, task_scale: float, repeat: int, measure_memory: bool):
+    results = []
+    for vm_count in vm_counts:
+        for nodes in node_counts:
+            for handler in handlers:
+                runs = [run_once(handler, nodes, vm_count, task_scale, measure_memory=False) for _ in range(repeat)]
+                best = min(runs, key=lambda run: run["wall_s"])
+                if measure_memory:
+                    best["peak_kb"] = run_once(handler, nodes, vm_count, task_scale, measure_memory=True)["peak_kb"]
+                result = {"handler": handler, "nodes": nodes, "vms": vm_count, **best}
+                results.append(result)
+                print("{handler:<22} nodes={nodes:<2} vms={vms:<5} wall={wall_s:>8.3f}s calls={calls:>6} peak={peak_kb:>9.1f}KiB{err}".format(
+                    err="  ERROR " + result["error"] if result["error"] else "", **result), flush=True)
+    return results
+
+def compare(results, baseline, tolerance: float, min_delta: float):
+    """Returns a list of human-readable regressions against the baseline results."""
+    previous = {(entry["handler"], entry["nodes"], entry["vms"]): entry for entry in baseline.get("results", [])}
+    regressions = []
+    for result in results:
+        old = previous.get((result["handler"], result["nodes"], result["vms"]))
+        if not old:
+            continue
+        label = "{handler} nodes={nodes} vms={vms}".format(**result)
+        if result["calls"] > old["calls"]:
+            regressions.append("{}: upstream calls {} -> {}".format(label, old["calls"], result["calls"]))
+        if result["wall_s"] > old["wall_s"] * (1 + tolerance) and result["wall_s"] - old["wall_s"] > min_delta:
+            regressions.append("{}: wall time {:.3f}s -> {:.3f}s".format(label, old["wall_s"], result["wall_s"]))
+        if old.get("peak_kb") and result["peak_kb"] > old["peak_kb"] * (1 + tolerance) and result["peak_kb"] - old["peak_kb"] > 256:
+            regressions.append("{}: peak memory {:.0f}KiB -> {:.0f}KiB".format(label, old["peak_kb"], result["peak_kb"]))
+        if result["error"] and not old.get("error"):
+            regressions.append("{}: now fails with {}".format(label, result["error"]))
+    return regressions
+
+def _csv(value, cast=str):
+    return [cast(part) for part in value.split(",") if part]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--handlers", type=_csv, default=list(HANDLERS), help="comma-separated subset of: " + ", ".join(HANDLERS))
+    parser.add_argument("--nodes", type=lambda v: _csv(v, int), default=[1, 3, 8])
+    parser.add_argument("--vms", type=lambda v: _csv(v, int), default=[50, 500, 2000])
+    parser.add_argument("--task-scale", type=float, default=0.1, help="multiplier on simulated task durations")
+    parser.add_argument("--repeat", type=int, default=1, help="timing runs per case (best is kept)")
+    parser.add_argument("--no-memory", action="store_true", help="skip the tracemalloc run")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--output", help="also write this run's results to a JSON file")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative slowdown before flagging")
+    parser.add_argument("--min-delta", type=float, default=0.05, help="ignore wall-time regressions smaller than this (seconds)")
+    args = parser.parse_args(argv)
+
+    unknown = set(args.handlers) - set(HANDLERS)
+    if unknown:
+        parser.error("unknown handlers: {}".format(", ".join(sorted(unknown))))
+
+    results = run_suite(args.handlers, args.nodes, args.vms, args.task_scale, args.repeat, not args.no_memory)
+    document = {"created": time.strftime("%Y-%m-%dT%H:%M:%S"), "task_scale": args.task_scale, "results": results}
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(document, f, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(document, f, indent=2)
+        print("Baseline saved to {}".format(args.baseline))
+        return 0
+    try:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    except FileNotFoundError:
+        print("No baseline at {} (run with --save-baseline to create one).".format(args.baseline))
+        return 0
+    regressions = compare(results, baseline, args.tolerance, args.min_delta)
+    if regressions:
+        print("\nRegressions against baseline from {}:".format(baseline.get("created", "?")))
+        for line in regressions:
+            print("  - " + line)
+        return 1
+    print("\nNo regressions against baseline from {}.".format(baseline.get("created", "?")))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,49 @@
+"""Shared setup for the benchmark scripts: environment, simulated clusters and a stand-in user."""
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def setup_environment(log_level: str = "WARNING"):
+    """Must run before anything from `app` is imported: the app reads these at import time."""
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+    os.environ.setdefault("SECRET_KEY", "benchmark")
+    os.environ.setdefault("PROXMOX_SIMULATOR", "1")
+    os.environ["LOG_LEVEL"] = log_level
+
+def create_tables():
+    """The routers read settings from the database (warm pools, template replicas); app.main normally creates the tables."""
+    from app import models
+    from app.database import engine
+    models.Base.metadata.create_all(bind=engine)
+
+class BenchUser:
+    """What the routers read from `get_current_active_user`."""
+    username = "benchmark"
+    is_admin = True
+    disabled = False
+
+# Simulator settings used by the benchmarks: a fast LAN to the cluster and tasks
+# that finish in a fraction of their real duration, so suites finish in minutes
+# while still rewarding handlers that overlap their waits.
+BENCH_LATENCY = {"*": 0.002, "GET /cluster/resources": 0.02, "GET /nodes/{node}/qemu": 0.01}
+
+def build_cluster(nodes: int, vms: int, task_scale: float = 0.1, lab_instances: int = None, seed: int = 42):
+    """
+    Synthetic cluster with templates for two lab groups and, unless given, roughly one
+    lab instance per 100 VMs. Instances alternate WebLab (odd) / ADLab (even).
+
+    Nodes are sized to the VMs they run so that instantiate_lab passes the capacity check at
+    every size: the running VMs (4 vCPUs and 4 GiB on average) take about half of each node's
+    memory and of its vCPUs under the planner's default 4x overcommit.
+    """
+    from app.core.simulator import SimulatedCluster, DEFAULT_TASK_DURATIONS
+    running_ratio = 0.5
+    running_per_node = -(-int(vms * running_ratio) // nodes)
+    return SimulatedCluster.synthetic(
+        nodes=nodes, vms=vms, templates=6, lab_groups=("WebLab", "ADLab"),
+        lab_instances=lab_instances or max(2, vms // 100), running_ratio=running_ratio, seed=seed, latency=BENCH_LATENCY,
+        maxcpu=max(32, running_per_node * 2), maxmem_gb=max(256, running_per_node * 8),
+        task_durations={task_type: seconds * task_scale for task_type, seconds in DEFAULT_TASK_DURATIONS.items()},
+    )
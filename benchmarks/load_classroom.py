@@ -0,0 +1,230 @@
+"""
+Load generator reproducing the start of a class.
+
+Every simulated student logs in (POST /token), opens the lab playground (GET /vms),
+starts their lab, keeps polling GET /vms, and stops the lab at the end; a fraction
+of them also instantiate a fresh lab. Students arrive spread over a ramp-up window.
+
+By default the script starts everything it needs: an HTTP Proxmox simulator shared
+by all workers, and the full FastAPI app under gunicorn in a scratch directory (its
+own SQLite database and app.log). Point `--target` at a running backend to skip that.
+It runs one stage per student count and reports p50/p95/p99 latency, error rate and
+throughput per endpoint, plus the stage where throughput stopped scaling.
+
+    python -m benchmarks.load_classroom --students 40,80,120,200 --workers 4
+    python -m benchmarks.load_classroom --target http://127.0.0.1:8000 --students 40
+"""
+import os
+import sys
+import json
+import time
+import random
+import socket
+import argparse
+import tempfile
+import threading
+import subprocess
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from benchmarks.common import setup_environment, build_cluster, ROOT
+
+setup_environment()
+
+import requests
+from app.core import simulator
+
+PASSWORD = "Classroom-2024!"
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def percentile(values, fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(fraction * (len(ordered) - 1)))))
+    return ordered[index]
+
+class Recorder:
+    """Collects (endpoint, latency, ok) samples from all student threads."""
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.lock = threading.Lock()
+
+    def record(self, endpoint: str, seconds: float, ok: bool):
+        with self.lock:
+            self.samples[endpoint].append(seconds)
+            if not ok:
+                self.errors[endpoint] += 1
+
+    def summary(self, duration: float) -> dict:
+        report = {}
+        for endpoint, values in sorted(self.samples.items()):
+            report[endpoint] = {
+                "requests": len(values),
+                "errors": self.errors[endpoint],
+                "error_rate": round(self.errors[endpoint] / len(values), 4),
+                "throughput_rps": round(len(values) / duration, 2),
+                "p50_ms": round(percentile(values, 0.50) * 1000, 1),
+                "p95_ms": round(percentile(values, 0.95) * 1000, 1),
+                "p99_ms": round(percentile(values, 0.99) * 1000, 1),
+            }
+        return report
+
+class Student:
+    def __init__(self, index: int, base_url: str, recorder: Recorder, lab_instances: int):
+        self.index = index
+        self.username = "student{:03d}".format(index)
+        self.base_url = base_url
+        self.recorder = recorder
+        self.lab = "WebLab_cloned{}".format(index % lab_instances * 2 + 1)
+        self.session = requests.Session()
+
+    def call(self, endpoint: str, method: str, path: str, **kwargs):
+        start = time.perf_counter()
+        ok = False
+        try:
+            response = self.session.request(method, self.base_url + path, timeout=300, **kwargs)
+            ok = response.status_code < 400
+            return response
+        except requests.RequestException:
+            return None
+        finally:
+            self.recorder.record(endpoint, time.perf_counter() - start, ok)
+
+    def register(self):
+        self.session.post(self.base_url + "/users/", json={"username": self.username, "password": PASSWORD}, timeout=120)
+
+    def run(self, poll_interval: float, polls: int, instantiate: bool):
+        response = self.call("POST /token", "POST", "/token", data={"username": self.username, "password": PASSWORD})
+        if response is None or response.status_code != 200:
+            return
+        self.session.headers["Authorization"] = "Bearer " + response.json()["access_token"]
+        self.call("GET /vms", "GET", "/vms")
+        self.call("POST /labs/{lab}/start", "POST", "/labs/{}/start".format(self.lab))
+        if instantiate:
+            self.call("POST /labs/instantiate", "POST", "/labs/instantiate",
+                      json={"lab_group": "WebLab", "vlan_zone": "labzone", "vlan_tag": 2000 + self.index})
+        for _ in range(polls):
+            time.sleep(poll_interval * random.uniform(0.8, 1.2))
+            self.call("GET /vms", "GET", "/vms")
+        self.call("POST /labs/{lab}/stop", "POST", "/labs/{}/stop".format(self.lab))
+
+def start_backend(simulator_url: str, workers: int, log_level: str):
+    """Starts gunicorn on a free port in a scratch directory; returns (process, base_url)."""
+    port = _free_port()
+    workdir = tempfile.mkdtemp(prefix="load_classroom_")
+    env = {**os.environ, "PYTHONPATH": ROOT, "PROXMOX_SIMULATOR": simulator_url, "LOG_LEVEL": log_level}
+    env.pop("PROMETHEUS_MULTIPROC_DIR", None)
+    process = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-w", str(workers), "-k", "uvicorn.workers.UvicornWorker",
+         "-b", "127.0.0.1:{}".format(port), "--timeout", "600", "app.main:app"],
+        cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    base_url = "http://127.0.0.1:{}".format(port)
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        try:
+            requests.get(base_url + "/", timeout=1)
+            return process, base_url
+        except requests.RequestException:
+            time.sleep(0.25)
+    process.terminate()
+    raise RuntimeError("gunicorn did not come up on {}".format(base_url))
+
+def run_stage(base_url: str, students: int, args) -> dict:
+    recorder = Recorder()
+    crowd = [Student(index, base_url, recorder, args.lab_instances) for index in range(students)]
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        list(pool.map(lambda student: student.register(), crowd))
+    instantiating = set(random.Random(students).sample(range(students), int(students * args.instantiate_ratio)))
+    start = time.perf_counter()
+    threads = []
+    for student in crowd:
+        thread = threading.Thread(target=student.run, args=(args.poll_interval, args.polls, student.index in instantiating), daemon=True)
+        threads.append(thread)
+    for thread in threads:
+        thread.start()
+        time.sleep(args.ramp / max(1, students))
+    for thread in threads:
+        thread.join()
+    duration = time.perf_counter() - start
+    endpoints = recorder.summary(duration)
+    total = sum(entry["requests"] for entry in endpoints.values())
+    errors = sum(entry["errors"] for entry in endpoints.values())
+    all_latencies = [value for values in recorder.samples.values() for value in values]
+    return {
+        "students": students, "duration_s": round(duration, 2), "requests": total,
+        "throughput_rps": round(total / duration, 2), "error_rate": round(errors / total, 4) if total else 0.0,
+        "p95_ms": round(percentile(all_latencies, 0.95) * 1000, 1), "endpoints": endpoints,
+    }
+
+def find_saturation(stages, slo_ms: float, min_gain: float = 0.1):
+    """First stage whose throughput grew by less than `min_gain` over the previous one, or whose p95 broke the SLO."""
+    for previous, stage in zip(stages, stages[1:]):
+        if stage["p95_ms"] > slo_ms or stage["throughput_rps"] < previous["throughput_rps"] * (1 + min_gain):
+            return stage["students"]
+    return None
+
+def print_stage(stage: dict):
+    print("\n=== {students} students: {requests} requests in {duration_s}s, {throughput_rps} req/s, "
+          "error rate {error_rate:.2%}, p95 {p95_ms}ms".format(**stage))
+    print("  {:<26} {:>8} {:>8} {:>9} {:>9} {:>9} {:>9}".format("endpoint", "reqs", "err%", "req/s", "p50 ms", "p95 ms", "p99 ms"))
+    for endpoint, entry in stage["endpoints"].items():
+        print("  {:<26} {:>8} {:>8.2%} {:>9} {:>9} {:>9} {:>9}".format(
+            endpoint, entry["requests"], entry["error_rate"], entry["throughput_rps"], entry["p50_ms"], entry["p95_ms"], entry["p99_ms"]))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--students", type=lambda v: [int(part) for part in v.split(",")], default=[40, 80, 120, 200],
+                        help="comma-separated student counts, one stage each")
+    parser.add_argument("--target", help="base URL of an already running backend (skips gunicorn and the simulator)")
+    parser.add_argument("--workers", type=int, default=4, help="gunicorn workers")
+    parser.add_argument("--nodes", type=int, default=3)
+    parser.add_argument("--vms", type=int, default=500)
+    parser.add_argument("--lab-instances", type=int, default=20, help="existing lab instances students are spread over")
+    parser.add_argument("--ramp", type=float, default=30.0, help="seconds over which students arrive")
+    parser.add_argument("--polls", type=int, default=5, help="GET /vms polls per student after starting the lab")
+    parser.add_argument("--poll-interval", type=float, default=5.0)
+    parser.add_argument("--instantiate-ratio", type=float, default=0.1, help="fraction of students who instantiate a new lab")
+    parser.add_argument("--task-scale", type=float, default=0.1, help="multiplier on simulated task durations")
+    parser.add_argument("--slo-ms", type=float, default=2000.0, help="p95 above which a stage counts as saturated")
+    parser.add_argument("--log-level", default="INFO", help="backend LOG_LEVEL")
+    parser.add_argument("--output", help="write the full report to this JSON file")
+    args = parser.parse_args(argv)
+
+    server = process = None
+    base_url = args.target
+    try:
+        if not base_url:
+            # Students only use the WebLab instances, which are every other instance.
+            cluster = build_cluster(args.nodes, args.vms, task_scale=args.task_scale, lab_instances=args.lab_instances * 2)
+            server = simulator.serve(cluster, port=_free_port())
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            simulator_url = "http://127.0.0.1:{}".format(server.server_address[1])
+            process, base_url = start_backend(simulator_url, args.workers, args.log_level)
+            print("Backend {} ({} workers) on simulator {} with {} VMs".format(base_url, args.workers, simulator_url, len(cluster.vms)))
+        stages = []
+        for students in args.students:
+            stage = run_stage(base_url, students, args)
+            stages.append(stage)
+            print_stage(stage)
+        saturation = find_saturation(stages, args.slo_ms)
+        print("\nThroughput by stage: " + ", ".join("{students}: {throughput_rps} req/s".format(**stage) for stage in stages))
+        print("Saturation point: " + ("{} students".format(saturation) if saturation else "not reached"))
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump({"stages": stages, "saturation_students": saturation, "settings": vars(args)}, f, indent=2)
+    finally:
+        if process:
+            process.terminate()
+            process.wait(timeout=30)
+        if server:
+            server.shutdown()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,8 @@
+#!/bin/sh
+set -e
+# Metric files of the previous container run would otherwise be summed into /metrics
+if [ -n "$PROMETHEUS_MULTIPROC_DIR" ]; then
+    rm -rf "$PROMETHEUS_MULTIPROC_DIR"
+    mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
+fi
+exec "$@"
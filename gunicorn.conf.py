@@ -0,0 +1,17 @@
+"""
+Gunicorn settings for the backend container (see Dockerfile.backend).
+
+With PROMETHEUS_MULTIPROC_DIR set, every worker writes its metrics to files in that directory.
+A worker that exits must be marked dead, or its live gauges (such as the job queue depth) keep
+being summed into /metrics.
+"""
+import os
+from prometheus_client import multiprocess
+
+bind = "0.0.0.0:8000"
+workers = int(os.getenv("WEB_CONCURRENCY", "4"))
+worker_class = "uvicorn.workers.UvicornWorker"
+
+def child_exit(server, worker):
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        multiprocess.mark_process_dead(worker.pid)
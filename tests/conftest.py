@@ -0,0 +1,50 @@
+"""
+Test setup: the API runs against the in-process Proxmox simulator (app/core/simulator.py) and
+a throwaway SQLite database, with authentication replaced by an admin user.
+"""
+import os
+import tempfile
+
+# Before any app import: the database URL is relative to the working directory and the
+# Proxmox connection reads PROXMOX_SIMULATOR when it is imported.
+os.chdir(tempfile.mkdtemp(prefix="proxmox-api-tests-"))
+os.environ.setdefault("PROXMOX_SIMULATOR", "1")
+os.environ.setdefault("SECRET_KEY", "test-secret")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+import pytest
+from fastapi.testclient import TestClient
+from app.core import simulator
+from app.core.inventory import cluster_resources
+from app.database import Base, engine
+
+class AdminUser:
+    username = "tests"
+    is_admin = True
+    disabled = False
+
+@pytest.fixture
+def cluster():
+    """A small simulated cluster with instant tasks and no API latency."""
+    cluster = simulator.SimulatedCluster.synthetic(nodes=2, vms=12, templates=4, time_scale=0)
+    simulator.set_cluster(cluster)
+    cluster_resources.invalidate()
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    return cluster
+
+@pytest.fixture
+def client(cluster):
+    import app.main as main
+    from app.routers.auth import get_current_active_user, get_current_admin_user
+    main.app.dependency_overrides[get_current_active_user] = AdminUser
+    main.app.dependency_overrides[get_current_admin_user] = AdminUser
+    with TestClient(main.app) as client:
+        yield client
+    main.app.dependency_overrides.clear()
+
+@pytest.fixture
+def no_sleep(monkeypatch):
+    """Skips the fixed waits some handlers make between Proxmox calls."""
+    import time
+    monkeypatch.setattr(time, "sleep", lambda seconds: None)
@@ -0,0 +1,49 @@
+from app.core import journal as journal_module
+from app.core.journal import Journal, resume_instantiate, rollback_instantiate
+from app.core.proxmox import get_proxmox_connection
+
+def _running_vm(cluster) -> int:
+    vmid = min(vmid for vmid, vm in cluster.vms.items() if not vm["config"].get("template") and vmid >= 500000)
+    cluster.vms[vmid]["status"] = "running"
+    return vmid
+
+def _instantiation(cluster, vmid: int) -> Journal:
+    """An instantiation that created its VNET and stopped before its clone and its added VM."""
+    vm = cluster.vms[vmid]
+    journal = Journal.open("instantiate", "WebLab_cloned9", {"vnet": "vnet9", "vlan_zone": "labzone", "vlan_tag": 909}, [
+        ("vnet", {}),
+        ("clone:9000", {"source_node": "pve1", "source_vmid": 100, "target_node": "pve1", "source_storages": ["ceph"], "vmid": 9000,
+                        "name": "weblab-tpl-0-9000", "description": "Lab: WebLab clone | Instance: 9", "tags": "lab-WebLab.9;labrole-clone"}),
+        ("add:{}".format(vmid), {"node": vm["node"], "vmid": vmid, "name": vm["config"]["name"], "description": "Lab: WebLab added | Instance: 9",
+                                 "tags": "lab-WebLab.9;labrole-added", "original_description": "", "original_net0": vm["config"]["net0"],
+                                 "original_tags": "", "original_status": "stopped"}),
+    ])
+    journal.step("vnet", status="done")
+    return journal
+
+def test_rollback_leaves_steps_that_never_ran_pending(cluster):
+    vmid = _running_vm(cluster)
+    journal = _instantiation(cluster, vmid)
+
+    result = rollback_instantiate(get_proxmox_connection(), journal)
+
+    assert result["errors"] == []
+    assert result["restored_vms"] == []
+    assert cluster.vms[vmid]["status"] == "running"
+    statuses = {step["key"]: step["status"] for step in journal.load()[1]}
+    assert statuses == {"vnet": "rolled_back", "clone:9000": "pending", "add:{}".format(vmid): "pending"}
+
+def test_resume_adds_vm_with_its_full_config(cluster, monkeypatch):
+    vmid = _running_vm(cluster)
+    journal = _instantiation(cluster, vmid)
+    journal.step("clone:9000", status="done")
+    configs = []
+    def provision_existing(proxmox, node_name, vm_id, vm_name, config, *args, **kwargs):
+        configs.append(config)
+        return {"name": vm_name, "id": vm_id}
+    monkeypatch.setattr(journal_module, "provision_existing", provision_existing)
+
+    result = resume_instantiate(get_proxmox_connection(), journal)
+
+    assert result["errors"] == []
+    assert configs == [cluster.vms[vmid]["config"]]
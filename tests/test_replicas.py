@@ -0,0 +1,55 @@
+import re
+import pytest
+from app.core.proxmox import get_proxmox_connection
+
+CLONE_PATH = re.compile(r"/nodes/[^/]+/qemu/(\d+)/clone$")
+
+@pytest.fixture
+def replica(client, cluster):
+    """Replicates template 100 to the second node and returns the replica's VMID."""
+    response = client.post("/templates/replicas", json={"template_ids": [100], "targets": [{"node": "pve2", "storage": "ceph"}]})
+    assert response.status_code == 200, response.text
+    created = response.json()["created"]
+    assert len(created) == 1
+    return created[0]["replica"]
+
+@pytest.fixture
+def cloned_sources(cluster, monkeypatch):
+    """VMIDs the simulated cluster is asked to clone from, in call order."""
+    sources = []
+    handle = cluster.handle
+    def recording_handle(method, path, data=None):
+        match = CLONE_PATH.search(path)
+        if method == "POST" and match:
+            sources.append(int(match.group(1)))
+        return handle(method, path, data)
+    monkeypatch.setattr(cluster, "handle", recording_handle)
+    return sources
+
+@pytest.mark.parametrize("method, path, body", [
+    ("POST", "/clone_templates", None),
+    ("POST", "/labs/create", {"lab_name": "replica-test"}),
+    ("POST", "/labs/create_vlan_lab", {"zone": "labzone", "tag": 321}),
+])
+def test_clone_every_template_skips_replicas(client, cluster, replica, cloned_sources, no_sleep, method, path, body):
+    templates = {vmid for vmid, vm in cluster.vms.items() if vm["config"].get("template")}
+    assert replica in templates
+
+    response = client.request(method, path, json=body)
+
+    assert response.status_code == 200, response.text
+    assert replica not in cloned_sources
+    assert sorted(cloned_sources) == sorted(templates - {replica})
+
+def test_replica_is_stale_only_after_edits_it_does_not_reflect(client, replica):
+    def stale():
+        response = client.get("/templates/replicas")
+        assert response.status_code == 200, response.text
+        return {entry["replica"]: entry["stale"] for entry in response.json()}[replica]
+
+    assert not stale()
+    response = client.put("/templates/100/tag", json={"lab_groups": ["WebLab", "ADLab"]})
+    assert response.status_code == 200, response.text
+    assert not stale()
+    get_proxmox_connection().nodes("pve1").qemu(100).config.put(memory=8192)
+    assert stale()
@@ -0,0 +1,45 @@
+import re
+from app.core.inventory import cluster_resources
+from app.core.proxmox import get_proxmox_connection
+from app.core.vm_index import VmIndex
+
+CONFIG_PATH = re.compile(r"/nodes/[^/]+/qemu/(\d+)/config$")
+
+def _count_config_reads(cluster, monkeypatch) -> list:
+    reads = []
+    handle = cluster.handle
+    def counting_handle(method, path, data=None):
+        match = CONFIG_PATH.search(path)
+        if method == "GET" and match:
+            reads.append(int(match.group(1)))
+        return handle(method, path, data)
+    monkeypatch.setattr(cluster, "handle", counting_handle)
+    return reads
+
+def test_bridge_query_after_invalidate_reads_only_changed_vms(cluster, monkeypatch):
+    proxmox = get_proxmox_connection()
+    index = VmIndex()
+    reads = _count_config_reads(cluster, monkeypatch)
+    on_vmbr0 = index.query(proxmox, bridge="vmbr0")
+    assert len(reads) == len(cluster.vms)
+
+    vm = next(vm for vm in on_vmbr0 if "net1" not in cluster.vms[vm['vmid']]["config"])
+    changed = vm['vmid']
+    proxmox.nodes(vm['node']).qemu(changed).config.put(tags="moved", net0="virtio=AA:BB:CC:DD:EE:FF,bridge=vmbr9")
+    cluster_resources.invalidate()
+    reads.clear()
+
+    assert changed not in {vm['vmid'] for vm in index.query(proxmox, bridge="vmbr0")}
+    assert [vm['vmid'] for vm in index.query(proxmox, bridge="vmbr9")] == [changed]
+    assert reads == [changed]
+
+def test_stale_configs_are_refreshed_in_batches(cluster, monkeypatch):
+    proxmox = get_proxmox_connection()
+    index = VmIndex(config_max_age=0, refresh_batch=3)
+    reads = _count_config_reads(cluster, monkeypatch)
+    index.query(proxmox, bridge="vmbr0")
+    reads.clear()
+
+    index.query(proxmox, bridge="vmbr0")
+
+    assert len(reads) == 3